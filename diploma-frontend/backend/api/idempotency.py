@@ -0,0 +1,182 @@
+"""
+Ключи идемпотентности для POST-эндпоинтов с побочными эффектами
+(создание заказа, оформление, оплата).
+
+Клиент передает в заголовке Idempotency-Key уникальное значение для
+каждой операции и повторяет его при повторной отправке. Первый запрос
+с ключом занимает его вставкой строки IdempotencyKey с уникальным
+полем key: из одновременных запросов вставка удается одному, в каком бы
+процессе они ни выполнялись. Он выполняется, его результат (код ответа
+и данные) сохраняется в той же строке на TTL секунд. Повтор с тем же
+ключом получает сохраненный ответ одним чтением строки, без повторного
+выполнения, с заголовком Idempotent-Replayed: true. Устаревшие строки
+удаляются после каждого выполненного запроса.
+
+- Ключ действует в пределах пользователя (или сессии) и эндпоинта
+  с параметрами адреса.
+- Пока первый запрос выполняется (не дольше LOCK_TIMEOUT секунд),
+  повтор получает 409 с Retry-After.
+- Повтор ключа с другим телом запроса получает 422.
+- Ответы 5xx и исключения не сохраняются: ключ освобождается, и запрос
+  можно повторить.
+- Запросы без заголовка обрабатываются как раньше.
+"""
+import datetime
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.http.request import RawPostDataException
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from api import metrics
+
+from .models import IdempotencyKey
+
+DEFAULT_IDEMPOTENCY = {
+    "ENABLED": True,
+    "HEADER": "Idempotency-Key",
+    # сколько секунд хранится результат
+    "TTL": 24 * 60 * 60,
+    # сколько секунд ключ считается занятым выполняющимся запросом
+    "LOCK_TIMEOUT": 30,
+    "MAX_KEY_LENGTH": 255,
+}
+
+
+def get_config():
+    return {**DEFAULT_IDEMPOTENCY, **getattr(settings, "IDEMPOTENCY", {})}
+
+
+def _scope(request):
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    session_key = request.session.session_key
+    return f"session:{session_key}" if session_key else "anonymous"
+
+
+def _store_key(name, request, kwargs, key):
+    raw = repr((_scope(request), sorted(kwargs.items()), key)).encode()
+    return f"{name}:{hashlib.sha1(raw).hexdigest()}"
+
+
+def _fingerprint(request):
+    try:
+        body = request.body
+    except RawPostDataException:
+        # тело уже разобрано DRF
+        body = repr(sorted(request.data.items())).encode()
+    return hashlib.sha1(body).hexdigest()
+
+
+def _freeze(response):
+    """
+    Поля IdempotencyKey с результатом запроса
+    """
+    if isinstance(response, Response):
+        content = json.dumps(response.data, cls=JSONEncoder, ensure_ascii=False).encode()
+        return {"content": content, "content_type": ""}
+    return {"content": response.content, "content_type": response["Content-Type"]}
+
+
+def _replay(record):
+    content = bytes(record.content)
+    if not record.content_type:
+        response = Response(json.loads(content), status=record.status)
+    else:
+        response = HttpResponse(content, status=record.status, content_type=record.content_type)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _claim(store_key, fingerprint, config):
+    """
+    Занимает ключ вставкой строки. Возвращает (занятая строка, None) или
+    (None, строка ключа, занятого раньше).
+    """
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(key=store_key).first()
+    if record is not None and record.expires_at <= now:
+        # результат устарел или запрос не завершился за LOCK_TIMEOUT;
+        # условие по сроку не даст удалить ключ, занятый заново
+        IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).delete()
+        record = None
+    if record is not None:
+        return None, record
+    try:
+        with transaction.atomic():
+            claimed = IdempotencyKey.objects.create(
+                key=store_key,
+                fingerprint=fingerprint,
+                expires_at=now + datetime.timedelta(seconds=config["LOCK_TIMEOUT"]),
+            )
+    except IntegrityError:
+        # ключ занял одновременный запрос
+        record = IdempotencyKey.objects.filter(key=store_key).first()
+        return None, record or IdempotencyKey(fingerprint=fingerprint)
+    return claimed, None
+
+
+def _record(name, result):
+    metrics.inc("idempotency_requests_total", endpoint=name, result=result)
+
+
+def idempotent(name):
+    """
+    Декоратор обработчика POST вьюхи: запросы с заголовком Idempotency-Key
+    выполняются не более одного раза, повторы получают сохраненный ответ
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            config = get_config()
+            key = request.headers.get(config["HEADER"])
+            if not config["ENABLED"] or key is None:
+                return handler(view, request, *args, **kwargs)
+            if not key or len(key) > config["MAX_KEY_LENGTH"]:
+                return Response(
+                    {"error": f"{config['HEADER']} должен содержать от 1 до {config['MAX_KEY_LENGTH']} символов"},
+                    status=400,
+                )
+
+            store_key = _store_key(name, request, kwargs, key)
+            fingerprint = _fingerprint(request)
+            claimed, record = _claim(store_key, fingerprint, config)
+            if record is not None:
+                if record.fingerprint != fingerprint:
+                    _record(name, "mismatch")
+                    return Response(
+                        {"error": f"{config['HEADER']} уже использован для другого запроса"}, status=422
+                    )
+                if record.status is None:
+                    _record(name, "conflict")
+                    response = Response({"error": "Запрос с этим ключом еще выполняется"}, status=409)
+                    response["Retry-After"] = "1"
+                    return response
+                _record(name, "replayed")
+                return _replay(record)
+
+            try:
+                response = handler(view, request, *args, **kwargs)
+            except BaseException:
+                IdempotencyKey.objects.filter(pk=claimed.pk).delete()
+                raise
+            if response.status_code >= 500 or response.streaming:
+                IdempotencyKey.objects.filter(pk=claimed.pk).delete()
+                return response
+            now = timezone.now()
+            IdempotencyKey.objects.filter(pk=claimed.pk).update(
+                status=response.status_code,
+                expires_at=now + datetime.timedelta(seconds=config["TTL"]),
+                **_freeze(response),
+            )
+            IdempotencyKey.objects.filter(expires_at__lte=now).delete()
+            _record(name, "executed")
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,221 @@
+"""
+Шина инвалидации кешей в памяти процессов.
+
+Кеши в памяти процесса (LRU кеша ответов, карта тегов, настройки
+магазина) быстрее общих, но изменение, сделанное в одном воркере или на
+одном сервере, остальные увидят только после истечения своих записей.
+Шина доставляет изменения всем процессам, работающим с общей БД:
+
+- publish(*topics) вызывается при изменении данных (invalidate() кешей,
+  сигналы моделей). После фиксации транзакции темы копятся в памяти
+  и записываются одной строкой InvalidationEvent через COALESCE_WINDOW
+  секунд после первой из них: массовое изменение (импорт товаров, пачка
+  сохранений в админке) дает одно событие, а не тысячи.
+- Каждый процесс не чаще раза в POLL_INTERVAL секунд перед обработкой
+  запроса (InvalidationMiddleware) одним запросом по индексу created_at
+  читает события, созданные не раньше чем за REREAD_WINDOW секунд до
+  последнего прочитанного, и вызывает подписчиков (subscribe) один раз
+  с объединением тем тех из них, которых еще не видел. Порядку первичных
+  ключей здесь доверять нельзя: при одновременной записи событие
+  с меньшим id может быть зафиксировано позже события с большим, и чтение
+  "id больше последнего" пропустило бы его навсегда. Повторное чтение
+  окна находит такие события, если запись была зафиксирована не позже
+  чем через REREAD_WINDOW секунд после создания (с учетом расхождения
+  часов серверов).
+
+Запрос, начатый позже чем через COALESCE_WINDOW + POLL_INTERVAL секунд
+после фиксации изменения, уже не увидит сброшенных им записей. События
+старше RETENTION секунд удаляются при записи новых; RETENTION должен быть
+больше времени жизни записей кешей в памяти.
+"""
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DatabaseError, close_old_connections, transaction
+from django.utils import timezone
+
+from api import metrics
+
+from .models import InvalidationEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INVALIDATION = {
+    "ENABLED": True,
+    # как часто процесс читает новые события, с
+    "POLL_INTERVAL": 1,
+    # сколько секунд темы копятся перед записью события
+    "COALESCE_WINDOW": 0.2,
+    "RETENTION": 60 * 60,
+    # события, созданные за столько секунд до последнего прочитанного,
+    # читаются повторно
+    "REREAD_WINDOW": 10,
+}
+
+_config = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        _config = {**DEFAULT_INVALIDATION, **getattr(settings, "INVALIDATION", {})}
+    return _config
+
+
+def _reset_config(setting, **kwargs):
+    global _config
+    if setting == "INVALIDATION":
+        _config = None
+
+
+setting_changed.connect(_reset_config)
+
+_subscribers = []
+
+
+def subscribe(handler):
+    """
+    Регистрирует handler(topics) - он получает frozenset тем новых событий.
+    Можно использовать как декоратор.
+    """
+    _subscribers.append(handler)
+    return handler
+
+
+_pending = set()
+_pending_lock = threading.Lock()
+_timer = None
+
+
+def publish(*topics):
+    """
+    Отправляет темы topics всем процессам после фиксации текущей транзакции
+    """
+    if not topics or not get_config()["ENABLED"]:
+        return
+    topics = frozenset(topics)
+    transaction.on_commit(lambda: _enqueue(topics))
+
+
+def _enqueue(topics):
+    global _timer
+    with _pending_lock:
+        _pending.update(topics)
+        if _timer is None:
+            # не фоновый поток: процесс дождется записи перед выходом
+            _timer = threading.Timer(get_config()["COALESCE_WINDOW"], _write_pending)
+            _timer.start()
+
+
+def _write_pending():
+    global _timer
+    with _pending_lock:
+        topics = set(_pending)
+        _pending.clear()
+        _timer = None
+    if not topics:
+        return
+    try:
+        write_event(topics)
+    except DatabaseError:
+        logger.exception("Не удалось записать событие инвалидации, повтор")
+        _enqueue(topics)
+    finally:
+        close_old_connections()
+
+
+def flush():
+    """
+    Записывает накопленные темы сразу, не дожидаясь COALESCE_WINDOW
+    """
+    with _pending_lock:
+        if _timer is not None:
+            _timer.cancel()
+    _write_pending()
+
+
+def write_event(topics):
+    InvalidationEvent.objects.create(topics=" ".join(sorted(topics)))
+    deadline = timezone.now() - datetime.timedelta(seconds=get_config()["RETENTION"])
+    InvalidationEvent.objects.filter(created_at__lt=deadline).delete()
+    metrics.inc("invalidation_events_published_total")
+
+
+# прочитанные события окна REREAD_WINDOW: {id: created_at}
+_seen = None
+# created_at последнего прочитанного события
+_last_seen = None
+_polled_at = 0.0
+_poll_lock = threading.Lock()
+
+
+def poll(force=False):
+    """
+    Читает новые события и вызывает подписчиков, если с прошлого чтения
+    прошло POLL_INTERVAL секунд (или force). Возвращает полученные темы.
+    """
+    global _seen, _last_seen, _polled_at
+    config = get_config()
+    if not config["ENABLED"]:
+        return frozenset()
+    if not force and time.monotonic() - _polled_at < config["POLL_INTERVAL"]:
+        return frozenset()
+    # остальные потоки ждут, пока кеши будут сброшены
+    with _poll_lock:
+        if not force and time.monotonic() - _polled_at < config["POLL_INTERVAL"]:
+            return frozenset()
+        _polled_at = time.monotonic()
+        window = datetime.timedelta(seconds=config["REREAD_WINDOW"])
+        try:
+            if _seen is None:
+                # кеши нового процесса пусты, прежние события ему не нужны
+                _last_seen = timezone.now()
+                _seen = dict(
+                    InvalidationEvent.objects.filter(created_at__gte=_last_seen - window)
+                    .values_list("pk", "created_at")
+                )
+                _last_seen = max([_last_seen, *_seen.values()])
+                return frozenset()
+            rows = list(
+                InvalidationEvent.objects.filter(created_at__gte=_last_seen - window).order_by("pk")
+                .values_list("pk", "topics", "created_at")
+            )
+        except DatabaseError:
+            # запрос обслуживается, кеши сбросятся при следующем чтении
+            logger.exception("Не удалось прочитать события инвалидации")
+            return frozenset()
+        rows = [row for row in rows if row[0] not in _seen]
+        if not rows:
+            return frozenset()
+        for pk, _, created_at in rows:
+            _seen[pk] = created_at
+        _last_seen = max(_last_seen, *(created_at for _, _, created_at in rows))
+        _seen = {pk: created_at for pk, created_at in _seen.items() if created_at >= _last_seen - window}
+        topics = frozenset(topic for _, line, _ in rows for topic in line.split())
+        metrics.inc("invalidation_events_received_total", len(rows))
+        metrics.observe(
+            "invalidation_lag_seconds",
+            (timezone.now() - min(created_at for _, _, created_at in rows)).total_seconds(),
+        )
+        for handler in _subscribers:
+            try:
+                handler(topics)
+            except Exception:
+                logger.exception("Ошибка подписчика шины инвалидации %r", handler)
+        return topics
+
+
+class InvalidationMiddleware:
+    """
+    Перед обработкой запроса сбрасывает кеши процесса по новым событиям шины
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        poll()
+        return self.get_response(request)
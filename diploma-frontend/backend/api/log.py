@@ -0,0 +1,173 @@
+"""
+Структурированные логи запросов.
+
+RequestLogMiddleware присваивает каждому запросу идентификатор (берется
+из заголовка X-Request-ID, если его передал балансировщик, иначе
+генерируется) и возвращает его в том же заголовке ответа. По окончании
+запроса в логгер api.requests пишется одна запись: метод, путь, вьюха,
+статус, общее время и время запросов к БД.
+
+RequestContextFilter добавляет к каждой записи, сделанной во время
+запроса, идентификатор запроса, имя вьюхи и id пользователя, а
+JsonFormatter выводит запись одной строкой JSON. QueueStreamHandler
+только кладет запись в очередь, вывод выполняет отдельный поток, поэтому
+медленный stdout не задерживает обработку запросов; при переполнении
+очереди записи отбрасываются.
+"""
+import contextvars
+import datetime
+import json
+import logging
+import queue
+import re
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("api.requests")
+
+REQUEST_ID_HEADER = "HTTP_X_REQUEST_ID"
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+# атрибуты LogRecord, которые есть у любой записи; остальные - поля из extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Добавляет к записи request_id, view и user_id текущего запроса
+    """
+    def filter(self, record):
+        request = _current_request.get()
+        if request is not None:
+            record.request_id = getattr(request, "request_id", None)
+            record.view = getattr(request, "view_name", None)
+            # пользователь берется, только если уже загружен - запись
+            # в лог не должна сама обращаться к сессии и БД
+            user = getattr(request, "_cached_user", None)
+            record.user_id = user.pk if user is not None and user.is_authenticated else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Запись лога одной строкой JSON, включая поля, переданные через extra
+    """
+    def format(self, record):
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueueStreamHandler(QueueHandler):
+    """
+    Неблокирующий обработчик: запись форматируется в потоке запроса
+    и передается в очередь, в поток stream ее пишет QueueListener
+    """
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, logging.StreamHandler(stream))
+        self.listener.start()
+        self.stopped = False
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # вызывается и при перенастройке логирования, и в logging.shutdown при выходе;
+        # stop() дописывает оставшиеся в очереди записи
+        if not self.stopped:
+            self.stopped = True
+            self.listener.stop()
+        super().close()
+
+
+class _QueryTimer:
+    """
+    Суммирует время и количество запросов к БД (connection.execute_wrapper)
+    """
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+def _request_id(request):
+    request_id = request.META.get(REQUEST_ID_HEADER, "")
+    if REQUEST_ID_PATTERN.match(request_id):
+        return request_id
+    return uuid.uuid4().hex
+
+
+class RequestLogMiddleware:
+    """
+    Идентификатор запроса и итоговая запись о запросе в api.requests.
+    Запросы дольше settings.SLOW_REQUEST_MS пишутся с уровнем WARNING.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.request_id = _request_id(request)
+        request.view_name = None
+        token = _current_request.set(request)
+        timer = _QueryTimer()
+        started = time.perf_counter()
+        try:
+            with connections["default"].execute_wrapper(timer):
+                response = self.get_response(request)
+            response["X-Request-ID"] = request.request_id
+            self.log(request, response.status_code, started, timer)
+            return response
+        except Exception:
+            self.log(request, 500, started, timer)
+            raise
+        finally:
+            _current_request.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, "view_class", view_func)
+        request.view_name = f"{view.__module__}.{view.__name__}"
+
+    @staticmethod
+    def log(request, status, started, timer):
+        latency_ms = (time.perf_counter() - started) * 1000
+        slow = latency_ms >= getattr(settings, "SLOW_REQUEST_MS", 1000)
+        logger.log(
+            logging.WARNING if slow else logging.INFO,
+            "%s %s %s", request.method, request.path, status,
+            extra={
+                "method": request.method,
+                "path": request.path,
+                "status": status,
+                "latency_ms": round(latency_ms, 2),
+                "db_ms": round(timer.seconds * 1000, 2),
+                "db_queries": timer.queries,
+            },
+        )
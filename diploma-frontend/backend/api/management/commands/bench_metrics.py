@@ -0,0 +1,131 @@
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.http import HttpResponse
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import resolve
+
+from api import metrics
+
+from shopapp.models import Product
+
+
+def _metrics_settings(**overrides):
+    return override_settings(METRICS={**metrics.get_config(), **overrides})
+
+
+class Command(BaseCommand):
+    """
+    Доля времени запроса, которую занимает сбор метрик.
+
+    Сначала замеряется среднее время ответа нескольких адресов API и
+    число запросов к БД на ответ с выключенными метриками. Затем отдельно
+    замеряется стоимость MetricsMiddleware (вокруг ответа, который ничего
+    не делает) и обертки одного запроса к БД. Накладные расходы на запрос -
+    стоимость middleware плюс стоимость обертки на каждый запрос к БД;
+    команда завершается ошибкой, если их доля больше --max-overhead.
+    Для сверки выводится и прямое сравнение времени ответа, но на
+    коротких замерах его заметно искажает шум.
+    """
+    help = "Накладные расходы метрик Prometheus на запрос"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Запросов к каждому адресу")
+        parser.add_argument("--iterations", type=int, default=20000, help="Вызовов в микрозамерах")
+        parser.add_argument("--max-overhead", type=float, default=0.01)
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1 or options["iterations"] < 1:
+            raise CommandError("--requests и --iterations должны быть положительными")
+        product = Product.objects.order_by("pk").first()
+        if product is None:
+            raise CommandError("Нужен хотя бы один товар")
+        urls = ["/api/catalog", "/api/tags", "/api/products/popular", f"/api/product/{product.pk}"]
+
+        with _metrics_settings(ENABLED=False):
+            request_time, queries = self.measure_requests(urls, options["requests"])
+        with _metrics_settings(ENABLED=True, DIR=None):
+            enabled_time, _ = self.measure_requests(urls, options["requests"])
+            middleware_cost = self.measure_middleware(options["iterations"])
+            query_cost = self.measure_query_wrapper(options["iterations"])
+        with tempfile.TemporaryDirectory() as directory, _metrics_settings(DIR=directory):
+            flush_cost = self.measure_flush()
+
+        overhead = middleware_cost + queries * query_cost
+        fraction = overhead / request_time
+        self.stdout.write(f"ответ без метрик:         {request_time * 1000:8.3f} мс, запросов к БД {queries:.1f}")
+        self.stdout.write(f"ответ с метриками:        {enabled_time * 1000:8.3f} мс")
+        self.stdout.write(f"middleware:               {middleware_cost * 1e6:8.2f} мкс")
+        self.stdout.write(f"обертка запроса к БД:     {query_cost * 1e6:8.2f} мкс")
+        self.stdout.write(f"запись файла процесса:    {flush_cost * 1e6:8.2f} мкс (раз в FLUSH_INTERVAL)")
+        self.stdout.write(
+            f"накладные расходы:        {overhead * 1e6:8.2f} мкс, {fraction:.3%} времени ответа "
+            f"(допустимо {options['max_overhead']:.3%})"
+        )
+        if fraction > options["max_overhead"]:
+            raise CommandError("Накладные расходы метрик превышают допустимую долю")
+
+    @staticmethod
+    def measure_requests(urls, count):
+        """
+        Среднее время ответа и среднее число запросов к БД на ответ
+        """
+        client = Client(HTTP_HOST="localhost")
+        for url in urls:
+            client.get(url)
+        durations, queries = [], []
+        for url in urls:
+            for _ in range(count):
+                counter = metrics._QueryCounter()
+                with connections["default"].execute_wrapper(counter):
+                    started = time.perf_counter()
+                    client.get(url)
+                    durations.append(time.perf_counter() - started)
+                queries.append(counter.queries)
+        return statistics.mean(durations), statistics.mean(queries)
+
+    @staticmethod
+    def measure_middleware(iterations):
+        """
+        Время одного прохода MetricsMiddleware, с
+        """
+        response = HttpResponse()
+        middleware = metrics.MetricsMiddleware(lambda request: response)
+        request = RequestFactory().get("/api/catalog")
+        request.resolver_match = resolve("/api/catalog")
+        started = time.perf_counter()
+        for _ in range(iterations):
+            middleware(request)
+        return (time.perf_counter() - started) / iterations
+
+    @staticmethod
+    def measure_query_wrapper(iterations):
+        """
+        Дополнительное время одного запроса к БД из-за обертки, с
+        """
+        def execute(sql, params, many, context):
+            return None
+
+        counter = metrics._QueryCounter()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            counter(execute, "", (), False, {})
+        wrapped = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(iterations):
+            execute("", (), False, {})
+        return max(0.0, wrapped - (time.perf_counter() - started)) / iterations
+
+    @staticmethod
+    def measure_flush(rounds=20):
+        """
+        Время записи значений процесса в файл, с
+        """
+        started = time.perf_counter()
+        for _ in range(rounds):
+            metrics.flush()
+        return (time.perf_counter() - started) / rounds
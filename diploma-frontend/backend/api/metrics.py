@@ -0,0 +1,458 @@
+"""
+Метрики в формате Prometheus (/metrics).
+
+Счетчики и гистограммы хранятся в памяти процесса, у каждого потока
+свой набор значений: запись не берет блокировок, а при выдаче метрик
+наборы потоков складываются. Наборы завершившихся потоков (поток на
+соединение runserver, таймеры шины инвалидации) переносятся в общий
+набор процесса при появлении нового потока и при выдаче, так что число
+наборов не превышает числа живых потоков. MetricsMiddleware измеряет
+время ответа по имени маршрута (url_name) и число запросов к БД,
+остальные метрики (кеши, корзина, заказы, оплаты) записываются вызовами
+inc() в коде.
+
+Под gunicorn у каждого воркера свои значения, а запрос /metrics попадает
+в один из них. Если задан METRICS["DIR"], каждый процесс не чаще раза
+в FLUSH_INTERVAL секунд (и при выходе) записывает свои значения в
+собственный файл этого каталога, а /metrics складывает все файлы.
+Значения завершившихся процессов, чтобы счетчики не уменьшались после
+перезапуска воркера, переносятся при выдаче в общий файл RETIRED_FILE,
+а их файлы удаляются; metrics_processes - число живых процессов.
+Каталог очищается при деплое.
+"""
+import atexit
+import bisect
+import fcntl
+import glob
+import json
+import math
+import os
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+
+DEFAULT_METRICS = {
+    "ENABLED": True,
+    # каталог файлов процессов; None - метрики только текущего процесса
+    "DIR": None,
+    "FLUSH_INTERVAL": 5,
+    # границы гистограммы времени ответа, с
+    "BUCKETS": [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    # /metrics доступен с этих адресов и администраторам
+    "ALLOWED_IPS": ["127.0.0.1", "::1"],
+}
+
+# имя -> (тип, описание); выводятся только описанные здесь метрики
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Время ответа по маршруту"),
+    "db_queries_total": ("counter", "Запросы к БД по маршруту"),
+    "cache_requests_total": ("counter", "Обращения к кешам: result=hit|miss"),
+    "cache_hit_ratio": ("gauge", "Доля попаданий в кеш"),
+    "idempotency_requests_total": ("counter", "Запросы с ключом идемпотентности: result=executed|replayed|conflict|mismatch"),
+    "invalidation_events_published_total": ("counter", "Записанные события шины инвалидации"),
+    "invalidation_events_received_total": ("counter", "Прочитанные процессом события шины инвалидации"),
+    "invalidation_lag_seconds": ("histogram", "Задержка от записи события до его чтения процессом"),
+    "shop_basket_operations_total": ("counter", "Изменения корзины: operation=add|remove"),
+    "shop_orders_created_total": ("counter", "Созданные заказы"),
+    "shop_payments_total": ("counter", "Оплаты заказов: result=succeeded|failed"),
+    "shop_stock_outs_total": ("counter", "Товар закончился: при добавлении в корзину или после оплаты"),
+    "shop_sale_transitions_total": ("counter", "Начавшиеся и закончившиеся распродажи: kind=activated|expired"),
+    "shop_sale_transition_seconds": ("histogram", "Время пересчета цен на границе дня"),
+    "shop_product_views_total": ("counter", "Просмотры карточек товаров"),
+    "shop_product_views_flush_seconds": ("histogram", "Время записи накопленных просмотров"),
+    "metrics_processes": ("gauge", "Процессы, значения которых сложены в ответе"),
+}
+
+_config = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        _config = {**DEFAULT_METRICS, **getattr(settings, "METRICS", {})}
+    return _config
+
+
+def _reset_config(setting, **kwargs):
+    global _config
+    if setting == "METRICS":
+        _config = None
+
+
+setting_changed.connect(_reset_config)
+
+
+class _Shard:
+    """
+    Значения одного потока. Пишет в них только этот поток
+    """
+    def __init__(self, thread=None):
+        self.counters = {}
+        # ключ -> [счетчики по корзинам..., +Inf, сумма]
+        self.histograms = {}
+        self.thread = weakref.ref(thread) if thread is not None else None
+
+    def alive(self):
+        thread = self.thread()
+        return thread is not None and thread.is_alive()
+
+    def merge(self, other):
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, row in other.histograms.items():
+            total = self.histograms.setdefault(key, [0] * len(row))
+            for i, value in enumerate(row):
+                total[i] += value
+
+
+_local = threading.local()
+_shards = []
+# значения завершившихся потоков; меняется только под _shards_lock
+_retired = _Shard()
+_shards_lock = threading.Lock()
+
+
+def _retire_dead_shards():
+    """
+    Переносит значения завершившихся потоков в _retired. Вызывается под
+    _shards_lock; завершившийся поток в свой набор уже не пишет.
+    """
+    alive = []
+    for shard in _shards:
+        if shard.alive():
+            alive.append(shard)
+        else:
+            _retired.merge(shard)
+    _shards[:] = alive
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = _Shard(threading.current_thread())
+        with _shards_lock:
+            _retire_dead_shards()
+            _shards.append(shard)
+        return shard
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def inc(name, value=1, **labels):
+    """
+    Увеличивает счетчик name с метками labels
+    """
+    if not get_config()["ENABLED"]:
+        return
+    counters = _shard().counters
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """
+    Добавляет значение value в гистограмму name с метками labels
+    """
+    config = get_config()
+    if not config["ENABLED"]:
+        return
+    buckets = config["BUCKETS"]
+    histograms = _shard().histograms
+    key = _key(name, labels)
+    row = histograms.get(key)
+    if row is None:
+        row = histograms[key] = [0] * (len(buckets) + 2)
+    row[bisect.bisect_left(buckets, value)] += 1
+    row[-1] += value
+
+
+def snapshot():
+    """
+    Значения текущего процесса: {"counters": [[имя, метки, значение]],
+    "histograms": [[имя, метки, границы, счетчики, сумма]]}
+    """
+    buckets = list(get_config()["BUCKETS"])
+    with _shards_lock:
+        _retire_dead_shards()
+        # _retired меняется только под блокировкой, копируется здесь же
+        shards = [_Shard(), *_shards]
+        shards[0].merge(_retired)
+    counters, histograms = {}, {}
+    for shard in shards:
+        # копия словаря делается без переключения потоков
+        for key, value in dict(shard.counters).items():
+            counters[key] = counters.get(key, 0) + value
+        for key, row in dict(shard.histograms).items():
+            total = histograms.setdefault(key, [0] * len(row))
+            for i, value in enumerate(list(row)):
+                total[i] += value
+    return {
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [
+            [name, list(labels), buckets, row[:-1], row[-1]]
+            for (name, labels), row in histograms.items()
+        ],
+    }
+
+
+RETIRED_FILE = "retired.json"
+LOCK_FILE = ".lock"
+
+_process = None
+_flushed_at = 0.0
+_flush_lock = threading.Lock()
+
+
+def _process_file(directory):
+    """
+    Файл текущего процесса; после fork у воркера будет свой
+    """
+    global _process
+    pid = os.getpid()
+    if _process is None or _process[0] != pid:
+        _process = (pid, f"{pid}-{time.time_ns()}.json")
+    return os.path.join(directory, _process[1])
+
+
+def flush():
+    """
+    Записывает значения процесса в его файл каталога METRICS["DIR"]
+    """
+    global _flushed_at
+    directory = get_config()["DIR"]
+    if not directory or not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = _process_file(directory)
+        with open(path + ".tmp", "w") as file:
+            json.dump(snapshot(), file)
+        os.replace(path + ".tmp", path)
+        _flushed_at = time.monotonic()
+    finally:
+        _flush_lock.release()
+
+
+def maybe_flush():
+    config = get_config()
+    if config["DIR"] and time.monotonic() - _flushed_at >= config["FLUSH_INTERVAL"]:
+        flush()
+
+
+atexit.register(flush)
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        # файл удален или дописывается при очистке каталога
+        return None
+
+
+def _combine(snapshots):
+    """
+    Сумма значений нескольких снимков в формате snapshot()
+    """
+    counters, histograms = {}, {}
+    for data in snapshots:
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, counts, total in data["histograms"]:
+            key = (name, tuple(map(tuple, labels)), tuple(buckets))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0])
+            for i, value in enumerate(counts):
+                merged[0][i] += value
+            merged[1] += total
+    return {
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [
+            [name, list(labels), list(buckets), counts, total]
+            for (name, labels, buckets), (counts, total) in histograms.items()
+        ],
+    }
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _retire_dead_processes(directory):
+    """
+    Переносит значения завершившихся процессов в RETIRED_FILE и удаляет
+    их файлы. Процессы, выдающие метрики одновременно, переносят файлы
+    по очереди под блокировкой LOCK_FILE.
+    """
+    dead = []
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        name = os.path.basename(path)
+        pid = name.split("-", 1)[0]
+        if name != RETIRED_FILE and pid.isdigit() and not _pid_alive(int(pid)):
+            dead.append(path)
+    if not dead:
+        return
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # файлы мог перенести процесс, ждавший блокировку раньше
+        snapshots = [data for data in map(_read, [retired_path, *dead]) if data is not None]
+        if len(snapshots) == (1 if os.path.exists(retired_path) else 0):
+            return
+        with open(retired_path + ".tmp", "w") as file:
+            json.dump(_combine(snapshots), file)
+        os.replace(retired_path + ".tmp", retired_path)
+        for path in dead:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def collect():
+    """
+    Значения всех процессов (или только текущего без METRICS["DIR"])
+    и число живых процессов
+    """
+    directory = get_config()["DIR"]
+    if not directory:
+        return [snapshot()], 1
+    flush()
+    _retire_dead_processes(directory)
+    snapshots, processes = [], 0
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        data = _read(path)
+        if data is None:
+            continue
+        snapshots.append(data)
+        processes += os.path.basename(path) != RETIRED_FILE
+    return snapshots, processes
+
+
+def _labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """
+    Текст ответа /metrics в формате Prometheus
+    """
+    snapshots, processes = collect()
+    combined = _combine(snapshots)
+    counters = {
+        (name, tuple(map(tuple, labels))): value for name, labels, value in combined["counters"]
+    }
+    histograms = {
+        (name, tuple(map(tuple, labels)), tuple(buckets)): [counts, total]
+        for name, labels, buckets, counts, total in combined["histograms"]
+    }
+
+    # доля попаданий по каждому кешу
+    gauges = {("metrics_processes", ()): processes}
+    cache_totals = {}
+    for (name, labels), value in counters.items():
+        if name == "cache_requests_total":
+            labels = dict(labels)
+            hits, total = cache_totals.get(labels["cache"], (0, 0))
+            hits += value if labels["result"] == "hit" else 0
+            cache_totals[labels["cache"]] = (hits, total + value)
+    for cache, (hits, total) in cache_totals.items():
+        gauges[("cache_hit_ratio", (("cache", cache),))] = hits / total if total else 0.0
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        if kind == "histogram":
+            series = sorted(item for item in histograms.items() if item[0][0] == name)
+        else:
+            source = counters if kind == "counter" else gauges
+            series = sorted(item for item in source.items() if item[0][0] == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key, value in series:
+            labels = key[1]
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip([*key[2], math.inf], counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def _route(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        # не найденные адреса не размножают серии
+        return "unmatched"
+    return match.url_name or match.route
+
+
+class MetricsMiddleware:
+    """
+    Время ответа и число запросов к БД по имени маршрута
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_config()["ENABLED"]:
+            return self.get_response(request)
+        counter = _QueryCounter()
+        status = 500
+        started = time.perf_counter()
+        try:
+            with connections["default"].execute_wrapper(counter):
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            route = _route(request)
+            observe(
+                "http_request_duration_seconds", time.perf_counter() - started,
+                route=route, method=request.method, status=f"{status // 100}xx",
+            )
+            if counter.queries:
+                inc("db_queries_total", counter.queries, route=route)
+            maybe_flush()
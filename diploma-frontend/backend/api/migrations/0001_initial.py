@@ -0,0 +1,27 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvalidationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topics', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Событие инвалидации',
+                'verbose_name_plural': 'События инвалидации',
+                'indexes': [models.Index(fields=['created_at'], name='api_invalid_created_88c142_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('status', models.PositiveSmallIntegerField(null=True)),
+                ('content', models.BinaryField(null=True)),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Ключ идемпотентности',
+                'verbose_name_plural': 'Ключи идемпотентности',
+            },
+        ),
+    ]
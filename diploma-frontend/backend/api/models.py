@@ -1 +1,40 @@
 from django.db import models
+
+
+class InvalidationEvent(models.Model):
+    """
+    Событие шины инвалидации (api.invalidation): topics - темы через
+    пробел, изменения которых должны сбросить кеши в памяти процессов
+    """
+    class Meta:
+        verbose_name = "Событие инвалидации"
+        verbose_name_plural = "События инвалидации"
+        indexes = [
+            # удаление устаревших событий
+            models.Index(fields=["created_at"]),
+        ]
+
+    topics = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Ключ идемпотентности (api.idempotency): занимается вставкой строки,
+    уникальность key гарантирует одно выполнение запроса на ключ.
+    Пока status пуст, запрос выполняется.
+    """
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+
+    # эндпоинт и хеш области, параметров адреса и значения заголовка
+    key = models.CharField(max_length=100, unique=True)
+    # хеш тела запроса
+    fingerprint = models.CharField(max_length=40)
+    status = models.PositiveSmallIntegerField(null=True)
+    # пустой content_type - в content данные Response в JSON
+    content = models.BinaryField(null=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    # занятый ключ освобождается через LOCK_TIMEOUT, результат - через TTL
+    expires_at = models.DateTimeField(db_index=True)
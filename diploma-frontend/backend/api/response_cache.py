@@ -0,0 +1,337 @@
+"""
+Кеш ответов GET-эндпоинтов чтения.
+
+Декоратор cache_response оборачивает обработчик вьюхи (get, list,
+retrieve). Ключ строится из имени эндпоинта, параметров адреса и
+нормализованных параметров запроса (порядок параметров и значений не
+важен). Кешируются только ответы 200: данные Response или содержимое
+HttpResponse вместе с заголовками, которые выставила вьюха (например,
+Server-Timing); отрисовка выполняется заново для каждого запроса.
+
+Два уровня: LRU в памяти процесса на LOCAL_TIMEOUT секунд и общий кеш
+CACHES[ALIAS], доступный всем процессам. Запись общего кеша хранит
+время вычисления и после TIMEOUT еще STALE_GRACE секунд отдается
+устаревшей, пока один процесс ее пересчитывает. Пересчет начинается
+немного раньше истечения с вероятностью, растущей к его моменту
+(probabilistic early expiration), так что популярные ключи обычно
+обновляются до истечения. Одновременные промахи по одному ключу
+в процессе ждут одного вычисления, между процессами пересчет
+захватывает блокировку cache.add. Блокировка - на усмотрение бэкенда:
+в FileBasedCache add - это проверка и запись без атомарности, так что
+иногда два процесса пересчитают ключ одновременно. На результат это
+не влияет, только на лишнюю работу.
+
+Инвалидация - по тегам: запись помнит версии своих тегов на момент
+вычисления, invalidate() меняет версии после фиксации транзакции и
+удаляет записи тега из памяти своего процесса. Другие процессы удаляют
+их, получив теги через шину инвалидации (api.invalidation), и в любом
+случае не позже чем через LOCAL_TIMEOUT секунд.
+"""
+import functools
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.response import Response
+
+from api import invalidation, metrics
+
+DEFAULT_RESPONSE_CACHE = {
+    "ENABLED": True,
+    "ALIAS": "default",
+    "TIMEOUT": 60,
+    "LOCAL_TIMEOUT": 5,
+    "LOCAL_MAX_ENTRIES": 1000,
+    # сколько секунд после TIMEOUT запись отдается, пока идет пересчет
+    "STALE_GRACE": 60,
+    # > 1 - досрочный пересчет раньше, 0 - только по истечении
+    "BETA": 1.0,
+    # максимальное время вычисления под блокировкой; столько же ждут другие
+    "LOCK_TIMEOUT": 10,
+}
+
+# версия в префиксе меняется вместе с форматом записей
+KEY_PREFIX = "respcache:2"
+
+
+def get_config():
+    return {**DEFAULT_RESPONSE_CACHE, **getattr(settings, "RESPONSE_CACHE", {})}
+
+
+class Entry(NamedTuple):
+    value: object
+    tags: tuple
+    # версии тегов на момент вычисления
+    versions: tuple
+    expires: float
+    # время вычисления, с
+    delta: float
+
+    def fresh(self, now, beta):
+        """
+        Не истекла и не выбрана для досрочного пересчета
+        """
+        if beta <= 0:
+            return now < self.expires
+        return now - self.delta * beta * math.log(1 - random.random()) < self.expires
+
+
+class LocalCache:
+    """
+    LRU записей в памяти процесса
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, now):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            entry, local_expires = item
+            if now >= local_expires or now >= entry.expires:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry, local_expires, max_entries):
+        with self.lock:
+            self.entries[key] = (entry, local_expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+
+    def drop_tags(self, tags):
+        with self.lock:
+            for key in [key for key, (entry, _) in self.entries.items() if tags & set(entry.tags)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_local = LocalCache()
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+class Uncacheable(Exception):
+    """
+    Результат вычисления не кешируется, но возвращается вызывающему
+    """
+    def __init__(self, value):
+        super().__init__()
+        self.value = value
+
+
+def _tag_key(tag):
+    return f"{KEY_PREFIX}:tag:{tag}"
+
+
+def _shared_lookup(shared, key, tags):
+    """
+    Запись общего кеша, если версии ее тегов не менялись, и текущие версии.
+    Версия тега хранится без срока, но кеш может ее вытеснить (FileBasedCache
+    при MAX_ENTRIES удаляет случайные ключи). Отсутствующая версия заводится
+    заново при чтении, и записи, вычисленные при прежней версии, становятся
+    недействительными; запись без версии тега недействительна всегда.
+    """
+    tag_keys = [_tag_key(tag) for tag in tags]
+    found = shared.get_many([key, *tag_keys])
+    missing = [tag_key for tag_key in tag_keys if found.get(tag_key) is None]
+    if missing:
+        version = time.time_ns()
+        for tag_key in missing:
+            shared.add(tag_key, version, None)
+        found.update(shared.get_many(missing))
+    versions = tuple(found.get(tag_key) for tag_key in tag_keys)
+    entry = found.get(key)
+    if entry is not None and (None in versions or entry.versions != versions):
+        entry = None
+    return entry, versions
+
+
+def _record(name, tier, result):
+    metrics.inc("cache_requests_total", cache="responses", endpoint=name, tier=tier, result=result)
+
+
+def fetch(name, key, tags, compute, timeout=None):
+    """
+    Значение ключа key из кеша или результат compute(). Если compute
+    выбрасывает Uncacheable, его значение возвращается без сохранения.
+    """
+    config = get_config()
+    if not config["ENABLED"]:
+        try:
+            return compute()
+        except Uncacheable as exc:
+            return exc.value
+    now = time.time()
+    entry = _local.get(key, now)
+    if entry is not None:
+        _record(name, "local", "hit")
+        return entry.value
+
+    # одно вычисление ключа на процесс, остальные ждут его результата
+    with _inflight_lock:
+        done = _inflight.get(key)
+        leader = done is None
+        if leader:
+            done = _inflight[key] = threading.Event()
+    if not leader:
+        done.wait(config["LOCK_TIMEOUT"])
+        entry = _local.get(key, time.time())
+        if entry is not None:
+            _record(name, "local", "hit")
+            return entry.value
+    try:
+        return _fetch_shared(name, key, tuple(tags), compute, timeout, config)
+    finally:
+        if leader:
+            with _inflight_lock:
+                del _inflight[key]
+            done.set()
+
+
+def _fetch_shared(name, key, tags, compute, timeout, config):
+    shared = caches[config["ALIAS"]]
+    entry, versions = _shared_lookup(shared, key, tags)
+    now = time.time()
+    if entry is not None and entry.fresh(now, config["BETA"]):
+        _store_local(key, entry, now, config)
+        _record(name, "shared", "hit")
+        return entry.value
+
+    lock_key = f"{key}:lock"
+    locked = shared.add(lock_key, 1, config["LOCK_TIMEOUT"])
+    if not locked:
+        if entry is not None:
+            # пересчитывает другой процесс, пока отдается прежнее значение
+            _record(name, "shared", "hit")
+            return entry.value
+        entry = _wait_shared(shared, key, tags, config)
+        if entry is not None:
+            _store_local(key, entry, time.time(), config)
+            _record(name, "shared", "hit")
+            return entry.value
+
+    _record(name, "none", "miss")
+    try:
+        started = time.perf_counter()
+        try:
+            value = compute()
+        except Uncacheable as exc:
+            return exc.value
+        now = time.time()
+        entry = Entry(
+            value=value,
+            tags=tags,
+            versions=versions,
+            expires=now + (timeout or config["TIMEOUT"]),
+            delta=time.perf_counter() - started,
+        )
+        shared.set(key, entry, (timeout or config["TIMEOUT"]) + config["STALE_GRACE"])
+        _store_local(key, entry, now, config)
+        return value
+    finally:
+        if locked:
+            shared.delete(lock_key)
+
+
+def _wait_shared(shared, key, tags, config, interval=0.05):
+    deadline = time.monotonic() + config["LOCK_TIMEOUT"]
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        entry, _ = _shared_lookup(shared, key, tags)
+        if entry is not None:
+            return entry
+    return None
+
+
+def _store_local(key, entry, now, config):
+    _local.put(key, entry, now + config["LOCAL_TIMEOUT"], config["LOCAL_MAX_ENTRIES"])
+
+
+def invalidate(*tags):
+    """
+    Сбрасывает записи с тегами tags после фиксации текущей транзакции
+    """
+    tags = set(tags)
+
+    def bump():
+        _local.drop_tags(tags)
+        caches[get_config()["ALIAS"]].set_many(
+            {_tag_key(tag): time.time_ns() for tag in tags}, None
+        )
+
+    transaction.on_commit(bump)
+    invalidation.publish(*tags)
+
+
+@invalidation.subscribe
+def _drop_local(topics):
+    _local.drop_tags(topics)
+
+
+def clear_local():
+    _local.clear()
+
+
+def request_key(name, request, kwargs):
+    """
+    Ключ ответа: имя эндпоинта, параметры адреса и параметры запроса
+    без учета их порядка
+    """
+    params = sorted((param, sorted(values)) for param, values in request.GET.lists())
+    raw = repr((sorted(kwargs.items()), params)).encode()
+    return f"{KEY_PREFIX}:{name}:{hashlib.sha1(raw).hexdigest()}"
+
+
+def _freeze(response):
+    if response.status_code != 200 or response.streaming:
+        raise Uncacheable(response)
+    headers = tuple(response.headers.items())
+    if isinstance(response, Response):
+        # тип содержимого Response выбирается при отрисовке
+        return ("data", response.data, tuple(item for item in headers if item[0] != "Content-Type"))
+    return ("content", response.content, headers)
+
+
+def _thaw(value):
+    kind, payload, headers = value
+    response = Response(payload) if kind == "data" else HttpResponse(payload)
+    for header, header_value in headers:
+        response[header] = header_value
+    return response
+
+
+def cache_response(name, tags=(), timeout=None):
+    """
+    Декоратор обработчика GET вьюхи: ответ кешируется по имени name
+    и параметрам запроса и сбрасывается invalidate() любого из tags
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            value = fetch(
+                name,
+                request_key(name, request, kwargs),
+                tags,
+                lambda: _freeze(handler(view, request, *args, **kwargs)),
+                timeout,
+            )
+            # не кешируемый ответ возвращается как есть
+            return value if isinstance(value, HttpResponse) else _thaw(value)
+        return wrapper
+    return decorator
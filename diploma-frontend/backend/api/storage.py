@@ -0,0 +1,40 @@
+"""
+Локальная замена объектного хранилища (S3 и совместимых) для разработки
+и тестов. Ведет себя как S3-хранилище django-storages: имя файла - ключ
+объекта, запись по существующему ключу заменяет объект целиком (атомарно,
+через временный файл), удаление отсутствующего ключа не ошибка. Код,
+работающий с файлами через Storage API, не зависит от того, какое из
+хранилищ настроено в STORAGES.
+"""
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+
+class LocalObjectStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # ключи объектов не переименовываются, запись заменяет объект
+        return name
+
+    def _save(self, name, content):
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(descriptor, "wb") as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return str(name).replace("\\", "/")
+
+    def delete(self, name):
+        if name:
+            super().delete(name)
@@ -0,0 +1,43 @@
+"""
+Запуск тестов без логов приложения.
+
+Логи пишутся в stderr строками JSON (api.log), и записи api.requests
+о каждом запросе тестового клиента перемешиваются с отчетом unittest.
+QuietLogsRunner на время тестов поднимает уровень корневого логгера и
+логгера django до CRITICAL; --show-logs оставляет настройки LOGGING.
+assertLogs в тестах работает как обычно: он сам выставляет уровень
+проверяемого логгера.
+"""
+import logging
+
+from django.test.runner import DiscoverRunner
+
+QUIET_LOGGERS = ("", "django")
+
+
+class QuietLogsRunner(DiscoverRunner):
+    def __init__(self, show_logs=False, **kwargs):
+        super().__init__(**kwargs)
+        self.show_logs = show_logs
+        self.saved_levels = {}
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--show-logs", action="store_true", help="Выводить логи приложения во время тестов",
+        )
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        if self.show_logs:
+            return
+        for name in QUIET_LOGGERS:
+            logger = logging.getLogger(name)
+            self.saved_levels[name] = logger.level
+            logger.setLevel(logging.CRITICAL)
+
+    def teardown_test_environment(self, **kwargs):
+        for name, level in self.saved_levels.items():
+            logging.getLogger(name).setLevel(level)
+        super().teardown_test_environment(**kwargs)
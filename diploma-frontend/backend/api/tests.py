@@ -1,3 +1,446 @@
-from django.test import TestCase
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+
+from api import idempotency, invalidation, metrics, response_cache, throttling
+from api.models import IdempotencyKey, InvalidationEvent
+from api.storage import LocalObjectStorage
+from myauth.tests import TEST_CACHES
+from shopapp import shop_config, tags
+from shopapp.models import Category, DeliveryPrices, Product, Subcategory, Tag
+
+
+class CountingView(APIView):
+    """
+    Вьюха с побочным эффектом: считает выполнения
+    """
+    calls = 0
+
+    @idempotency.idempotent("test")
+    def post(self, request):
+        CountingView.calls += 1
+        return Response({"calls": CountingView.calls}, status=201)
+
+
+class FailingView(APIView):
+    @idempotency.idempotent("test")
+    def post(self, request):
+        return Response(status=503)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        CountingView.calls = 0
+        self.user = User.objects.create_user("buyer", password="secret")
+        self.factory = APIRequestFactory()
+
+    def post(self, data, key="key-1"):
+        request = self.factory.post("/test", data, format="json", HTTP_IDEMPOTENCY_KEY=key)
+        force_authenticate(request, self.user)
+        return CountingView.as_view()(request)
+
+    def test_retry_is_replayed(self):
+        first = self.post({"amount": 1})
+        second = self.post({"amount": 1})
+        self.assertEqual(CountingView.calls, 1)
+        self.assertEqual((first.status_code, first.data), (201, {"calls": 1}))
+        self.assertEqual((second.status_code, second.data), (201, {"calls": 1}))
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+
+    def test_other_body_is_rejected(self):
+        self.post({"amount": 1})
+        self.assertEqual(self.post({"amount": 2}).status_code, 422)
+        self.assertEqual(CountingView.calls, 1)
+
+    def test_claim_is_exclusive(self):
+        fingerprint = "0" * 40
+        claimed, record = idempotency._claim("test:1", fingerprint, idempotency.get_config())
+        self.assertIsNotNone(claimed)
+        self.assertIsNone(record)
+        # второй запрос с тем же ключом, пока первый выполняется
+        claimed, record = idempotency._claim("test:1", fingerprint, idempotency.get_config())
+        self.assertIsNone(claimed)
+        self.assertIsNone(record.status)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_failed_request_releases_key(self):
+        request = self.factory.post("/test", {}, format="json", HTTP_IDEMPOTENCY_KEY="key-1")
+        force_authenticate(request, self.user)
+        self.assertEqual(FailingView.as_view()(request).status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class InvalidationPollTests(TestCase):
+    def setUp(self):
+        invalidation._seen = None
+        self.addCleanup(setattr, invalidation, "_seen", None)
+        invalidation.poll(force=True)
+
+    def test_late_commit_with_lower_id(self):
+        late = InvalidationEvent.objects.create(topics="tags")
+        InvalidationEvent.objects.filter(pk=late.pk).delete()
+        InvalidationEvent.objects.create(topics="products")
+        self.assertEqual(invalidation.poll(force=True), {"products"})
+        # событие с меньшим id зафиксировано после чтения события с большим
+        InvalidationEvent.objects.create(pk=late.pk, topics="tags")
+        self.assertEqual(invalidation.poll(force=True), {"tags"})
+        self.assertEqual(invalidation.poll(force=True), frozenset())
+
+    def test_events_before_start_are_skipped(self):
+        invalidation._seen = None
+        InvalidationEvent.objects.create(topics="tags")
+        invalidation.poll(force=True)
+        self.assertEqual(invalidation.poll(force=True), frozenset())
+
+
+class MetricsTests(TestCase):
+    def counter(self, data, name):
+        return sum(value for metric, _, value in data["counters"] if metric == name)
+
+    def test_dead_thread_shards_are_folded(self):
+        before = self.counter(metrics.snapshot(), "shop_orders_created_total")
+        threads = [threading.Thread(target=metrics.inc, args=("shop_orders_created_total",)) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        self.assertEqual(self.counter(metrics.snapshot(), "shop_orders_created_total"), before + 50)
+        self.assertEqual([shard for shard in metrics._shards if not shard.alive()], [])
+        self.assertLessEqual(len(metrics._shards), threading.active_count())
+
+    def test_dead_process_files_are_retired(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        dead = subprocess.Popen([sys.executable, "-c", ""])
+        dead.wait()
+        data = {"counters": [["shop_orders_created_total", [], 3]], "histograms": []}
+        for name in (f"{dead.pid}-1.json", f"{dead.pid}-2.json"):
+            with open(os.path.join(directory, name), "w") as file:
+                json.dump(data, file)
+        with self.settings(METRICS={"DIR": directory}):
+            first, processes = metrics.collect()
+            self.assertEqual(processes, 1)
+            # повторная выдача не переносит значения еще раз
+            second, processes = metrics.collect()
+        self.assertEqual(processes, 1)
+        self.assertEqual(sorted(os.listdir(directory))[-1], metrics.RETIRED_FILE)
+        self.assertEqual(len([name for name in os.listdir(directory) if name.endswith(".json")]), 2)
+        for snapshots in (first, second):
+            own = self.counter(metrics.snapshot(), "shop_orders_created_total")
+            total = sum(self.counter(data, "shop_orders_created_total") for data in snapshots)
+            self.assertEqual(total, own + 6)
+
+
+# теги кеша ответов, записи которых держит каждый рабочий процесс
+WATCHED_TAGS = ("products", "categories", "tags", "sales")
+
+WORKER = "import sys, django; django.setup(); from api.tests import run_bus_worker; run_bus_worker(sys.argv[1])"
+
+
+class LocalObjectStorageTests(unittest.TestCase):
+    """
+    Замена S3-хранилища ведет себя как объектное хранилище
+    """
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, ignore_errors=True)
+        self.storage = LocalObjectStorage(location=self.location)
+
+    def test_save_replaces_object(self):
+        name = "images/avatar.png"
+        self.assertEqual(self.storage.save(name, ContentFile(b"old")), name)
+        # запись по существующему ключу заменяет объект, а не переименовывает файл
+        self.assertEqual(self.storage.save(name, ContentFile(b"new")), name)
+        with self.storage.open(name) as content:
+            self.assertEqual(content.read(), b"new")
+        self.assertEqual(os.listdir(os.path.join(self.location, "images")), ["avatar.png"])
+
+    def test_failed_save_keeps_object(self):
+        name = "avatar.png"
+        self.storage.save(name, ContentFile(b"old"))
+
+        class BrokenFile(ContentFile):
+            def chunks(self, chunk_size=None):
+                yield b"partial"
+                raise OSError("обрыв соединения")
+
+        with self.assertRaises(OSError):
+            self.storage.save(name, BrokenFile(b""))
+        with self.storage.open(name) as content:
+            self.assertEqual(content.read(), b"old")
+        self.assertEqual(os.listdir(self.location), ["avatar.png"])
+
+    def test_delete_missing(self):
+        self.storage.delete("missing.png")
+        self.storage.delete("")
+        self.storage.save("avatar.png", ContentFile(b"data"))
+        self.storage.delete("avatar.png")
+        self.assertFalse(self.storage.exists("avatar.png"))
+
+
+class HeaderView(APIView):
+    calls = 0
+
+    @response_cache.cache_response("test-headers", tags=("test",))
+    def get(self, request):
+        HeaderView.calls += 1
+        response = Response({"calls": HeaderView.calls})
+        response["Server-Timing"] = "work;dur=1.0"
+        return response
+
+
+@override_settings(CACHES=TEST_CACHES, INVALIDATION={"ENABLED": False})
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        HeaderView.calls = 0
+        response_cache.clear_local()
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+
+    def test_headers(self):
+        view = HeaderView.as_view()
+        for _ in range(3):
+            response = view(APIRequestFactory().get("/headers"))
+            response.render()
+            self.assertEqual(response["Server-Timing"], "work;dur=1.0")
+            self.assertEqual(response["Content-Type"], "application/json")
+            self.assertEqual(json.loads(response.content), {"calls": 1})
+        # из общего кеша тоже, а не только из памяти процесса
+        response_cache.clear_local()
+        self.assertEqual(view(APIRequestFactory().get("/headers"))["Server-Timing"], "work;dur=1.0")
+        self.assertEqual(HeaderView.calls, 1)
+
+    def test_evicted_tag_version(self):
+        shared = caches[response_cache.get_config()["ALIAS"]]
+        self.assertEqual(response_cache.fetch("test", "test-key", ("test",), lambda: 1), 1)
+        self.assertIsNotNone(shared.get(response_cache._tag_key("test")))
+        # общий кеш вытеснил версию тега: прежняя запись не должна вернуться
+        shared.delete(response_cache._tag_key("test"))
+        response_cache.clear_local()
+        self.assertEqual(response_cache.fetch("test", "test-key", ("test",), lambda: 2), 2)
+        response_cache.clear_local()
+        self.assertEqual(response_cache.fetch("test", "test-key", ("test",), lambda: 3), 2)
+
+
+class BasketView(APIView):
+    throttle_classes = [throttling.BasketThrottle]
+
+    def get(self, request):
+        return Response({})
+
+    def post(self, request):
+        return Response({})
+
+    def delete(self, request):
+        return Response({})
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    RATE_LIMITS={"BUDGETS": {"basket": {"capacity": 2, "rate": 0.5}}},
+)
+class ThrottlingTests(TestCase):
+    """
+    Корзина токенов: пополнение со скоростью rate до capacity,
+    Retry-After по времени до следующего токена
+    """
+    def setUp(self):
+        throttling._local_store.clear()
+        caches["default"].clear()
+
+    def test_refill(self):
+        for store, clock in (
+            (throttling.LocalBucketStore(), "api.throttling.time.monotonic"),
+            (throttling.CacheBucketStore("default"), "api.throttling.time.time"),
+        ):
+            with self.subTest(store=type(store).__name__), mock.patch(clock) as now:
+                now.return_value = 1000.0
+                self.assertEqual([store.take("key", 2, 0.5, 1) for _ in range(3)], [0, 0, 2.0])
+                now.return_value = 1001.0
+                self.assertEqual(store.take("key", 2, 0.5, 1), 1.0)
+                now.return_value = 1002.0
+                self.assertEqual(store.take("key", 2, 0.5, 1), 0)
+                # за долгий простой корзина наполняется только до capacity
+                now.return_value = 2000.0
+                self.assertEqual([store.take("key", 2, 0.5, 1) for _ in range(3)], [0, 0, 2.0])
+                self.assertEqual(store.take("key", 2, 0.5, 3), 6.0)
+
+    def test_retry_after(self):
+        view = BasketView.as_view()
+        with mock.patch("api.throttling.time.monotonic", return_value=1000.0):
+            for _ in range(2):
+                self.assertEqual(view(APIRequestFactory().post("/basket")).status_code, 200)
+            response = view(APIRequestFactory().post("/basket"))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "2")
+
+    def test_basket_methods(self):
+        view = BasketView.as_view()
+        for _ in range(5):
+            self.assertEqual(view(APIRequestFactory().get("/basket")).status_code, 200)
+        # POST и DELETE списывают из одной корзины
+        self.assertEqual(view(APIRequestFactory().post("/basket")).status_code, 200)
+        self.assertEqual(view(APIRequestFactory().delete("/basket")).status_code, 200)
+        self.assertEqual(view(APIRequestFactory().delete("/basket")).status_code, 429)
+        self.assertEqual(view(APIRequestFactory().get("/basket")).status_code, 200)
+
+
+def run_bus_worker(db_name):
+    """
+    Рабочий процесс теста шины: заполняет свои кеши в памяти (записи кеша
+    ответов с тегами WATCHED_TAGS, карту тегов, настройки магазина),
+    читает шину, как воркер перед запросом, и пишет в stdout, какие темы
+    получил и какие кеши после этого сброшены
+    """
+    connections["default"].settings_dict["NAME"] = db_name
+    # записи в памяти не должны истечь сами за время теста
+    local = {**getattr(settings, "RESPONSE_CACHE", {}), "LOCAL_TIMEOUT": 3600}
+    with override_settings(CACHES=TEST_CACHES, RESPONSE_CACHE=local):
+        keys = {tag: f"bus-check:{os.getpid()}:{tag}" for tag in WATCHED_TAGS}
+
+        def fill():
+            for tag, key in keys.items():
+                response_cache.fetch("bus-check", key, (tag,), lambda: 1)
+            tags.tag_ids(["bus-check"])
+            shop_config.get_shop_config()
+
+        def cached():
+            now = time.time()
+            result = {
+                f"responses:{tag}" for tag, key in keys.items()
+                if response_cache._local.get(key, now) is not None
+            }
+            if tags._map is not None:
+                result.add("tags")
+            if shop_config._loaded is not None:
+                result.add("config")
+            return result
+
+        def report(**data):
+            # строки журнала процесса тоже могут быть JSON
+            print(json.dumps({"bus": True, **data}), flush=True)
+
+        invalidation.poll(force=True)
+        fill()
+        report(ready=os.getpid())
+        while True:
+            before = cached()
+            topics = invalidation.poll()
+            if topics:
+                report(topics=sorted(topics), at=time.time(), evicted=sorted(before - cached()))
+                fill()
+            time.sleep(0.005)
+
+
+@unittest.skipIf(connection.vendor == "sqlite" and connection.is_in_memory_db(), "БД в памяти недоступна другим процессам")
+@override_settings(CACHES=TEST_CACHES)
+class InvalidationBusTests(TransactionTestCase):
+    """
+    Доставка изменений в кеши нескольких процессов через шину: каждый
+    рабочий процесс должен сбросить нужные кеши не позже чем через
+    COALESCE_WINDOW + POLL_INTERVAL секунд (с запасом), а серия
+    сохранений товаров - записать несколько событий, а не по одному на товар
+    """
+    WORKERS = 3
+    BURST = 100
+    STARTUP_TIMEOUT = 60
+
+    def setUp(self):
+        self.tag = Tag.objects.create(name="Популярное")
+        self.category = Category.objects.create(title="Компьютеры")
+        subcategory = Subcategory.objects.create(title="Ноутбуки", category=self.category)
+        self.prices = DeliveryPrices.objects.create(
+            delivery_cost=200, delivery_express_cost=500, delivery_free_minimum_cost=2000,
+        )
+        self.products = [
+            Product.objects.create(title=f"Товар {i}", category=self.category, subcategory=subcategory)
+            for i in range(10)
+        ]
+        invalidation.flush()
+        config = invalidation.get_config()
+        self.max_lag = config["COALESCE_WINDOW"] + config["POLL_INTERVAL"] + 1
+        self.workers = self.start_workers()
+
+    def start_workers(self):
+        workers = []
+        for _ in range(self.WORKERS):
+            process = subprocess.Popen(
+                [sys.executable, "-c", WORKER, str(connection.settings_dict["NAME"])],
+                cwd=settings.BASE_DIR, stdout=subprocess.PIPE, text=True,
+            )
+            reports = queue.Queue()
+            threading.Thread(target=self.read_reports, args=(process, reports), daemon=True).start()
+            workers.append((process, reports))
+            self.addCleanup(process.wait)
+            self.addCleanup(process.terminate)
+        deadline = time.monotonic() + self.STARTUP_TIMEOUT
+        for process, reports in workers:
+            try:
+                report = reports.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                self.fail(f"Процесс {process.pid} не запустился за {self.STARTUP_TIMEOUT} с")
+            self.assertIn("ready", report)
+        return workers
+
+    @staticmethod
+    def read_reports(process, reports):
+        for line in process.stdout:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(data, dict) and data.pop("bus", False):
+                reports.put(data)
+
+    def assertDelivered(self, change, topic, expected):
+        """
+        После change() каждый процесс получает тему topic и сбрасывает кеши
+        expected; возвращает число записанных событий
+        """
+        first_id = InvalidationEvent.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+        started = time.time()
+        change()
+        for process, reports in self.workers:
+            deadline = time.monotonic() + self.max_lag * 3
+            while True:
+                try:
+                    report = reports.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    self.fail(f"Процесс {process.pid} не получил тему {topic}")
+                if topic in report["topics"]:
+                    break
+            self.assertLessEqual(set(expected), set(report["evicted"]), f"процесс {process.pid}")
+            # от фиксации первого изменения серии
+            self.assertLess(report["at"] - started, self.max_lag, f"процесс {process.pid}")
+        invalidation.flush()
+        return InvalidationEvent.objects.filter(pk__gt=first_id).count()
+
+    def test_changes_reach_all_workers(self):
+        self.assertDelivered(self.tag.save, "tags", ("tags", "responses:tags", "responses:products"))
+        self.assertDelivered(self.category.save, "categories", ("responses:categories",))
+        self.assertDelivered(self.prices.save, "shop-config", ("config",))
+
+        def save_products():
+            # каждый товар в своей транзакции, как при сохранении в админке
+            for i in range(self.BURST):
+                self.products[i % len(self.products)].save()
+
+        events = self.assertDelivered(save_products, "products", ("responses:products", "responses:sales"))
+        self.assertLess(events, self.BURST // 10)
@@ -0,0 +1,230 @@
+"""
+Ограничение частоты запросов по алгоритму "корзина токенов".
+
+Каждый бюджет из settings.RATE_LIMITS["BUDGETS"] задает емкость корзины
+(сколько запросов можно сделать подряд) и скорость пополнения в токенах
+в секунду. Запрос списывает из корзины столько токенов, сколько стоит:
+по умолчанию 1, вьюха может задать throttle_cost, например, смена пароля
+дороже входа, так как хеширует пароль дважды. Если токенов не хватает,
+DRF отвечает 429 с заголовком Retry-After.
+
+Состояние корзин хранится в одном из хранилищ:
+- locmem - в памяти процесса, у каждого воркера свои корзины;
+- cache  - в кеше Django (CACHES), общий для всех процессов, если кеш общий
+  (memcached, redis). Чтение и запись корзины не атомарны, поэтому при
+  одновременных запросах бюджет может быть превышен на число параллельных
+  запросов - для защиты от перебора паролей этого достаточно.
+"""
+import json
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http.request import RawPostDataException
+from rest_framework.throttling import BaseThrottle
+
+CACHE_PREFIX = "throttle"
+# сколько корзин хранит locmem-хранилище, прежде чем удалить полные
+MAX_LOCAL_BUCKETS = 10000
+
+DEFAULT_RATE_LIMITS = {
+    "ENABLED": True,
+    "BACKEND": "locmem",
+    "CACHE": "default",
+    "BUDGETS": {
+        "auth-ip": {"capacity": 20, "rate": 20 / 60},
+        "auth-username": {"capacity": 5, "rate": 5 / 60},
+        "review": {"capacity": 5, "rate": 5 / 3600},
+        "basket": {"capacity": 60, "rate": 1},
+    },
+}
+
+
+def _refill(state, capacity, rate, now):
+    """
+    Количество токенов в корзине на момент now
+    """
+    if state is None:
+        return capacity
+    tokens, stamp = state
+    return min(capacity, tokens + (now - stamp) * rate)
+
+
+def _wait(tokens, cost, rate):
+    return (cost - tokens) / rate
+
+
+class LocalBucketStore:
+    """
+    Корзины в памяти процесса
+    """
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost):
+        """
+        Списывает cost токенов. Возвращает 0, если запрос разрешен,
+        иначе - через сколько секунд токенов хватит.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._buckets.get(key)
+            tokens = _refill(state and state[:2], capacity, rate, now)
+            wait = _wait(tokens, cost, rate) if tokens < cost else 0
+            if not wait:
+                tokens -= cost
+            # третий элемент - момент, когда корзина снова будет полной
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self._buckets) > MAX_LOCAL_BUCKETS:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now):
+        # полная корзина ничем не отличается от отсутствующей
+        self._buckets = {
+            key: state for key, state in self._buckets.items() if state[2] > now
+        }
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBucketStore:
+    """
+    Корзины в кеше Django, общие для всех процессов
+    """
+    def __init__(self, alias):
+        self.alias = alias
+
+    def take(self, key, capacity, rate, cost):
+        cache = caches[self.alias]
+        now = time.time()
+        key = f"{CACHE_PREFIX}:{key}"
+        tokens = _refill(cache.get(key), capacity, rate, now)
+        # корзина хранится, пока не наполнится снова
+        timeout = math.ceil(capacity / rate) + 1
+        if tokens < cost:
+            cache.set(key, (tokens, now), timeout)
+            return _wait(tokens, cost, rate)
+        cache.set(key, (tokens - cost, now), timeout)
+        return 0
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+_local_store = LocalBucketStore()
+
+
+def get_config():
+    """
+    Настройки RATE_LIMITS поверх значений по умолчанию, бюджеты
+    объединяются по имени
+    """
+    overrides = getattr(settings, "RATE_LIMITS", {})
+    config = {**DEFAULT_RATE_LIMITS, **overrides}
+    config["BUDGETS"] = {**DEFAULT_RATE_LIMITS["BUDGETS"], **overrides.get("BUDGETS", {})}
+    return config
+
+
+def get_store(config=None):
+    config = config or get_config()
+    if config["BACKEND"] == "cache":
+        return CacheBucketStore(config["CACHE"])
+    return _local_store
+
+
+def _body_username(request):
+    """
+    Имя пользователя из JSON-тела запроса. Тело читается через request.body,
+    поэтому вьюха по-прежнему может сама разобрать его json.loads.
+    """
+    try:
+        data = json.loads(request.body or b"{}")
+    except (RawPostDataException, ValueError):
+        return None
+    username = data.get("username") if isinstance(data, dict) else None
+    return str(username).strip().lower() if username else None
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Базовый класс: списывает стоимость запроса из корзины бюджета budget
+    для ключа, который возвращает get_key. Запросы с ключом None не ограничиваются.
+    """
+    budget = None
+    methods = None
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        config = get_config()
+        if not config["ENABLED"]:
+            return True
+        if self.methods is not None and request.method not in self.methods:
+            return True
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+
+        budget = config["BUDGETS"][self.budget]
+        cost = getattr(view, "throttle_cost", 1)
+        wait = get_store(config).take(
+            f"{self.budget}:{key}", budget["capacity"], budget["rate"], cost
+        )
+        if wait:
+            self.wait_seconds = wait
+            return False
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class AuthIPThrottle(TokenBucketThrottle):
+    """
+    Вход, регистрация и смена пароля с одного IP-адреса
+    """
+    budget = "auth-ip"
+
+
+class AuthUsernameThrottle(TokenBucketThrottle):
+    """
+    Вход, регистрация и смена пароля для одного имени пользователя,
+    независимо от адреса, с которого перебирают пароли
+    """
+    budget = "auth-username"
+
+    def get_key(self, request, view):
+        if request.user.is_authenticated:
+            return request.user.username.lower()
+        return _body_username(request)
+
+
+class UserOrIPThrottle(TokenBucketThrottle):
+    """
+    Ключ - пользователь, для анонимных запросов - IP-адрес
+    """
+    def get_key(self, request, view):
+        if request.user.is_authenticated:
+            return f"user-{request.user.pk}"
+        return f"ip-{self.get_ident(request)}"
+
+
+class ReviewThrottle(UserOrIPThrottle):
+    budget = "review"
+    methods = {"POST"}
+
+
+class BasketThrottle(UserOrIPThrottle):
+    budget = "basket"
+    methods = {"POST", "DELETE"}
+
+
+AUTH_THROTTLES = [AuthIPThrottle, AuthUsernameThrottle]
@@ -0,0 +1,422 @@
+"""
+Прием загружаемых изображений (аватарки, изображения товаров).
+
+ImageUploadHandler подключается только к вьюхам, принимающим изображения
+(ImageUploadMixin для APIView, DeferredUploadAdminMixin для админки);
+остальные запросы разбираются обработчиками Django по умолчанию. Он
+принимает каждый файл multipart-запроса потоком во временный файл
+каталога SPOOL_DIR.
+Размер проверяется по мере приема, тип - по сигнатуре первых байт,
+то есть до того, как файл будет декодирован Pillow. Отклоненный файл
+в request.FILES не попадает, причина записывается в request.upload_errors.
+
+Запись в хранилище (storage поля модели) и удаление старого файла
+выполняет фоновый поток после фиксации транзакции: запрос не ждет
+файловой системы или объектного хранилища. Временные файлы, оставшиеся
+от прерванных запросов, фоновый поток удаляет в простое.
+
+Очередь записи живет только в памяти процесса, а поток - демон: задачи,
+не выполненные к остановке или перезапуску процесса, теряются. Объект
+в этом случае сохраняет прежний файл, а временный файл удаляется как
+брошенный по истечении SPOOL_MAX_AGE; пользователю нужно загрузить файл
+повторно. Где это недопустимо, запись выполняется в потоке запроса
+(ASYNC: False).
+"""
+import functools
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from typing import NamedTuple
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib import messages
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.db import close_old_connections, transaction
+from django.http import HttpResponseRedirect
+from django.urls import URLPattern
+from django.views.decorators.csrf import csrf_exempt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPLOADS = {
+    "MAX_SIZE": 5 * 1024 * 1024,
+    "TYPES": ["jpeg", "png", "gif", "webp"],
+    "SPOOL_DIR": os.path.join(tempfile.gettempdir(), "diploma-uploads"),
+    # False - файл записывается в хранилище сразу, в потоке запроса
+    "ASYNC": True,
+    # временные файлы старше этого возраста (с) считаются брошенными
+    "SPOOL_MAX_AGE": 60 * 60,
+}
+
+# сигнатуры допустимых форматов; для webp дополнительно проверяется "WEBP"
+SIGNATURES = [
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"RIFF", "webp"),
+]
+HEAD_SIZE = 12
+
+
+def get_config():
+    return {**DEFAULT_UPLOADS, **getattr(settings, "UPLOADS", {})}
+
+
+def detect_image_type(head):
+    """
+    Формат изображения по первым байтам файла или None
+    """
+    for signature, image_type in SIGNATURES:
+        if head.startswith(signature):
+            if image_type == "webp" and head[8:12] != b"WEBP":
+                return None
+            return image_type
+    return None
+
+
+def get_upload_errors(request):
+    """
+    Причины отклонения файлов запроса
+    """
+    # ошибки появляются при разборе тела, если оно еще не разобрано
+    request.FILES
+    return list(getattr(request, "upload_errors", []))
+
+
+class SpooledUploadedFile(UploadedFile):
+    """
+    Принятый файл во временном каталоге. В отличие от TemporaryUploadedFile
+    не удаляется при закрытии: его забирает фоновая запись в хранилище.
+    """
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            pass
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """
+    Потоковый прием файла во временный каталог с проверкой размера и типа
+    """
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.config = get_config()
+        self.received = 0
+        self.head = b""
+        self.checked = False
+        os.makedirs(self.config["SPOOL_DIR"], exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(
+            dir=self.config["SPOOL_DIR"], suffix=".upload", delete=False
+        )
+        if self.content_length and self.content_length > self.config["MAX_SIZE"]:
+            self.reject("превышен допустимый размер")
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.config["MAX_SIZE"]:
+            self.reject("превышен допустимый размер")
+        if not self.checked:
+            self.head += raw_data[:HEAD_SIZE]
+            if len(self.head) >= HEAD_SIZE:
+                self.check_type()
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if not self.checked:
+            # файл короче HEAD_SIZE; SkipFile здесь уже не обрабатывается
+            # парсером, поэтому файл отклоняется возвратом None
+            self.checked = True
+            reason = self.type_error()
+            if reason:
+                self.discard()
+                self.record_error(reason)
+                return None
+        self.file.flush()
+        self.file.seek(0)
+        return SpooledUploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, "file"):
+            self.discard()
+
+    def type_error(self):
+        if detect_image_type(self.head) not in self.config["TYPES"]:
+            return f"допустимы только изображения {', '.join(self.config['TYPES'])}"
+        return None
+
+    def check_type(self):
+        self.checked = True
+        reason = self.type_error()
+        if reason:
+            self.reject(reason)
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.file.name)
+        except FileNotFoundError:
+            pass
+
+    def record_error(self, reason):
+        if not hasattr(self.request, "upload_errors"):
+            self.request.upload_errors = []
+        self.request.upload_errors.append(f"{self.file_name}: {reason}")
+
+    def reject(self, reason):
+        self.discard()
+        self.record_error(reason)
+        raise SkipFile()
+
+
+def use_image_upload_handler(request):
+    """
+    Файлы запроса принимает ImageUploadHandler вместо обработчиков
+    по умолчанию; вызывается до разбора тела запроса
+    """
+    request.upload_handlers = [ImageUploadHandler(request)]
+
+
+class ImageUploadMixin:
+    """
+    Для APIView: файлы запроса принимаются ImageUploadHandler. Обработчик
+    подключается до аутентификации: проверка CSRF в SessionAuthentication
+    уже разбирает тело запроса.
+    """
+    def initialize_request(self, request, *args, **kwargs):
+        use_image_upload_handler(request)
+        return super().initialize_request(request, *args, **kwargs)
+
+
+def image_upload_view(view):
+    """
+    Оборачивает вьюху, защищенную csrf_protect: файлы принимает
+    ImageUploadHandler. CsrfViewMiddleware разобрал бы тело запроса до
+    вьюхи обработчиками по умолчанию, поэтому обертка от нее освобождена,
+    а CSRF проверяет сама обернутая вьюха.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        use_image_upload_handler(request)
+        return view(request, *args, **kwargs)
+
+    return csrf_exempt(wrapper)
+
+
+class StoreJob(NamedTuple):
+    """
+    Запись принятого файла в поле field_name объекта model_label/pk.
+    Если pk не задан, объект создается из create вместе с записью файла.
+    """
+    model_label: str
+    pk: int
+    field_name: str
+    spool_path: str
+    file_name: str
+    # имена файлов, которые нельзя удалять при замене (общие файлы по умолчанию)
+    keep: frozenset
+    # значения полей создаваемого объекта: {attname: значение}
+    create: dict = None
+
+
+def store(job):
+    """
+    Записывает файл в хранилище поля, сохраняет его имя в объекте
+    и удаляет из хранилища прежний файл. Создаваемый объект сохраняется
+    в одной транзакции с именем файла: читатели не видят его без файла,
+    а при ошибке записи он не появляется вовсе.
+    """
+    try:
+        model = apps.get_model(job.model_label)
+        field = model._meta.get_field(job.field_name)
+        with transaction.atomic():
+            if job.pk is None:
+                # путь файла может зависеть от pk, поэтому объект сохраняется до записи
+                instance = model(**job.create)
+                instance.save()
+            else:
+                instance = model._default_manager.filter(pk=job.pk).first()
+                if instance is None:
+                    return
+            old_name = getattr(instance, job.field_name).name
+            with open(job.spool_path, "rb") as content:
+                name = field.storage.save(
+                    field.generate_filename(instance, job.file_name), File(content)
+                )
+            setattr(instance, job.field_name, name)
+            instance.save(update_fields=[job.field_name])
+        if old_name and old_name != name and old_name not in job.keep:
+            field.storage.delete(old_name)
+    finally:
+        try:
+            os.remove(job.spool_path)
+        except FileNotFoundError:
+            pass
+
+
+def cleanup_spool(max_age):
+    """
+    Удаляет временные файлы прерванных или необработанных загрузок
+    """
+    spool_dir = get_config()["SPOOL_DIR"]
+    if not os.path.isdir(spool_dir):
+        return
+    deadline = time.time() - max_age
+    for entry in os.scandir(spool_dir):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < deadline:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+
+
+_jobs = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _work():
+    while True:
+        try:
+            job = _jobs.get(timeout=60)
+        except queue.Empty:
+            cleanup_spool(get_config()["SPOOL_MAX_AGE"])
+            continue
+        try:
+            store(job)
+        except Exception:
+            logger.exception("Не удалось сохранить загруженный файл %s", job.file_name)
+        finally:
+            close_old_connections()
+            _jobs.task_done()
+
+
+def _submit(job):
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name="upload-storage", daemon=True)
+            _worker.start()
+    _jobs.put(job)
+
+
+def save_in_background(instance, field_name, upload, keep=()):
+    """
+    Передает принятый файл upload на запись в поле field_name объекта
+    instance после фиксации текущей транзакции. Объект уже должен быть
+    сохранен; до окончания записи поле хранит прежний файл.
+    """
+    _schedule(StoreJob(
+        model_label=instance._meta.label,
+        pk=instance.pk,
+        field_name=field_name,
+        spool_path=upload.temporary_file_path(),
+        file_name=upload.name,
+        keep=frozenset(keep),
+    ))
+
+
+def create_in_background(instance, field_name, upload):
+    """
+    Как save_in_background, но для несохраненного объекта: он создается
+    только после записи файла. Пока запись не выполнена (или если задача
+    потеряна), объекта нет, и читателям не попадается пустое поле файла.
+    """
+    _schedule(StoreJob(
+        model_label=instance._meta.label,
+        pk=None,
+        field_name=field_name,
+        spool_path=upload.temporary_file_path(),
+        file_name=upload.name,
+        keep=frozenset(),
+        create={
+            field.attname: getattr(instance, field.attname)
+            for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name != field_name
+        },
+    ))
+
+
+def _schedule(job):
+    if get_config()["ASYNC"]:
+        transaction.on_commit(lambda: _submit(job))
+    else:
+        transaction.on_commit(lambda: store(job))
+
+
+class DeferredUploadAdminMixin:
+    """
+    Для ModelAdmin: файлы форм добавления и изменения принимает
+    ImageUploadHandler, отклоненные при приеме файлы показываются сообщением,
+    а принятые файлы полей upload_fields записываются в хранилище
+    фоновым потоком, а не при сохранении формы. С upload_create новый
+    объект с файлом создается только после записи файла.
+    """
+    upload_fields = ()
+    upload_keep = ()
+    # для моделей, объект которых без файла не имеет смысла (изображение товара)
+    upload_create = False
+
+    def get_urls(self):
+        # admin_view уже обернул вьюхи добавления и изменения в csrf_protect
+        names = {
+            f"{self.opts.app_label}_{self.opts.model_name}_{action}" for action in ("add", "change")
+        }
+        return [
+            URLPattern(url.pattern, image_upload_view(url.callback), url.default_args, url.name)
+            if isinstance(url, URLPattern) and url.name in names else url
+            for url in super().get_urls()
+        ]
+
+    def changeform_view(self, request, object_id=None, form_url="", extra_context=None):
+        if request.method == "POST":
+            errors = get_upload_errors(request)
+            if errors:
+                self.message_user(request, "; ".join(errors), messages.ERROR)
+                return HttpResponseRedirect(request.get_full_path())
+        return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def save_model(self, request, obj, form, change):
+        pending = {}
+        for field_name in self.upload_fields:
+            value = form.cleaned_data.get(field_name)
+            if field_name in form.changed_data and isinstance(value, UploadedFile):
+                pending[field_name] = value
+                # до записи в хранилище в объекте остается прежний файл
+                setattr(obj, field_name, form.initial.get(field_name) or "")
+        if not change and self.upload_create and len(pending) == 1:
+            (field_name, upload), = pending.items()
+            create_in_background(obj, field_name, upload)
+            return
+        super().save_model(request, obj, form, change)
+        for field_name, upload in pending.items():
+            save_in_background(obj, field_name, upload, keep=self.upload_keep)
+
+    def log_addition(self, request, obj, message):
+        # объект с отложенным созданием еще не сохранен
+        if obj.pk is None:
+            return None
+        return super().log_addition(request, obj, message)
+
+    def response_add(self, request, obj, post_url_continue=None):
+        if obj.pk is None:
+            self.message_user(request, f"{obj._meta.verbose_name} появится после записи файла", messages.INFO)
+            return self.response_post_save_add(request, obj)
+        return super().response_add(request, obj, post_url_continue)
@@ -15,6 +15,8 @@ from shopapp.views import (
     BannerListAPIView,
     PopularListAPIView,
     LimitedListAPIView,
+    TrendingListAPIView,
+    RecentlyViewedListAPIView,
     ProductDetailsRetrieveAPIView,
     ProductReviewAPIView,
     TagListAPIView,
@@ -23,28 +25,33 @@ from shopapp.views import (
     OrdersAPIView,
     OrderRegistrationAPIView,
     PaymentAPIView,
+    SalesReportAPIView,
 )
 
 urlpatterns = [
-    path("sign-in", SignInAPIView.as_view()),
-    path("sign-up", SignUpAPIView.as_view()),
-    path("sign-out", SingOutAPIView.as_view()),
-    path("profile", ProfileAPIView.as_view()),
-    path("profile/password", ChangePasswordAPIView.as_view()),
-    path("profile/avatar", AvatarUpdateAPIView.as_view()),
+    path("sign-in", SignInAPIView.as_view(), name="sign-in"),
+    path("sign-up", SignUpAPIView.as_view(), name="sign-up"),
+    path("sign-out", SingOutAPIView.as_view(), name="sign-out"),
+    path("profile", ProfileAPIView.as_view(), name="profile"),
+    path("profile/password", ChangePasswordAPIView.as_view(), name="profile-password"),
+    path("profile/avatar", AvatarUpdateAPIView.as_view(), name="profile-avatar"),
 
-    path("categories", CategoryAPIView.as_view()),
-    path("catalog", CatalogAPIView.as_view()),
-    path('banners', BannerListAPIView.as_view()),
-    path('products/popular', PopularListAPIView.as_view()),
-    path('products/limited', LimitedListAPIView.as_view()),
-    path('product/<int:id>', ProductDetailsRetrieveAPIView.as_view()),
-    path('product/<int:id>/reviews', ProductReviewAPIView.as_view()),
-    path('tags', TagListAPIView.as_view()),
-    path('sales', SalesListAPIView.as_view()),
-    path('basket', BasketItemsAPIView.as_view()),
+    path("categories", CategoryAPIView.as_view(), name="categories"),
+    path("catalog", CatalogAPIView.as_view(), name="catalog"),
+    path('banners', BannerListAPIView.as_view(), name='banners'),
+    path('products/popular', PopularListAPIView.as_view(), name='products-popular'),
+    path('products/limited', LimitedListAPIView.as_view(), name='products-limited'),
+    path('products/trending', TrendingListAPIView.as_view(), name='products-trending'),
+    path('products/recent', RecentlyViewedListAPIView.as_view(), name='products-recent'),
+    path('product/<int:id>', ProductDetailsRetrieveAPIView.as_view(), name='product'),
+    path('product/<int:id>/reviews', ProductReviewAPIView.as_view(), name='product-reviews'),
+    path('tags', TagListAPIView.as_view(), name='tags'),
+    path('sales', SalesListAPIView.as_view(), name='sales'),
+    path('basket', BasketItemsAPIView.as_view(), name='basket'),
 
-    path('orders', OrdersAPIView.as_view()),
-    path('order/<int:order_id>', OrderRegistrationAPIView.as_view()),
-    path('payment/<int:order_id>', PaymentAPIView.as_view()),
+    path('orders', OrdersAPIView.as_view(), name='orders'),
+    path('order/<int:order_id>', OrderRegistrationAPIView.as_view(), name='order'),
+    path('payment/<int:order_id>', PaymentAPIView.as_view(), name='payment'),
+
+    path('reports/<str:report>', SalesReportAPIView.as_view(), name='report'),
 ]
@@ -1,3 +1,14 @@
-from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseForbidden
 
-# Create your views here.
+from api import metrics
+
+
+def metrics_view(request):
+    """
+    Метрики в формате Prometheus: с адресов METRICS["ALLOWED_IPS"]
+    или для администраторов
+    """
+    allowed = metrics.get_config()["ALLOWED_IPS"]
+    if request.META.get("REMOTE_ADDR") not in allowed and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+# под ASGI хеширование паролей выполняется в ограниченном пуле (myauth.hashing)
+os.environ.setdefault('PASSWORD_HASHING_OFFLOAD', '1')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -49,11 +50,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.log.RequestLogMiddleware',
+    'api.metrics.MetricsMiddleware',
+    'api.invalidation.InvalidationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'myauth.middleware.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -86,10 +91,66 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # тестовая БД в файле, а не в памяти: тест шины инвалидации
+        # (api.tests) запускает рабочие процессы, работающие с ней
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# "auth" - кеш сессий и пользователей, "shared" - второй уровень кеша
+# ответов каталога (api.response_cache); оба общие для всех процессов на сервере.
+# Файловый кеш здесь заменяет memcached/redis, в продакшене достаточно
+# поменять BACKEND и LOCATION.
+# Файлы кеша - pickle (сессии, пользователи с хешами паролей), поэтому
+# каталог по умолчанию внутри проекта, а не в общем /tmp: там его мог бы
+# заранее создать другой пользователь и подложить свои файлы.
+
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", BASE_DIR / "cache"))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR / 'auth',
+        'TIMEOUT': 60 * 60 * 24 * 14,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR / 'shared',
+        'TIMEOUT': 60 * 10,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Кеш ответов эндпоинтов чтения каталога: LRU в памяти процесса на
+# LOCAL_TIMEOUT секунд и CACHES[ALIAS] на TIMEOUT секунд
+RESPONSE_CACHE = {
+    "ENABLED": True,
+    "ALIAS": "shared",
+    "TIMEOUT": 60,
+    "LOCAL_TIMEOUT": 5,
+    "LOCAL_MAX_ENTRIES": 1000,
+    "STALE_GRACE": 60,
+    "BETA": 1.0,
+    "LOCK_TIMEOUT": 10,
+}
+
+# Сессии читаются из кеша и пишутся в кеш и БД: при промахе кеша
+# (очистка, перезапуск) сессия не теряется
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'auth'
+
+# пользователь сессии вместе с профилем (myauth.backends.PooledHashingBackend)
+USER_CACHE_ALIAS = 'auth'
+USER_CACHE_TIMEOUT = 300
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -109,6 +170,33 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+AUTHENTICATION_BACKENDS = [
+    'myauth.backends.PooledHashingBackend',
+]
+
+# Хешеры с параметрами из PASSWORD_HASHING (myauth.hashing). Новые пароли
+# хешируются первым хешером, остальные хеши пересчитываются им при входе.
+# Для Argon2 нужен пакет argon2-cffi. Параметры подбираются командой bench_hashers.
+PASSWORD_HASHERS = [
+    'myauth.hashing.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'myauth.hashing.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'myauth.hashing.ScryptPasswordHasher',
+]
+
+# OFFLOAD - хешировать в ограниченном пуле (POOL_SIZE потоков или процессов);
+# включается в backend/asgi.py, под WSGI хеширование идет в потоке запроса
+PASSWORD_HASHING = {
+    "OFFLOAD": os.environ.get("PASSWORD_HASHING_OFFLOAD") == "1",
+    "POOL": "thread",
+    "POOL_SIZE": max(1, (os.cpu_count() or 2) // 2),
+    "PBKDF2": {"iterations": 600000},
+    "SCRYPT": {"work_factor": 2 ** 14, "block_size": 8, "parallelism": 1},
+    "ARGON2": {"time_cost": 2, "memory_cost": 102400, "parallelism": 8},
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -129,6 +217,28 @@ STATIC_ROOT = BASE_DIR / "static"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Файлы моделей пишутся через хранилище "default"; для проверки работы
+# с объектным хранилищем без S3 можно указать api.storage.LocalObjectStorage
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
+# Изображения (аватарки, изображения товаров) принимаются потоком во
+# временный каталог с проверкой размера и типа: обработчик api.uploads
+# подключают сами вьюхи загрузки, FILE_UPLOAD_HANDLERS остается по умолчанию.
+# В хранилище файлы записывает фоновый поток
+UPLOADS = {
+    "MAX_SIZE": 5 * 1024 * 1024,
+    "TYPES": ["jpeg", "png", "gif", "webp"],
+    "SPOOL_DIR": CACHE_DIR / "uploads",
+    "ASYNC": True,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -145,6 +255,116 @@ REST_FRAMEWORK = {
 
 }
 
+# Logging
+# https://docs.djangoproject.com/en/4.2/topics/logging/
+# Записи выводятся строками JSON через очередь (api.log): request_id, view
+# и user_id добавляются к каждой записи, сделанной во время запроса.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_context': {'()': 'api.log.RequestContextFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'api.log.JsonFormatter'},
+    },
+    'handlers': {
+        'queue': {
+            'class': 'api.log.QueueStreamHandler',
+            'stream': 'ext://sys.stderr',
+            'formatter': 'json',
+            'filters': ['request_context'],
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': 'INFO',
+    },
+    'loggers': {
+        'django': {
+            'handlers': ['queue'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# manage.py test не выводит логи в JSON поверх отчета тестов (--show-logs - выводит)
+TEST_RUNNER = 'api.test_runner.QuietLogsRunner'
+
+# запросы дольше этого времени (мс) пишутся в api.requests с уровнем WARNING
+SLOW_REQUEST_MS = 1000
+
+# Метрики Prometheus (api.metrics, /metrics). Под gunicorn с несколькими
+# воркерами нужен METRICS_DIR: каждый воркер пишет свои значения в файл
+# этого каталога, /metrics складывает файлы всех воркеров.
+METRICS = {
+    "ENABLED": True,
+    "DIR": os.environ.get("METRICS_DIR"),
+    "FLUSH_INTERVAL": 5,
+    "ALLOWED_IPS": ["127.0.0.1", "::1"],
+}
+
+# Шина инвалидации кешей в памяти процессов (api.invalidation): события
+# пишутся в БД не чаще раза в COALESCE_WINDOW секунд, процессы читают их
+# не чаще раза в POLL_INTERVAL секунд, повторно читая события последних
+# REREAD_WINDOW секунд (события, зафиксированные не по порядку id)
+INVALIDATION = {
+    "ENABLED": True,
+    "POLL_INTERVAL": 1,
+    "COALESCE_WINDOW": 0.2,
+    "RETENTION": 60 * 60,
+    "REREAD_WINDOW": 10,
+}
+
+# Настройки магазина из админки (shopapp.shop_config) хранятся в памяти
+# процесса; версия в CACHES[ALIAS] сверяется раз в CHECK_INTERVAL секунд
+SHOP_CONFIG = {
+    "ALIAS": "shared",
+    "CHECK_INTERVAL": 1,
+}
+
+# Ключи идемпотентности (api.idempotency) для создания, оформления и
+# оплаты заказов: ключ занимается строкой api.IdempotencyKey, результат
+# запроса хранится в ней TTL секунд
+IDEMPOTENCY = {
+    "ENABLED": True,
+    "HEADER": "Idempotency-Key",
+    "TTL": 60 * 60 * 24,
+    "LOCK_TIMEOUT": 30,
+}
+
+# Просмотры товаров (shopapp.trending): буфер процесса записывается раз
+# в FLUSH_INTERVAL секунд или по FLUSH_SIZE просмотров; рейтинг "сейчас
+# смотрят" затухает вдвое за HALF_LIFE секунд. Списки "вы смотрели"
+# хранятся в CACHES[ALIAS].
+TRENDING = {
+    "ENABLED": True,
+    "FLUSH_INTERVAL": 10,
+    "FLUSH_SIZE": 1000,
+    "HALF_LIFE": 6 * 60 * 60,
+    "LIMIT": 8,
+    "ALIAS": "auth",
+    "RECENT_LIMIT": 20,
+}
+
+# Ограничение частоты запросов (api.throttling): емкость корзины токенов
+# и скорость ее пополнения в токенах в секунду для каждого бюджета.
+# BACKEND "locmem" - корзины в памяти процесса, "cache" - в кеше CACHES[CACHE],
+# общие для всех воркеров при общем кеше.
+RATE_LIMITS = {
+    "ENABLED": True,
+    "BACKEND": "locmem",
+    "CACHE": "default",
+    "BUDGETS": {
+        "auth-ip": {"capacity": 20, "rate": 20 / 60},
+        "auth-username": {"capacity": 5, "rate": 5 / 60},
+        "review": {"capacity": 5, "rate": 5 / 3600},
+        "basket": {"capacity": 60, "rate": 1},
+    },
+}
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'My Project API',
     'DESCRIPTION': 'My project description',
@@ -21,8 +21,11 @@ from django.urls import path, include
 
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from api.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name="metrics"),
     path('', include('frontend.urls')),
     path("api/", include("api.urls")),
     path('api/schema/', SpectacularAPIView.as_view(api_version="v1"), name="schema"),
@@ -1,14 +1,18 @@
 from django.contrib import admin
 
+from api.uploads import DeferredUploadAdminMixin
+
 from .models import UserProfile
 
 
 @admin.register(UserProfile)
-class ProfileAdmin(admin.ModelAdmin):
+class ProfileAdmin(DeferredUploadAdminMixin, admin.ModelAdmin):
     list_display = (
             "pk", "user", "name", "surname", "phone", "email", "avatar"
             )
     list_display_links = "pk", "user"
     ordering = ("pk", )
     search_fields = ("name", "surname", "phone", "email")
+    upload_fields = ("avatar", )
+    upload_keep = ("avatar_default.png", )
 
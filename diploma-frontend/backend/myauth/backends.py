@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+from api import metrics
+
+from . import hashing
+
+USER_CACHE_PREFIX = "myauth:user"
+
+
+def _user_cache():
+    return caches[getattr(settings, "USER_CACHE_ALIAS", "default")]
+
+
+def invalidate_user(user_id):
+    _user_cache().delete(f"{USER_CACHE_PREFIX}:{user_id}")
+
+
+class PooledHashingBackend(ModelBackend):
+    """
+    ModelBackend, который проверяет пароль через myauth.hashing:
+    в пуле хеширования, если он включен, с перехешированием устаревших хешей.
+
+    Пользователь сессии загружается вместе с профилем (select_related)
+    и кешируется в кеше USER_CACHE_ALIAS, поэтому аутентифицированный запрос
+    не читает auth_user и myauth_userprofile. Кеш сбрасывается при сохранении
+    и удалении пользователя или профиля (myauth.signals).
+    """
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user_model = get_user_model()
+        if username is None:
+            username = kwargs.get(user_model.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = user_model._default_manager.get_by_natural_key(username)
+        except user_model.DoesNotExist:
+            # хешируем и для несуществующего пользователя, чтобы время ответа
+            # не выдавало, зарегистрировано ли имя
+            hashing.make_password(password)
+            return None
+        if hashing.check_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        cache = _user_cache()
+        key = f"{USER_CACHE_PREFIX}:{user_id}"
+        user = cache.get(key)
+        metrics.inc("cache_requests_total", cache="users", result="miss" if user is None else "hit")
+        if user is None:
+            user_model = get_user_model()
+            user = (
+                user_model._default_manager
+                .select_related("userprofile")
+                .filter(pk=user_id)
+                .first()
+            )
+            if user is None:
+                return None
+            cache.set(key, user, getattr(settings, "USER_CACHE_TIMEOUT", 300))
+        return user if self.user_can_authenticate(user) else None
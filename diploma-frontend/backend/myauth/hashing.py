@@ -0,0 +1,116 @@
+"""
+Хеширование паролей с настраиваемой стоимостью.
+
+Хешеры ниже - стандартные хешеры Django, параметры которых берутся
+из settings.PASSWORD_HASHING. Алгоритм и формат хеша не меняются, поэтому
+при изменении параметров или предпочтительного хешера (первого в
+PASSWORD_HASHERS) пароль перехешируется при следующем входе пользователя.
+Для Argon2 нужен пакет argon2-cffi, scrypt доступен в hashlib.
+
+Под ASGI запросы обрабатываются в потоках без ограничения их числа,
+и одновременные входы занимают все ядра. Если PASSWORD_HASHING["OFFLOAD"]
+включен, хеширование выполняется в ограниченном пуле из POOL_SIZE потоков
+или процессов, а лишние запросы ждут очереди, не отнимая процессор у
+остальных. Под WSGI число одновременных хеширований и так ограничено
+числом воркеров, и хеширование идет в потоке запроса.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+DEFAULT_PASSWORD_HASHING = {
+    "OFFLOAD": False,
+    # "thread" или "process"; процессам нужен запуск через fork,
+    # чтобы унаследовать настроенный Django
+    "POOL": "thread",
+    "POOL_SIZE": max(1, (os.cpu_count() or 2) // 2),
+    "PBKDF2": {"iterations": hashers.PBKDF2PasswordHasher.iterations},
+    "SCRYPT": {
+        "work_factor": hashers.ScryptPasswordHasher.work_factor,
+        "block_size": hashers.ScryptPasswordHasher.block_size,
+        "parallelism": hashers.ScryptPasswordHasher.parallelism,
+    },
+    "ARGON2": {
+        "time_cost": hashers.Argon2PasswordHasher.time_cost,
+        "memory_cost": hashers.Argon2PasswordHasher.memory_cost,
+        "parallelism": hashers.Argon2PasswordHasher.parallelism,
+    },
+}
+
+
+def get_config():
+    overrides = getattr(settings, "PASSWORD_HASHING", {})
+    config = {**DEFAULT_PASSWORD_HASHING, **overrides}
+    for name in ("PBKDF2", "SCRYPT", "ARGON2"):
+        config[name] = {**DEFAULT_PASSWORD_HASHING[name], **overrides.get(name, {})}
+    return config
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    iterations = get_config()["PBKDF2"]["iterations"]
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    work_factor = get_config()["SCRYPT"]["work_factor"]
+    block_size = get_config()["SCRYPT"]["block_size"]
+    parallelism = get_config()["SCRYPT"]["parallelism"]
+    # hashlib.scrypt требует maxmem не меньше 128 * n * r
+    maxmem = 256 * work_factor * block_size
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    time_cost = get_config()["ARGON2"]["time_cost"]
+    memory_cost = get_config()["ARGON2"]["memory_cost"]
+    parallelism = get_config()["ARGON2"]["parallelism"]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(config):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            executor = ProcessPoolExecutor if config["POOL"] == "process" else ThreadPoolExecutor
+            _pool = executor(max_workers=config["POOL_SIZE"])
+        return _pool
+
+
+def run_hashing(func, *args):
+    """
+    Выполняет func(*args) в пуле хеширования, если он включен, иначе сразу.
+    func и аргументы должны сериализоваться pickle для пула процессов.
+    """
+    config = get_config()
+    if not config["OFFLOAD"]:
+        return func(*args)
+    return _get_pool(config).submit(func, *args).result()
+
+
+def _check(raw_password, encoded):
+    """
+    Проверка пароля и признак того, что хеш нужно пересчитать
+    """
+    outdated = []
+    valid = hashers.check_password(raw_password, encoded, setter=outdated.append)
+    return valid, bool(outdated)
+
+
+def make_password(raw_password):
+    return run_hashing(hashers.make_password, raw_password)
+
+
+def check_password(user, raw_password):
+    """
+    То же, что user.check_password: при верном пароле и устаревшем хеше
+    пароль хешируется заново текущим хешером и сохраняется
+    """
+    valid, outdated = run_hashing(_check, raw_password, user.password)
+    if valid and outdated:
+        user.password = make_password(raw_password)
+        user.save(update_fields=["password"])
+    return valid
@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from shopapp.models import Product
+
+# настройки до перехода на кеш сессий и пользователей
+BASELINE = {
+    "SESSION_ENGINE": "django.contrib.sessions.backends.db",
+    "AUTHENTICATION_BACKENDS": ["django.contrib.auth.backends.ModelBackend"],
+}
+
+
+class Command(BaseCommand):
+    """
+    Считает запросы к БД на один аутентифицированный запрос к API
+    с сессиями в БД и загрузкой пользователя из auth_user (как раньше)
+    и с текущими настройками. Каждый адрес запрашивается дважды,
+    учитывается второй запрос, когда кеши уже заполнены. Запросы
+    на запись выполняются в транзакции, которая откатывается.
+    """
+    help = "Запросы к БД на аутентифицированный запрос до и после кеширования сессий"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", help="По умолчанию - первый пользователь с профилем")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.filter(userprofile__isnull=False)
+        if options["username"]:
+            users = users.filter(username=options["username"])
+        user = users.first()
+        product = Product.objects.order_by("pk").first()
+        if user is None or product is None:
+            raise CommandError("Нужны пользователь с профилем и хотя бы один товар")
+
+        requests = [
+            ("GET", "/api/profile", None),
+            ("GET", "/api/orders", None),
+            ("GET", "/api/basket", None),
+            ("POST", f"/api/product/{product.pk}/reviews", {"text": "bench", "rate": 5}),
+        ]
+        with override_settings(**BASELINE):
+            before = self.count_queries(user, requests)
+        after = self.count_queries(user, requests)
+
+        self.stdout.write(f"{'запрос':<40} {'до':>4} {'после':>6}")
+        for (method, url, _), old, new in zip(requests, before, after):
+            self.stdout.write(f"{method + ' ' + url:<40} {old:>4} {new:>6}")
+
+    def count_queries(self, user, requests):
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        counts = []
+        for method, url, data in requests:
+            with transaction.atomic():
+                for _ in range(2):
+                    # журнал запросов ограничен 9000 записями, а на заполненном
+                    # журнале CaptureQueriesContext насчитает 0
+                    reset_queries()
+                    with CaptureQueriesContext(connection) as queries:
+                        if method == "GET":
+                            client.get(url)
+                        else:
+                            client.post(url, data, content_type="application/json")
+                counts.append(len(queries))
+                transaction.set_rollback(True)
+        return counts
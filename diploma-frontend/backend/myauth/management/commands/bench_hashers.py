@@ -0,0 +1,99 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myauth import hashing
+
+PASSWORD = "correct horse battery staple"
+
+# наборы параметров для сравнения: текущие из настроек и соседние значения
+CANDIDATES = {
+    "pbkdf2": (
+        hashing.PBKDF2PasswordHasher,
+        [{"iterations": n} for n in (260000, 390000, 600000, 870000)],
+    ),
+    "scrypt": (
+        hashing.ScryptPasswordHasher,
+        [
+            {"work_factor": 2 ** 14, "block_size": 8, "parallelism": 1},
+            {"work_factor": 2 ** 15, "block_size": 8, "parallelism": 1},
+            {"work_factor": 2 ** 16, "block_size": 8, "parallelism": 1},
+        ],
+    ),
+    "argon2": (
+        hashing.Argon2PasswordHasher,
+        [
+            {"time_cost": 2, "memory_cost": 19456, "parallelism": 1},
+            {"time_cost": 2, "memory_cost": 65536, "parallelism": 1},
+            {"time_cost": 2, "memory_cost": 102400, "parallelism": 8},
+            {"time_cost": 3, "memory_cost": 65536, "parallelism": 4},
+        ],
+    ),
+}
+
+
+class Command(BaseCommand):
+    """
+    Замеряет время хеширования пароля для нескольких наборов параметров
+    каждого алгоритма: миллисекунды на хеш, хешей в секунду на ядро и
+    хешей в секунду при --threads параллельных потоках. Помогает выбрать
+    параметры PASSWORD_HASHING: время одного хеша около --target-ms
+    при приемлемой пропускной способности на ядро.
+    """
+    help = "Производительность хешеров паролей при разных параметрах"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--algorithm", choices=sorted(CANDIDATES), action="append",
+            help="По умолчанию - все доступные",
+        )
+        parser.add_argument("--rounds", type=int, default=5, help="Хешей на замер")
+        parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--target-ms", type=float, default=250.0)
+
+    def handle(self, *args, **options):
+        if options["rounds"] < 1 or options["threads"] < 1:
+            raise CommandError("--rounds и --threads должны быть положительными")
+        cores = os.cpu_count() or 1
+        self.stdout.write(
+            f"Ядер: {cores}, потоков: {options['threads']}, хешей на замер: {options['rounds']}"
+        )
+        self.stdout.write(f"{'алгоритм':<8} {'мс/хеш':>8} {'хеш/с/ядро':>11} {'хеш/с всего':>12}  параметры")
+
+        for algorithm in options["algorithm"] or sorted(CANDIDATES):
+            hasher_class, candidates = CANDIDATES[algorithm]
+            for params in candidates:
+                hasher = hasher_class()
+                for name, value in params.items():
+                    setattr(hasher, name, value)
+                if algorithm == "scrypt":
+                    hasher.maxmem = 256 * hasher.work_factor * hasher.block_size
+                try:
+                    single = self.measure(hasher, options["rounds"], 1)
+                except ValueError as exc:
+                    # библиотека алгоритма не установлена (argon2-cffi)
+                    self.stdout.write(f"{algorithm:<8} недоступен: {exc}")
+                    break
+                total = self.measure(hasher, options["rounds"], options["threads"])
+                ms = 1000 / single
+                mark = "  <-" if abs(ms - options["target_ms"]) <= options["target_ms"] * 0.25 else ""
+                self.stdout.write(
+                    f"{algorithm:<8} {ms:>8.1f} {single:>11.2f} {total:>12.2f}  "
+                    f"{', '.join(f'{k}={v}' for k, v in params.items())}{mark}"
+                )
+
+    @staticmethod
+    def measure(hasher, rounds, threads):
+        """
+        Хешей в секунду при threads параллельных потоках
+        """
+        def work(_):
+            hasher.encode(PASSWORD, hasher.salt())
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            started = time.perf_counter()
+            list(pool.map(work, range(rounds * threads)))
+            elapsed = time.perf_counter() - started
+        return rounds * threads / elapsed
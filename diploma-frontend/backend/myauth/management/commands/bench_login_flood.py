@@ -0,0 +1,129 @@
+import json
+import logging
+import queue
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from api.throttling import get_config, get_store
+
+FLOOD, PROBE = "flood", "probe"
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочная проверка доступности воркеров при переборе паролей.
+
+    Запросы попадают в общую очередь и обслуживаются --workers потоками,
+    как запросы в очереди gunicorn с фиксированным числом воркеров. В очередь
+    с постоянной частотой поступают неверные входы (--flood-rate в секунду)
+    и запросы каталога (--probe-rate в секунду). Прогон выполняется без
+    ограничения частоты и с ним; для каждого выводится, сколько запросов
+    каталога обслужено и с какой задержкой (ожидание в очереди + обработка)
+    и сколько входов дошло до хеширования пароля.
+    """
+    help = "Доступность воркеров при переборе паролей, с ограничением частоты и без"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duration", type=float, default=5.0, help="Длительность прогона, с")
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--flood-rate", type=float, default=50.0)
+        parser.add_argument("--probe-rate", type=float, default=10.0)
+        parser.add_argument("--probe-url", default="/api/categories")
+        parser.add_argument("--username", default="flood-victim")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["flood_rate"] <= 0 or options["probe_rate"] <= 0:
+            raise CommandError("--workers и частоты запросов должны быть положительными")
+
+        # ответы 429 и 500 на неверный пароль иначе засыпают вывод
+        request_logger = logging.getLogger("django.request")
+        request_logger.disabled = True
+        try:
+            for title, enabled in (("без ограничения", False), ("с ограничением", True)):
+                get_store().clear()
+                with override_settings(RATE_LIMITS={**get_config(), "ENABLED": enabled}):
+                    self.report(title, *self.run(options))
+        finally:
+            request_logger.disabled = False
+            get_store().clear()
+
+    def report(self, title, statuses, latencies, queued):
+        latencies = sorted(latencies)
+        flood = statuses[FLOOD]
+        self.stdout.write(title)
+        self.stdout.write(
+            f"  каталог: обслужено {len(latencies)}, осталось в очереди {queued[PROBE]}, "
+            f"p50 {self.percentile(latencies, 50):.1f} мс, "
+            f"p95 {self.percentile(latencies, 95):.1f} мс"
+        )
+        self.stdout.write(
+            f"  входы: обслужено {sum(flood.values())}, осталось в очереди {queued[FLOOD]}, "
+            f"отклонено 429: {flood[429]}, "
+            f"дошло до хеширования: {sum(flood.values()) - flood[429]}"
+        )
+
+    @staticmethod
+    def percentile(values, percent):
+        if not values:
+            return 0.0
+        if len(values) == 1:
+            return values[0]
+        return statistics.quantiles(values, n=100)[percent - 1]
+
+    def run(self, options):
+        requests = queue.Queue()
+        deadline = time.monotonic() + options["duration"]
+        statuses = {FLOOD: Counter(), PROBE: Counter()}
+        latencies = []
+        lock = threading.Lock()
+        body = json.dumps({"username": options["username"], "password": "wrong-password"})
+
+        def send(client, kind):
+            if kind == FLOOD:
+                return client.post("/api/sign-in", body, content_type="text/plain")
+            return client.get(options["probe_url"])
+
+        def worker():
+            client = Client(HTTP_HOST="localhost")
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        kind, enqueued = requests.get(timeout=0.05)
+                    except queue.Empty:
+                        continue
+                    status = send(client, kind).status_code
+                    with lock:
+                        statuses[kind][status] += 1
+                        if kind == PROBE:
+                            latencies.append((time.monotonic() - enqueued) * 1000)
+            finally:
+                connection.close()
+
+        def generator(kind, rate):
+            interval = 1 / rate
+            next_at = time.monotonic()
+            while next_at < deadline:
+                time.sleep(max(0.0, next_at - time.monotonic()))
+                requests.put((kind, time.monotonic()))
+                next_at += interval
+
+        threads = [threading.Thread(target=worker) for _ in range(options["workers"])]
+        threads.append(threading.Thread(target=generator, args=(FLOOD, options["flood_rate"])))
+        threads.append(threading.Thread(target=generator, args=(PROBE, options["probe_rate"])))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        queued = Counter()
+        while not requests.empty():
+            kind, _ = requests.get_nowait()
+            queued[kind] += 1
+        return statuses, latencies, queued
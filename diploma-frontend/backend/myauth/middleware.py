@@ -0,0 +1,31 @@
+from django.utils.functional import SimpleLazyObject
+
+from .models import UserProfile
+
+
+def get_profile(request):
+    """
+    Профиль пользователя запроса. Пользователь, загруженный
+    PooledHashingBackend, уже содержит профиль (select_related), иначе
+    профиль читается одним запросом и остается в кеше связи user.userprofile.
+    Для анонимного пользователя и пользователя без профиля -
+    UserProfile.DoesNotExist, как при обращении к user.userprofile.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        raise UserProfile.DoesNotExist("Анонимный пользователь не имеет профиля")
+    return user.userprofile
+
+
+class ProfileMiddleware:
+    """
+    Добавляет request.profile - профиль текущего пользователя, который
+    загружается при первом обращении и переиспользуется до конца запроса.
+    Должен стоять после AuthenticationMiddleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.profile = SimpleLazyObject(lambda: get_profile(request))
+        return self.get_response(request)
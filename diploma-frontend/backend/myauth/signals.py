@@ -0,0 +1,16 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .backends import invalidate_user
+from .models import UserProfile
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
@@ -1,3 +1,207 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from api import throttling
+
+from . import hashing
+from .models import UserProfile
+
+# кеши в памяти: тесты не должны читать файловый кеш рабочей установки
+TEST_CACHES = {
+    alias: {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": alias}
+    for alias in ("default", "auth", "shared")
+}
+
+
+def png_file(name="avatar.png"):
+    content = io.BytesIO()
+    Image.new("RGB", (1, 1)).save(content, "PNG")
+    return SimpleUploadedFile(name, content.getvalue(), content_type="image/png")
+
+
+def profile_queries(queries):
+    """
+    Отдельные запросы профиля: до ProfileMiddleware каждая вьюха
+    выполняла UserProfile.objects.get(user=request.user)
+    """
+    return [
+        query["sql"] for query in queries
+        if query["sql"].startswith("SELECT") and 'FROM "myauth_userprofile"' in query["sql"]
+    ]
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ProfileQueriesTestCase(TestCase):
+    """
+    Запросы к БД аутентифицированных вьюх: профиль приходит вместе
+    с пользователем сессии и не читается отдельным запросом
+    """
+    def setUp(self):
+        self.user = User.objects.create_user("buyer", password="secret")
+        self.profile = UserProfile.objects.create(
+            user=self.user, name="Иван", surname="Иванов", patronymic="Иванович",
+            phone="+70000000000", email="buyer@example.com", avatar="avatar_default.png",
+        )
+        self.client.force_login(self.user)
+        # пользователь сессии с профилем попадает в кеш первым запросом
+        self.client.get("/api/profile")
+
+    def assertProfileNotQueried(self, num, func, *args, **kwargs):
+        """
+        Запрос выполняет num запросов к БД, среди них нет запроса профиля
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = func(*args, **kwargs)
+        self.assertEqual(profile_queries(queries), [])
+        self.assertEqual(len(queries), num, "\n".join(query["sql"] for query in queries))
+        return response
+
+
+class ProfileAPIViewTests(ProfileQueriesTestCase):
+    def test_get(self):
+        response = self.assertProfileNotQueried(0, self.client.get, "/api/profile")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["email"], "buyer@example.com")
+
+    def test_post(self):
+        # UPDATE профиля
+        response = self.assertProfileNotQueried(
+            1, self.client.post, "/api/profile",
+            {"fullName": "Петров Петр Петрович", "phone": "+71111111111"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.surname, "Петров")
+
+
+class AvatarUpdateAPIViewTests(ProfileQueriesTestCase):
+    def setUp(self):
+        super().setUp()
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir, ignore_errors=True)
+        uploads = override_settings(UPLOADS={"SPOOL_DIR": spool_dir})
+        uploads.enable()
+        self.addCleanup(uploads.disable)
+
+    def test_post(self):
+        avatar = png_file()
+        # файл записывается в хранилище после ответа, запрос к БД не нужен
+        response = self.assertProfileNotQueried(
+            0, self.client.post, "/api/profile/avatar", {"avatar": avatar},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_rejected_type(self):
+        # обработчик изображений подключен к вьюхе, а не глобально
+        self.assertNotIn("api.uploads.ImageUploadHandler", settings.FILE_UPLOAD_HANDLERS)
+        text = SimpleUploadedFile("avatar.png", b"not an image at all", content_type="image/png")
+        response = self.client.post("/api/profile/avatar", {"avatar": text})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("допустимы только изображения", response.json()["error"])
+
+
+class HashingPoolTests(TestCase):
+    """
+    Пул хеширования ограничивает число одновременных хеширований POOL_SIZE
+    """
+    def setUp(self):
+        hashing._pool = None
+        self.addCleanup(self.reset_pool)
+
+    def reset_pool(self):
+        if hashing._pool is not None:
+            hashing._pool.shutdown()
+        hashing._pool = None
+
+    @override_settings(PASSWORD_HASHING={"OFFLOAD": True, "POOL": "thread", "POOL_SIZE": 2})
+    def test_bounded(self):
+        lock = threading.Lock()
+        release = threading.Event()
+        running, peak = [0], [0]
+
+        def work():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            release.wait(5)
+            with lock:
+                running[0] -= 1
+            return threading.current_thread().name
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(hashing.run_hashing(work)))
+            for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        # задачи держат пул, пока их не отпустят: больше двух не запустится
+        deadline = time.monotonic() + 5
+        while running[0] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(running[0], 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 6)
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(len(set(results)), 2)
+
+    @override_settings(PASSWORD_HASHING={"OFFLOAD": False})
+    def test_inline(self):
+        self.assertEqual(hashing.run_hashing(threading.current_thread), threading.current_thread())
+        self.assertIsNone(hashing._pool)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RehashOnLoginTests(TestCase):
+    """
+    При входе хеш устаревшим хешером пересчитывается первым из PASSWORD_HASHERS
+    """
+    def setUp(self):
+        # бюджеты входа общие для всех тестов процесса
+        throttling._local_store.clear()
+        self.user = User.objects.create(
+            username="buyer", password=make_password("secret", hasher="pbkdf2_sha1"),
+        )
+
+    def sign_in(self, password):
+        return self.client.post(
+            "/api/sign-in", json.dumps({"username": "buyer", "password": password}),
+            content_type="application/json",
+        )
+
+    def test_rehash(self):
+        self.assertEqual(self.sign_in("secret").status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$"))
+        self.assertTrue(self.user.check_password("secret"))
+
+    def test_wrong_password(self):
+        self.assertEqual(self.sign_in("wrong").status_code, 500)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha1$"))
+
+    @override_settings(PASSWORD_HASHING={"OFFLOAD": True, "POOL": "thread", "POOL_SIZE": 1})
+    def test_rehash_offloaded(self):
+        self.addCleanup(setattr, hashing, "_pool", None)
+        self.assertEqual(self.sign_in("secret").status_code, 200)
+        self.assertIsNotNone(hashing._pool)
+        hashing._pool.shutdown()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$"))
@@ -1,15 +1,19 @@
 import json
-import os
 
 from django.conf import settings
-from django.contrib.auth import authenticate, login, logout, hashers
+from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import UploadedFile
 from django.http import JsonResponse
 from rest_framework.permissions import IsAuthenticated
 
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api import uploads
+from api.throttling import AUTH_THROTTLES
+
+from . import hashing
 from .models import UserProfile
 from .serializers import ProfileSerializer
 from .forms import ProfileForm
@@ -19,6 +23,8 @@ class SignInAPIView(APIView):
     """
     Класс, отвечающий за вход пользователя в систему.
     """
+    throttle_classes = AUTH_THROTTLES
+
     def post(self, request):
         data = json.loads(request.body)
         username = data['username']
@@ -43,6 +49,8 @@ class SignUpAPIView(APIView):
     """
     Класс, отвечающий за регистрацию новых пользователей
     """
+    throttle_classes = AUTH_THROTTLES
+
     def post(self, request):
         data = json.loads(request.body)
         username = data['username']
@@ -50,18 +58,17 @@ class SignUpAPIView(APIView):
         name = data['name']
         email = username + '@django.ru'
         user = User.objects.create(username=username, email=email)
-        user.password = hashers.make_password(password)
+        user.password = hashing.make_password(password)
         user.save()
         # создается профиль пользователя с аватаркой "по-умолчанию"
         UserProfile.objects.create(
             user=user, email=email,
             avatar='avatar_default.png',
         )
-        user = authenticate(request, username=username, password=password)
-        if user is not None:
-            login(request, user)
-            return Response(status=200)
-        return Response(status=500)
+        # пароль только что задан, повторно проверять его через authenticate
+        # незачем - это еще одно хеширование
+        login(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
+        return Response(status=200)
 
 
 class ProfileAPIView(APIView):
@@ -76,9 +83,8 @@ class ProfileAPIView(APIView):
     """
 
     def get(self, request):
-        profile = UserProfile.objects.get(user=request.user)
+        profile = request.profile
         serializer = ProfileSerializer(profile)
-        print(serializer.data)
         return Response(serializer.data)
 
     def post(self, request):
@@ -88,7 +94,7 @@ class ProfileAPIView(APIView):
         patronymic = full_name[2]
         phone = request.data['phone']
 
-        profile = UserProfile.objects.get(user=request.user)
+        profile = request.profile
         profile.name = name
         profile.surname = surname
         profile.patronymic = patronymic
@@ -107,27 +113,28 @@ class ProfileAPIView(APIView):
         return JsonResponse(data)
 
 
-class AvatarUpdateAPIView(APIView):
+class AvatarUpdateAPIView(uploads.ImageUploadMixin, APIView):
     """
         Класс отвечающий за смену аватарки пользователя.
-        А так же удаление старого файла аватарки
+        Файл проверяется при приеме (api.uploads), а запись нового файла
+        и удаление старого выполняются в фоне после ответа
     """
     permission_classes = [IsAuthenticated, ]
 
     def post(self, request):
-        profile = UserProfile.objects.get(user=request.user)
-        avatar_file = request.FILES.get('avatar')
-        avatar_file_path = os.path.join(settings.MEDIA_ROOT, str(profile.avatar))
-
-        # если получили новый файл аватара, то удалим
-        # старый, если он конечно доступен и это не аватарка по-умолчанию
-        if avatar_file:
-            if os.path.isfile(avatar_file_path) and profile.avatar != 'avatar_default.png':
-                os.remove(avatar_file_path)
-
+        profile = request.profile
         form = ProfileForm(request.POST, request.FILES, instance=profile)
+        errors = uploads.get_upload_errors(request)
+        if errors:
+            return Response({"error": "; ".join(errors)}, status=400)
+
         if form.is_valid():
-            form.save()
+            avatar = form.cleaned_data.get('avatar')
+            if isinstance(avatar, UploadedFile):
+                # аватарку "по-умолчанию" используют все новые профили, ее не удаляем
+                uploads.save_in_background(
+                    profile, 'avatar', avatar, keep={'avatar_default.png'}
+                )
             return Response(status=200)
         return Response(status=500)
 
@@ -137,13 +144,16 @@ class ChangePasswordAPIView(APIView):
     Класс, отвечающий за смену пароля пользователя.
     """
     permission_classes = [IsAuthenticated, ]
+    throttle_classes = AUTH_THROTTLES
+    # проверка текущего пароля и хеширование нового
+    throttle_cost = 2
 
     def post(self, request):
         user = request.user
         current_password = request.data.get('currentPassword')
         new_password = request.data.get('newPassword')
-        if user.check_password(current_password):
-            user.set_password(new_password)
+        if hashing.check_password(user, current_password):
+            user.password = hashing.make_password(new_password)
             user.save()
             return Response(status=200)
         return Response(status=500)
@@ -1,5 +1,8 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
+from api.uploads import DeferredUploadAdminMixin
+
+from . import bulk
 from .models import (
     Category,
     Subcategory,
@@ -12,7 +15,34 @@ from .models import (
     BasketItem,
     DeliveryPrices,
     Order,
+    ArchivedOrder,
 )
+from .forms import ProductBulkActionForm
+from .paginators import EstimatedCountPaginator
+
+
+class BulkActionsMixin:
+    """
+    Запуск массовой операции из shopapp.bulk с выводом результата
+    и предпросмотра изменений в сообщении админки
+    """
+
+    def run_bulk(self, request, operation, *args, dry_run=False):
+        try:
+            result = operation(*args, dry_run=dry_run)
+        except bulk.BulkOperationError as exc:
+            self.message_user(request, str(exc), messages.ERROR)
+            return
+        preview = "; ".join(
+            f"#{row['id']} {row['title']}: {row['before']} -> {row['after']}"
+            for row in result.preview
+        )
+        prefix = "Проверка, изменения не сохранены" if result.dry_run else "Готово"
+        self.message_user(
+            request,
+            f"{prefix}: затронуто товаров - {result.affected}. {preview}",
+            messages.INFO if result.dry_run else messages.SUCCESS,
+        )
 
 
 @admin.register(Category)
@@ -26,48 +56,131 @@ class CategoryAdmin(admin.ModelAdmin):
 class SubcategoryAdmin(admin.ModelAdmin):
     list_display = "pk", "title", "image"
     list_display_links = "pk", "title"
+    # поиск по префиксу названия идет по индексу shopapp_subcategory_title_prefix
+    search_fields = "^title",
+
+
+class SpecificationInline(admin.TabularInline):
+    model = Specification
+    fields = "position", "name", "value"
+    extra = 0
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = "pk", "title", "price", "count"
+class ProductAdmin(BulkActionsMixin, admin.ModelAdmin):
+    list_display = "pk", "title", "price", "count", "category"
     list_display_links = "pk", "title"
+    list_select_related = "category",
+    list_filter = "category", "subcategory"
+    autocomplete_fields = "category", "subcategory", "tags"
+    inlines = [SpecificationInline, ]
+    # поиск по префиксу названия (istartswith) идет по индексу shopapp_product_title_prefix
+    # (миграция 0015), "=pk" - по первичному ключу
+    search_fields = "=pk", "^title"
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    action_form = ProductBulkActionForm
+    actions = "apply_discount", "remove_discount", "change_prices"
+
+    def get_action_params(self, request):
+        form = self.action_form(request.POST)
+        form.is_valid()
+        return form.cleaned_data
+
+    @admin.action(description="Назначить скидку (процент, с, по)")
+    def apply_discount(self, request, queryset):
+        params = self.get_action_params(request)
+        if params.get("percent") is None or not params.get("date_from") or not params.get("date_to"):
+            self.message_user(request, "Укажите процент скидки и даты распродажи", messages.ERROR)
+            return
+        self.run_bulk(
+            request, bulk.apply_discount, queryset,
+            params["percent"], params["date_from"], params["date_to"],
+            dry_run=params.get("dry_run", False),
+        )
+
+    @admin.action(description="Снять скидку")
+    def remove_discount(self, request, queryset):
+        params = self.get_action_params(request)
+        self.run_bulk(request, bulk.remove_discount, queryset, dry_run=params.get("dry_run", False))
+
+    @admin.action(description="Изменить цену на процент")
+    def change_prices(self, request, queryset):
+        params = self.get_action_params(request)
+        if params.get("percent") is None:
+            self.message_user(request, "Укажите процент изменения цены", messages.ERROR)
+            return
+        self.run_bulk(
+            request, bulk.change_prices, queryset, params["percent"], dry_run=params.get("dry_run", False)
+        )
 
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
-    list_display = "pk", "name"
+    list_display = "pk", "name", "slug"
     list_display_links = "pk", "name"
+    search_fields = "^name", "^slug"
+    prepopulated_fields = {"slug": ("name",)}
 
 
 @admin.register(Specification)
-class Specification(admin.ModelAdmin):
-    list_display = "pk", "name", "value"
+class SpecificationAdmin(admin.ModelAdmin):
+    list_display = "pk", "product", "position", "name", "value"
     list_display_links = "pk", "name", "value"
+    list_select_related = "product",
+    autocomplete_fields = "product",
+    search_fields = "^name", "^value"
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
 
 @admin.register(ProductImage)
-class ProductImageAdmin(admin.ModelAdmin):
+class ProductImageAdmin(DeferredUploadAdminMixin, admin.ModelAdmin):
     list_display = "pk", "product", "image"
     list_display_links = "pk", "product", "image"
+    list_select_related = "product",
+    autocomplete_fields = "product",
+    search_fields = "=product__pk", "^product__title"
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    upload_fields = "image",
+    upload_create = True
 
 
 @admin.register(Sale)
-class SaleAdmin(admin.ModelAdmin):
+class SaleAdmin(BulkActionsMixin, admin.ModelAdmin):
     list_display = "pk", "product", "date_from", "date_to", "discount"
     list_display_links = "pk", "product",
+    list_select_related = "product",
+    autocomplete_fields = "product",
+    search_fields = "=product__pk", "^product__title"
+    actions = "end_sales",
+
+    @admin.action(description="Завершить выбранные распродажи")
+    def end_sales(self, request, queryset):
+        products = Product.objects.filter(sale_info__in=queryset)
+        self.run_bulk(request, bulk.remove_discount, products)
 
 
 @admin.register(Basket)
 class BasketAdmin(admin.ModelAdmin):
     list_display = "pk", "user", "created_at"
     list_display_links = "pk", "user",
+    list_select_related = "user",
+    autocomplete_fields = "user",
+    search_fields = "=pk", "^user__username"
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
 
 @admin.register(BasketItem)
 class BasketItemAdmin(admin.ModelAdmin):
     list_display = "pk", "basket", "product", "quantity"
     list_display_links = "pk", "basket", "product"
+    list_select_related = "basket", "product"
+    autocomplete_fields = "basket", "product"
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
 
 @admin.register(DeliveryPrices)
@@ -80,5 +193,21 @@ class DeliveryPricesAdmin(admin.ModelAdmin):
 class OrderAdmin(admin.ModelAdmin):
     list_display = "pk", "full_name", "created_at", "city", "status", "archived"
     list_display_links = "pk", "full_name", "created_at", "city"
-
-
+    list_select_related = "full_name",
+    list_filter = "archived",
+    autocomplete_fields = "full_name", "basket", "products"
+    search_fields = "=pk", "^full_name__surname", "^full_name__email"
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = "order_id", "full_name", "created_at", "total_cost", "status"
+    list_display_links = "order_id", "full_name"
+    list_select_related = "full_name",
+    autocomplete_fields = "full_name",
+    search_fields = "=order_id",
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
@@ -0,0 +1,186 @@
+"""
+Массовые операции над товарами: скидки, цены и остатки.
+
+Каждая операция выполняется одной транзакцией набором UPDATE/INSERT
+на пачку строк, а не сохранением объектов по одному; цена со скидкой
+(Product.effective_price) пересчитывается в той же транзакции. В режиме dry_run
+изменения выполняются и откатываются, поэтому количество затронутых
+строк и предпросмотр совпадают с реальным запуском.
+После фиксации отправляется один сигнал products_changed на всю операцию.
+"""
+from decimal import Decimal
+from itertools import islice
+from typing import NamedTuple
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Round
+
+from .models import Product, Sale
+from .pricing import refresh_effective_prices
+from .signals import products_changed
+
+BATCH_SIZE = 1000
+PREVIEW_SIZE = 10
+HUNDRED = Decimal(100)
+
+
+class BulkResult(NamedTuple):
+    affected: int
+    preview: list
+    dry_run: bool
+
+
+class BulkOperationError(ValueError):
+    """
+    Неверные параметры массовой операции
+    """
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _run(operation, preview_ids, value_of, dry_run):
+    """
+    Выполняет operation() в транзакции, собирает предпросмотр до и после
+    для первых товаров и при dry_run откатывает изменения.
+    operation возвращает множество id затронутых товаров.
+    """
+    with transaction.atomic():
+        before = value_of(preview_ids)
+        product_ids = operation()
+        after = value_of(preview_ids)
+        preview = [
+            {"id": pk, "title": title, "before": value, "after": after[pk][1]}
+            for pk, (title, value) in before.items()
+        ]
+        if dry_run:
+            transaction.set_rollback(True)
+        else:
+            transaction.on_commit(
+                lambda: products_changed.send(sender=Product, product_ids=product_ids)
+            )
+    return BulkResult(affected=len(product_ids), preview=preview, dry_run=dry_run)
+
+
+def _preview_ids(products):
+    return list(products.order_by("pk").values_list("pk", flat=True)[:PREVIEW_SIZE])
+
+
+def _field_values(field):
+    def value_of(ids):
+        return {
+            pk: (title, value)
+            for pk, title, value in Product.objects.filter(pk__in=ids).values_list(
+                "pk", "title", field
+            )
+        }
+    return value_of
+
+
+def _sale_values(ids):
+    sales = dict(Sale.objects.filter(product_id__in=ids).values_list("product_id", "discount"))
+    return {
+        pk: (title, sales.get(pk))
+        for pk, title in Product.objects.filter(pk__in=ids).values_list("pk", "title")
+    }
+
+
+def apply_discount(products, percent, date_from, date_to, dry_run=False):
+    """
+    Назначает товарам распродажу со скидкой percent процентов от текущей цены
+    на период date_from - date_to. Существующие распродажи перезаписываются
+    через INSERT ... ON CONFLICT (product_id) DO UPDATE.
+    """
+    percent = Decimal(percent)
+    if not 0 < percent < 100:
+        raise BulkOperationError("Скидка должна быть в диапазоне от 0 до 100 процентов")
+    if date_from > date_to:
+        raise BulkOperationError("Дата начала распродажи позже даты окончания")
+
+    def operation():
+        product_ids = set()
+        rows = products.order_by().values_list("pk", "price").iterator(chunk_size=BATCH_SIZE)
+        for batch in _batched(rows, BATCH_SIZE):
+            Sale.objects.bulk_create(
+                [
+                    Sale(
+                        product_id=pk,
+                        discount=(price * percent / HUNDRED).quantize(Decimal("0.01")),
+                        date_from=date_from,
+                        date_to=date_to,
+                    )
+                    for pk, price in batch
+                ],
+                update_conflicts=True,
+                unique_fields=["product"],
+                update_fields=["discount", "date_from", "date_to"],
+            )
+            product_ids.update(pk for pk, _ in batch)
+        refresh_effective_prices(product_ids)
+        return product_ids
+
+    return _run(operation, _preview_ids(products), _sale_values, dry_run)
+
+
+def remove_discount(products, dry_run=False):
+    """
+    Снимает распродажу с товаров одним DELETE
+    """
+    def operation():
+        sales = Sale.objects.filter(product__in=products.order_by().values("pk"))
+        product_ids = set(sales.values_list("product_id", flat=True))
+        sales.delete()
+        refresh_effective_prices(product_ids)
+        return product_ids
+
+    return _run(operation, _preview_ids(products), _sale_values, dry_run)
+
+
+def change_prices(products, percent, dry_run=False):
+    """
+    Меняет цену товаров на percent процентов (отрицательное значение - снижение)
+    одним UPDATE ... SET price = ROUND(price * k, 2)
+    """
+    percent = Decimal(percent)
+    if percent <= -100:
+        raise BulkOperationError("Цена не может стать нулевой или отрицательной")
+    factor = (HUNDRED + percent) / HUNDRED
+
+    def operation():
+        product_ids = set(products.values_list("pk", flat=True))
+        Product.objects.filter(pk__in=products.order_by().values("pk")).update(
+            price=Round(F("price") * factor, 2)
+        )
+        refresh_effective_prices(product_ids)
+        return product_ids
+
+    return _run(operation, _preview_ids(products), _field_values("price"), dry_run)
+
+
+def restock(counts, mode="add", dry_run=False):
+    """
+    Обновляет остатки товаров по словарю {id товара: количество}.
+    mode="add" прибавляет количество к остатку, mode="set" устанавливает его.
+    Один UPDATE с CASE на пачку из BATCH_SIZE товаров.
+    """
+    if mode not in ("add", "set"):
+        raise BulkOperationError(f"Неизвестный режим {mode}")
+
+    def operation():
+        product_ids = set()
+        for batch in _batched(counts.items(), BATCH_SIZE):
+            value = Case(
+                *[When(pk=pk, then=Value(count)) for pk, count in batch],
+                default=Value(0) if mode == "add" else F("count"),
+            )
+            queryset = Product.objects.filter(pk__in=[pk for pk, _ in batch])
+            queryset.update(count=F("count") + value if mode == "add" else value)
+            product_ids.update(queryset.values_list("pk", flat=True))
+        return product_ids
+
+    preview_ids = sorted(counts)[:PREVIEW_SIZE]
+    return _run(operation, preview_ids, _field_values("count"), dry_run)
@@ -0,0 +1,402 @@
+"""
+Построение запросов каталога товаров: разбор и проверка параметров API,
+фильтрация, сортировка и подсчет фасетов.
+"""
+import math
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import NamedTuple
+
+from django.db import connections
+from django.db.models import Count, Max, Min, Q
+from django.db.models.lookups import IContains
+
+from .models import Product, Specification
+from .tags import tag_ids
+
+# сколько самых частых тегов возвращать в фасете
+FACET_TAGS_LIMIT = 50
+
+# допустимые значения параметра sort и соответствующие им индексированные поля;
+# цена - с учетом действующей распродажи (shopapp.pricing)
+SORT_FIELDS = {
+    "id": "pk",
+    "title": "title",
+    "price": "effective_price",
+    "rating": "rating",
+    "date": "date",
+    "reviews": "reviews_count",
+}
+SORT_TYPES = {"inc": False, "dec": True}
+MAX_PAGE_SIZE = 100
+MAX_TAGS = 20
+MAX_SPECS = 10
+SPEC_PREFIX = "filter[spec]["
+# id больше 64-битного целого БД не примет (OverflowError вместо пустой выборки)
+MAX_ID = 2 ** 63 - 1
+
+
+class CatalogQueryError(ValueError):
+    """
+    Неверные параметры запроса каталога
+    """
+
+
+class CatalogParams(NamedTuple):
+    category: int = None
+    min_price: Decimal = None
+    max_price: Decimal = None
+    free_delivery: bool = False
+    available: bool = False
+    name: str = ""
+    tags: tuple = ()
+    specs: tuple = ()
+    sort: str = "id"
+    descending: bool = False
+
+
+def _flag(value):
+    return value.lower() == "true"
+
+
+def _decimal(value, name):
+    if value in (None, ""):
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise CatalogQueryError(f"{name} должен быть числом")
+    if not number.is_finite():
+        raise CatalogQueryError(f"{name} должен быть конечным числом")
+    return number
+
+
+def _positive_int(value, name, default):
+    if value in (None, ""):
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise CatalogQueryError(f"{name} должен быть целым числом")
+    if number < 1:
+        raise CatalogQueryError(f"{name} должен быть больше нуля")
+    if number > MAX_ID:
+        raise CatalogQueryError(f"{name} слишком велик")
+    return number
+
+
+def parse_catalog_params(query):
+    """
+    Разбирает параметры запроса каталога (request.GET) в CatalogParams.
+    Неизвестная сортировка и некорректные числа приводят к CatalogQueryError.
+    """
+    sort = query.get("sort") or "id"
+    if sort not in SORT_FIELDS:
+        raise CatalogQueryError(
+            f"Неизвестная сортировка {sort}, допустимо: {', '.join(SORT_FIELDS)}"
+        )
+    sort_type = query.get("sortType") or "inc"
+    if sort_type not in SORT_TYPES:
+        raise CatalogQueryError("sortType должен быть inc или dec")
+
+    tags = {tag for tag in query.getlist("tags[]") if tag}
+    if len(tags) > MAX_TAGS:
+        raise CatalogQueryError(f"Можно выбрать не больше {MAX_TAGS} тегов")
+    # id, slug или название тега приводятся к id
+    tags = tuple(sorted(set(tag_ids(tags))))
+    if tags and tags[-1] > MAX_ID:
+        raise CatalogQueryError("Неизвестный тег")
+
+    # характеристики передаются как filter[spec][<название>]=<значение>
+    specs = tuple(sorted(
+        (key[len(SPEC_PREFIX):-1], value)
+        for key, value in query.items()
+        if key.startswith(SPEC_PREFIX) and key.endswith("]") and value
+    ))
+    if len(specs) > MAX_SPECS:
+        raise CatalogQueryError(f"Можно выбрать не больше {MAX_SPECS} характеристик")
+
+    category = query.get("category")
+    return CatalogParams(
+        category=_positive_int(category, "category", None),
+        min_price=_decimal(query.get("filter[minPrice]"), "minPrice"),
+        max_price=_decimal(query.get("filter[maxPrice]"), "maxPrice"),
+        free_delivery=_flag(query.get("filter[freeDelivery]", "")),
+        available=_flag(query.get("filter[available]", "")),
+        name=query.get("filter[name]", "").strip(),
+        tags=tags,
+        specs=specs,
+        sort=sort,
+        descending=SORT_TYPES[sort_type],
+    )
+
+
+def parse_page(query):
+    page = _positive_int(query.get("currentPage"), "currentPage", 1)
+    limit = _positive_int(query.get("limit"), "limit", 20)
+    return page, min(limit, MAX_PAGE_SIZE)
+
+
+def filter_catalog_queryset(params):
+    """
+    Товары, подходящие под фильтры CatalogParams, без сортировки. Фильтры
+    по нескольким тегам и характеристикам - по одному подзапросу с GROUP BY
+    ... HAVING COUNT, поэтому количество JOIN не растет с числом условий
+    и строки не дублируются.
+    """
+    products = Product.objects.all()
+    if params.category is not None:
+        products = products.filter(category_id=params.category)
+    if params.min_price is not None:
+        products = products.filter(effective_price__gte=params.min_price)
+    if params.max_price is not None:
+        products = products.filter(effective_price__lte=params.max_price)
+    if params.free_delivery:
+        products = products.filter(free_delivery=True)
+    if params.available:
+        products = products.filter(count__gt=0)
+    if params.name:
+        products = products.filter(title__icontains=params.name)
+    if params.tags:
+        tagged = (
+            Product.tags.through.objects
+            .filter(tag_id__in=params.tags)
+            .values("product_id")
+            .annotate(matched=Count("tag_id"))
+            .filter(matched=len(params.tags))
+            .values("product_id")
+        )
+        products = products.filter(pk__in=tagged)
+    if params.specs:
+        condition = Q()
+        for name, value in params.specs:
+            condition |= Q(name=name, value=value)
+        specified = (
+            Specification.objects
+            .filter(condition)
+            .values("product_id")
+            .annotate(matched=Count("name", distinct=True))
+            .filter(matched=len(params.specs))
+            .values("product_id")
+        )
+        products = products.filter(pk__in=specified)
+    return products
+
+
+def build_catalog_queryset(params):
+    """
+    Queryset каталога по CatalogParams: фильтры и сортировка
+    """
+    products = filter_catalog_queryset(params)
+    if params.sort == "reviews":
+        products = products.annotate(reviews_count=Count("reviews"))
+    field = SORT_FIELDS[params.sort]
+    if params.descending:
+        return products.order_by(f"-{field}", "-pk")
+    return products.order_by(field, "pk")
+
+
+class CatalogShape(NamedTuple):
+    """
+    Форма запроса каталога: какие фильтры заданы, сколько выбрано тегов
+    и характеристик, сортировка. Запросы одной формы отличаются только
+    значениями параметров SQL.
+    """
+    category: bool
+    min_price: bool
+    max_price: bool
+    free_delivery: bool
+    available: bool
+    name: bool
+    tags: int
+    specs: int
+    sort: str
+    descending: bool
+
+
+def catalog_shape(params):
+    return CatalogShape(
+        category=params.category is not None,
+        min_price=params.min_price is not None,
+        max_price=params.max_price is not None,
+        free_delivery=params.free_delivery,
+        available=params.available,
+        name=bool(params.name),
+        tags=len(params.tags),
+        specs=len(params.specs),
+        sort=params.sort,
+        descending=params.descending,
+    )
+
+
+def _shape_params(shape):
+    """
+    CatalogParams формы shape, в которых значения заменены метками.
+    Метки отрицательные или начинаются с нулевого символа, поэтому
+    не совпадают с постоянными параметрами SQL (0, True, число тегов).
+    """
+    return CatalogParams(
+        category=-1 if shape.category else None,
+        min_price=Decimal("-0.01") if shape.min_price else None,
+        max_price=Decimal("-0.02") if shape.max_price else None,
+        free_delivery=shape.free_delivery,
+        available=shape.available,
+        name="\0name" if shape.name else "",
+        tags=tuple(-100 - index for index in range(shape.tags)),
+        specs=tuple((f"\0name{index}", f"\0value{index}") for index in range(shape.specs)),
+        sort=shape.sort,
+        descending=shape.descending,
+    )
+
+
+def _prep(model, field_name, value, connection):
+    # так же, как значение готовит Lookup.get_db_prep_lookup
+    field = model._meta.get_field(field_name)
+    return field.get_db_prep_value(field.get_prep_value(value), connection, prepared=True)
+
+
+def _slot_values(params, connection):
+    """
+    Значения параметров SQL, зависящие от запроса: {слот: значение}
+    """
+    values = {}
+    if params.category is not None:
+        values["category"] = _prep(Product, "category", params.category, connection)
+    if params.min_price is not None:
+        values["min_price"] = _prep(Product, "effective_price", params.min_price, connection)
+    if params.max_price is not None:
+        values["max_price"] = _prep(Product, "effective_price", params.max_price, connection)
+    if params.name:
+        values["name"] = IContains.param_pattern % connection.ops.prep_for_like_query(params.name)
+    for index, tag in enumerate(params.tags):
+        values[("tag", index)] = _prep(Product.tags.through, "tag", tag, connection)
+    for index, (name, value) in enumerate(params.specs):
+        values[("spec_name", index)] = _prep(Specification, "name", name, connection)
+        values[("spec_value", index)] = _prep(Specification, "value", value, connection)
+    return values
+
+
+class Slot(NamedTuple):
+    """
+    Место в параметрах скомпилированного SQL для значения из запроса
+    """
+    name: object
+
+
+class CompiledCatalogQuery(NamedTuple):
+    """
+    SQL подсчета и выборки id товаров с плейсхолдерами. В *_params
+    постоянные значения и Slot на месте значений запроса.
+    """
+    count_sql: str
+    count_params: tuple
+    ids_sql: str
+    ids_params: tuple
+
+
+def _slots(compiled_params, markers):
+    return tuple(Slot(markers[param]) if param in markers else param for param in compiled_params)
+
+
+def _bind(compiled_params, values):
+    return tuple(values[param.name] if isinstance(param, Slot) else param for param in compiled_params)
+
+
+@lru_cache(maxsize=512)
+def compile_catalog_query(shape, using="default"):
+    """
+    Компилирует SQL подсчета и выборки id товаров для формы запроса.
+    Результат запоминается по форме, а не по значениям фильтров: запрос
+    с другой категорией, ценой или тегами той же формы не проходит через
+    компиляцию ORM, его значения подставляются в готовый SQL.
+    """
+    connection = connections[using]
+    params = _shape_params(shape)
+    markers = {value: slot for slot, value in _slot_values(params, connection).items()}
+    products = build_catalog_queryset(params)
+    count_sql, count_params = products.order_by().values("pk").query.get_compiler(
+        using
+    ).as_sql()
+    ids_sql, ids_params = products.values_list("pk").query.get_compiler(using).as_sql()
+    return CompiledCatalogQuery(
+        count_sql=f"SELECT COUNT(*) FROM ({count_sql}) catalog",
+        count_params=_slots(count_params, markers),
+        ids_sql=f"{ids_sql} LIMIT %s OFFSET %s",
+        ids_params=_slots(ids_params, markers),
+    )
+
+
+class CatalogPage(NamedTuple):
+    products: list
+    current_page: int
+    last_page: int
+
+
+def get_catalog_page(params, page, limit, using="default"):
+    """
+    Возвращает страницу каталога двумя запросами по заранее скомпилированному
+    SQL и одним запросом за самими товарами по первичному ключу.
+    Номер страницы за пределами диапазона приводится к последней странице.
+    """
+    compiled = compile_catalog_query(catalog_shape(params), using)
+    values = _slot_values(params, connections[using])
+    with connections[using].cursor() as cursor:
+        cursor.execute(compiled.count_sql, _bind(compiled.count_params, values))
+        total = cursor.fetchone()[0]
+        last_page = max(1, math.ceil(total / limit))
+        page = min(page, last_page)
+        cursor.execute(
+            compiled.ids_sql,
+            _bind(compiled.ids_params, values) + (limit, (page - 1) * limit),
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    by_id = Product.objects.using(using).select_related("category").in_bulk(ids)
+    return CatalogPage(
+        products=[by_id[pk] for pk in ids if pk in by_id],
+        current_page=page,
+        last_page=last_page,
+    )
+
+
+def get_facets(products):
+    """
+    Считает фасеты для выборки каталога (filter_catalog_queryset: аннотация
+    сортировки по отзывам размножила бы строки): количество товаров по тегам
+    и категориям, диапазон цен, количество товаров в наличии и с бесплатной
+    доставкой. Ровно три запроса с группировкой независимо от размера выборки.
+    """
+    products = products.order_by()
+    summary = products.aggregate(
+        total=Count("pk"),
+        min_price=Min("effective_price"),
+        max_price=Max("effective_price"),
+        in_stock=Count("pk", filter=Q(count__gt=0)),
+        free_delivery=Count("pk", filter=Q(free_delivery=True)),
+    )
+    categories = (
+        products
+        .values("category_id", "category__title")
+        .annotate(count=Count("pk"))
+        .order_by("-count", "category__title")
+    )
+    tags = (
+        Product.tags.through.objects
+        .filter(product_id__in=products.values("pk"))
+        .values("tag_id", "tag__name")
+        .annotate(count=Count("product_id"))
+        .order_by("-count", "tag__name")[:FACET_TAGS_LIMIT]
+    )
+    return {
+        "total": summary["total"],
+        "price": {"min": summary["min_price"], "max": summary["max_price"]},
+        "inStock": summary["in_stock"],
+        "freeDelivery": summary["free_delivery"],
+        "categories": [
+            {"id": row["category_id"], "title": row["category__title"], "count": row["count"]}
+            for row in categories
+        ],
+        "tags": [
+            {"id": row["tag_id"], "name": row["tag__name"], "count": row["count"]}
+            for row in tags
+        ],
+    }
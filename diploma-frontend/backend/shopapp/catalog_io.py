@@ -0,0 +1,212 @@
+"""
+Формат строк для массового импорта/экспорта каталога товаров.
+
+Одна строка описывает один товар. В CSV многозначные поля записываются
+через разделитель "|", характеристики - парами "имя=значение".
+В JSONL те же поля передаются списками и словарями.
+"""
+import csv
+import datetime
+import json
+from decimal import Decimal
+
+CSV_FIELDS = [
+    "id",
+    "title",
+    "category",
+    "subcategory",
+    "price",
+    "count",
+    "description",
+    "free_delivery",
+    "tags",
+    "specifications",
+    "images",
+    "sale_discount",
+    "sale_date_from",
+    "sale_date_to",
+]
+
+LIST_SEPARATOR = "|"
+SPEC_SEPARATOR = "="
+
+
+class CatalogRowError(ValueError):
+    """
+    Ошибка разбора строки файла импорта
+    """
+
+
+def _split(value):
+    if not value:
+        return []
+    return [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "да")
+
+
+def _to_date(value, name):
+    if isinstance(value, datetime.date):
+        return value
+    value = str(value or "").strip()
+    if not value:
+        raise CatalogRowError(f"для распродажи обязательно поле {name}")
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CatalogRowError(f"{name} должна быть датой в формате YYYY-MM-DD, получено {value!r}")
+
+
+def _normalize_sale(sale):
+    if not isinstance(sale, dict) or sale.get("discount") in (None, ""):
+        raise CatalogRowError("для распродажи обязательно поле discount")
+    discount = Decimal(str(sale["discount"]))
+    if not discount.is_finite() or discount < 0:
+        raise CatalogRowError("discount должен быть неотрицательным числом")
+    date_from = _to_date(sale.get("date_from"), "sale_date_from")
+    date_to = _to_date(sale.get("date_to"), "sale_date_to")
+    if date_from > date_to:
+        raise CatalogRowError("sale_date_from позже sale_date_to")
+    return {"discount": discount, "date_from": date_from, "date_to": date_to}
+
+
+def normalize_row(raw, line_number):
+    """
+    Приводит строку CSV или объект JSONL к единому виду:
+    списки тегов, характеристик и изображений, данные о распродаже.
+    Скидка распродажи проверяется вместе с датами: без дат или с датами
+    не в формате YYYY-MM-DD строка отклоняется CatalogRowError.
+    """
+    try:
+        title = (raw.get("title") or "").strip()
+        category = (raw.get("category") or "").strip()
+        subcategory = (raw.get("subcategory") or "").strip()
+        if not title or not category or not subcategory:
+            raise CatalogRowError("обязательны поля title, category и subcategory")
+
+        tags = raw.get("tags") or []
+        if isinstance(tags, str):
+            tags = _split(tags)
+
+        specifications = raw.get("specifications") or []
+        if isinstance(specifications, str):
+            specifications = [
+                dict(zip(("name", "value"), spec.split(SPEC_SEPARATOR, 1)))
+                for spec in _split(specifications)
+            ]
+
+        images = raw.get("images") or []
+        if isinstance(images, str):
+            images = _split(images)
+
+        sale = raw.get("sale")
+        if sale is None and raw.get("sale_discount"):
+            sale = {
+                "discount": raw["sale_discount"],
+                "date_from": raw.get("sale_date_from"),
+                "date_to": raw.get("sale_date_to"),
+            }
+        if sale is not None:
+            sale = _normalize_sale(sale)
+
+        return {
+            "id": int(raw["id"]) if raw.get("id") else None,
+            "title": title,
+            "category": category,
+            "subcategory": subcategory,
+            "price": Decimal(str(raw.get("price") or 0)),
+            "count": int(raw.get("count") or 0),
+            "description": raw.get("description") or "",
+            "free_delivery": _to_bool(raw.get("free_delivery", True)),
+            "tags": [str(tag).strip() for tag in tags if str(tag).strip()],
+            "specifications": [
+                {"name": spec.get("name", ""), "value": spec.get("value", "")}
+                for spec in specifications
+            ],
+            "images": [str(image) for image in images],
+            "sale": sale,
+        }
+    except CatalogRowError as exc:
+        raise CatalogRowError(f"строка {line_number}: {exc}") from exc
+    except (KeyError, ValueError, ArithmeticError) as exc:
+        raise CatalogRowError(f"строка {line_number}: {exc!r}") from exc
+
+
+def read_rows(file, file_format):
+    """
+    Генератор нормализованных строк, читает файл построчно,
+    не загружая его в память целиком.
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for line_number, raw in enumerate(reader, start=2):
+            yield normalize_row(raw, line_number)
+    else:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json.loads(line)
+            except json.JSONDecodeError as exc:
+                raise CatalogRowError(f"строка {line_number}: {exc}") from exc
+            yield normalize_row(raw, line_number)
+
+
+def product_to_row(product):
+    """
+    Представление товара в виде строки экспорта. Ожидает, что категория,
+    подкатегория и распродажа уже подгружены через select_related,
+    а теги, характеристики и изображения - через prefetch_related.
+    """
+    sale = getattr(product, "sale_info", None)
+    return {
+        "id": product.pk,
+        "title": product.title,
+        "category": product.category.title,
+        "subcategory": product.subcategory.title,
+        "price": str(product.price),
+        "count": product.count,
+        "description": product.description,
+        "free_delivery": product.free_delivery,
+        "tags": [tag.name for tag in product.tags.all()],
+        "specifications": [
+            {"name": spec.name or "", "value": spec.value or ""}
+            for spec in product.specifications.all()
+        ],
+        "images": [image.image.name for image in product.images.all() if image.image],
+        "sale": {
+            "discount": str(sale.discount),
+            "date_from": sale.date_from.isoformat(),
+            "date_to": sale.date_to.isoformat(),
+        } if sale else None,
+    }
+
+
+def row_to_csv(row):
+    """
+    Разворачивает строку экспорта в плоский словарь для csv.DictWriter
+    """
+    sale = row["sale"] or {}
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "category": row["category"],
+        "subcategory": row["subcategory"],
+        "price": row["price"],
+        "count": row["count"],
+        "description": row["description"],
+        "free_delivery": row["free_delivery"],
+        "tags": LIST_SEPARATOR.join(row["tags"]),
+        "specifications": LIST_SEPARATOR.join(
+            f"{spec['name']}{SPEC_SEPARATOR}{spec['value']}" for spec in row["specifications"]
+        ),
+        "images": LIST_SEPARATOR.join(row["images"]),
+        "sale_discount": sale.get("discount", ""),
+        "sale_date_from": sale.get("date_from", ""),
+        "sale_date_to": sale.get("date_to", ""),
+    }
@@ -0,0 +1,17 @@
+from django import forms
+from django.contrib.admin.helpers import ActionForm
+
+
+class ProductBulkActionForm(ActionForm):
+    """
+    Дополнительные поля панели действий в списке товаров админки,
+    используются массовыми действиями со скидками и ценами.
+    """
+    percent = forms.DecimalField(label="Процент", required=False, max_digits=5, decimal_places=2)
+    date_from = forms.DateField(
+        label="С", required=False, widget=forms.DateInput(attrs={"type": "date"})
+    )
+    date_to = forms.DateField(
+        label="По", required=False, widget=forms.DateInput(attrs={"type": "date"})
+    )
+    dry_run = forms.BooleanField(label="Только проверить", required=False)
@@ -0,0 +1,117 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from shopapp.models import ArchivedOrder, Order
+
+
+def months_ago(moment, months):
+    """
+    Та же дата months месяцев назад, с поправкой на длину месяца
+    """
+    month_index = moment.year * 12 + moment.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    for day in range(moment.day, 0, -1):
+        try:
+            return moment.replace(year=year, month=month, day=day)
+        except ValueError:
+            continue
+
+
+class Command(BaseCommand):
+    """
+    Переносит закрытые (archived=True) заказы старше --months месяцев
+    в таблицу ArchivedOrder пачками по --batch-size. Каждая пачка переносится
+    в своей транзакции: вставка в архив и удаление из Order.
+    """
+    help = "Перенос старых закрытых заказов в холодный архив"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months", type=int, default=6)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["months"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--months и --batch-size должны быть положительными")
+        cutoff = months_ago(timezone.now(), options["months"])
+        old_orders = Order.objects.filter(archived=True, created_at__lt=cutoff)
+
+        if options["dry_run"]:
+            self.stdout.write(f"Будет перенесено заказов: {old_orders.count()} (старше {cutoff:%Y-%m-%d})")
+            return
+
+        started = time.monotonic()
+        moved = 0
+        while True:
+            ids = list(old_orders.order_by("pk").values_list("pk", flat=True)[:options["batch_size"]])
+            if not ids:
+                break
+            moved += self.archive_batch(ids)
+            if options["verbosity"] >= 2:
+                self.stdout.write(f"Перенесено {moved}")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Перенесено заказов: {moved} за {elapsed:.2f} с"
+        ))
+
+    @transaction.atomic
+    def archive_batch(self, ids):
+        orders = (
+            Order.objects
+            .filter(pk__in=ids)
+            .select_for_update()
+            .prefetch_related("products", "lines__product", "pay_order")
+        )
+        archived = [
+            ArchivedOrder(
+                order_id=order.pk,
+                full_name_id=order.full_name_id,
+                created_at=order.created_at,
+                city=order.city,
+                delivery_address=order.delivery_address,
+                delivery_type=order.delivery_type,
+                payment_type=order.payment_type,
+                total_cost=order.total_cost,
+                status=order.status,
+                payment_error=order.payment_error,
+                products=[
+                    {
+                        "id": product.pk,
+                        "category": product.category_id,
+                        "price": str(product.price),
+                        "count": product.count_of_orders,
+                        "title": product.title,
+                    }
+                    for product in order.products.all()
+                ],
+                # позиции удаляются вместе с заказом, отчеты по товарам
+                # и категориям читают их снимок
+                lines=[
+                    {
+                        "product": line.product_id,
+                        "category": line.product.category_id,
+                        "title": line.product.title,
+                        "quantity": line.quantity,
+                        "price": str(line.price),
+                    }
+                    for line in order.lines.all()
+                ],
+                payments=[
+                    {
+                        "id": payment.pk,
+                        "validityPeriod": payment.validity_period,
+                        "success": payment.success,
+                    }
+                    for payment in order.pay_order.all()
+                ],
+            )
+            for order in orders
+        ]
+        ArchivedOrder.objects.bulk_create(archived, ignore_conflicts=True)
+        Order.objects.filter(pk__in=ids).delete()
+        return len(archived)
@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from shopapp.models import Category, Product, ProductViews, Subcategory
+from shopapp.trending import Collector, get_config, trending
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """
+    Замер учета просмотров товаров. Создается синтетический каталог из
+    --products товаров, затем --threads потоков --seconds секунд
+    записывают просмотры в отдельный буфер Collector (товары выбираются
+    с перекосом популярности), а его фоновый поток пишет их в БД
+    по настройкам TRENDING. После замера проверяется, что записаны все
+    просмотры и самый просматриваемый товар первым в "сейчас смотрят".
+    Синтетические товары и их просмотры удаляются в конце. Команда
+    завершается ошибкой, если просмотров в секунду меньше --min-rate.
+    """
+    help = "Замер пропускной способности учета просмотров товаров"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--threads", type=int, default=4)
+        parser.add_argument("--seconds", type=float, default=10.0)
+        parser.add_argument("--min-rate", type=float, default=50000.0, help="Просмотров в секунду")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if min(options["products"], options["threads"]) < 1 or options["seconds"] <= 0:
+            raise CommandError("--products, --threads и --seconds должны быть положительными")
+        category = Category.objects.create(title="bench")
+        try:
+            product_ids = self.create_catalog(category, options["products"])
+            events, elapsed, collector = self.run(product_ids, options)
+            self.report(product_ids, events, elapsed, collector, options)
+        finally:
+            # просмотры удаляются вместе с товарами
+            category.delete()
+
+    @staticmethod
+    def create_catalog(category, count):
+        subcategory = Subcategory.objects.create(title="bench", category=category)
+        product_ids = []
+        for offset in range(0, count, BATCH_SIZE):
+            products = Product.objects.bulk_create([
+                Product(title=f"bench {offset + i}", price=100, category=category, subcategory=subcategory)
+                for i in range(min(BATCH_SIZE, count - offset))
+            ])
+            product_ids.extend(product.pk for product in products)
+        return product_ids
+
+    @staticmethod
+    def run(product_ids, options):
+        collector = Collector()
+        # распределение Парето: первый товар самый популярный
+        cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(product_ids))))
+        deadline = time.monotonic() + options["seconds"]
+        counts = [0] * options["threads"]
+
+        def producer(index):
+            rng = random.Random(options["seed"] + index)
+            events = 0
+            while time.monotonic() < deadline:
+                for product_id in rng.choices(product_ids, cum_weights=cum_weights, k=100):
+                    collector.record(product_id)
+                events += 100
+            counts[index] = events
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=producer, args=(i,)) for i in range(options["threads"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        # остаток буфера, как при выходе процесса
+        collector.flush()
+        return sum(counts), elapsed, collector
+
+    def report(self, product_ids, events, elapsed, collector, options):
+        config = get_config()
+        rate = events / elapsed
+        stored = ProductViews.objects.filter(product_id__in=product_ids).aggregate(total=Sum("views"))["total"]
+        rows = ProductViews.objects.filter(product_id__in=product_ids).count()
+        self.stdout.write(
+            f"Потоков: {options['threads']}, просмотров: {events} за {elapsed:.1f} с, {rate:.0f} просмотров/с"
+        )
+        self.stdout.write(
+            f"Записей в БД: {collector.flushes} (FLUSH_SIZE {config['FLUSH_SIZE']}, "
+            f"FLUSH_INTERVAL {config['FLUSH_INTERVAL']} с), "
+            f"{collector.flush_seconds:.2f} с всего, "
+            f"{collector.flush_seconds / max(collector.flushes, 1) * 1000:.1f} мс на запись, "
+            f"товаров с просмотрами: {rows}"
+        )
+        if stored != events:
+            raise CommandError(f"Записано {stored} просмотров из {events}")
+        top = trending(limit=1)
+        if not top or top[0].pk != product_ids[0]:
+            raise CommandError("Самый просматриваемый товар не первый в рейтинге")
+        if rate < options["min_rate"]:
+            raise CommandError(f"Пропускная способность ниже {options['min_rate']:.0f} просмотров/с")
@@ -0,0 +1,118 @@
+import random
+import time
+import tracemalloc
+from itertools import accumulate
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from myauth.models import UserProfile
+from shopapp.models import Basket, Category, Order, Product, ProductRecommendation, Subcategory
+from shopapp.recommendations import CHUNK_SIZE, SHARD_SIZE, TOP_K, build
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """
+    Замер пересчета рекомендаций. В транзакции, которая затем
+    откатывается, создается синтетический каталог из --products товаров
+    и заказы общим объемом --lines строк (товары выбираются с перекосом
+    популярности, как в реальных продажах). Затем build() выполняется
+    для каждого размера шарда из --shard-sizes: выводится скорость
+    в строках заказов в секунду и пик памяти Python (tracemalloc; он сам
+    замедляет расчет в несколько раз, --no-trace отключает замер памяти).
+    Команда завершается ошибкой, если скорость ниже --min-rate.
+    """
+    help = "Замер пересчета рекомендаций на синтетических заказах"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=20000)
+        parser.add_argument("--lines", type=int, default=1000000)
+        parser.add_argument("--order-size", type=int, default=4, help="Среднее число товаров в заказе")
+        parser.add_argument("--shard-sizes", type=int, nargs="+", default=[SHARD_SIZE, SHARD_SIZE // 4])
+        parser.add_argument("--top-k", type=int, default=TOP_K)
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+        parser.add_argument("--min-rate", type=float, default=5000.0, help="Строк заказов в секунду")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--no-trace", action="store_true", help="Без замера памяти")
+
+    def handle(self, *args, **options):
+        if min(options["products"], options["lines"], options["order_size"], *options["shard_sizes"]) < 1:
+            raise CommandError("--products, --lines, --order-size и --shard-sizes должны быть положительными")
+        rng = random.Random(options["seed"])
+
+        with transaction.atomic():
+            created = time.perf_counter()
+            product_ids = self.create_catalog(options["products"])
+            lines = self.create_orders(rng, product_ids, options["lines"], options["order_size"])
+            self.stdout.write(
+                f"Создано товаров: {len(product_ids)}, строк заказов: {lines} "
+                f"за {time.perf_counter() - created:.1f} с"
+            )
+
+            slowest = None
+            for shard_size in options["shard_sizes"]:
+                if not options["no_trace"]:
+                    tracemalloc.start()
+                try:
+                    stats = build(
+                        top_k=options["top_k"], shard_size=shard_size, chunk_size=options["chunk_size"]
+                    )
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+                rate = lines / stats.seconds if stats.seconds else float("inf")
+                slowest = rate if slowest is None else min(slowest, rate)
+                memory = "" if options["no_trace"] else f", пик памяти {peak / 2 ** 20:.1f} МБ"
+                self.stdout.write(
+                    f"Шард {shard_size}: шардов {stats.shards}, пар {stats.pairs}, "
+                    f"рекомендаций {stats.recommendations}, {stats.seconds:.2f} с, "
+                    f"{rate:.0f} строк/с{memory}"
+                )
+            saved = ProductRecommendation.objects.filter(product_id__in=product_ids[:1000]).count()
+            if not saved:
+                raise CommandError("Рекомендации не построены")
+            transaction.set_rollback(True)
+
+        if slowest < options["min_rate"]:
+            raise CommandError(f"Скорость ниже {options['min_rate']:.0f} строк/с")
+
+    @staticmethod
+    def create_catalog(count):
+        category = Category.objects.create(title="bench")
+        subcategory = Subcategory.objects.create(title="bench", category=category)
+        product_ids = []
+        for offset in range(0, count, BATCH_SIZE):
+            products = Product.objects.bulk_create([
+                Product(title=f"bench {offset + i}", price=100, category=category, subcategory=subcategory)
+                for i in range(min(BATCH_SIZE, count - offset))
+            ])
+            product_ids.extend(product.pk for product in products)
+        return product_ids
+
+    @staticmethod
+    def create_orders(rng, product_ids, lines, order_size):
+        user = User.objects.create(username=f"bench-{time.time_ns()}")
+        profile = UserProfile.objects.create(user=user, name="bench")
+        basket = Basket.objects.create(user=user)
+        through = Order.products.through
+        # распределение Парето: немногие товары встречаются в большинстве заказов
+        cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(product_ids))))
+        created = saved = 0
+        while created < lines:
+            sizes = []
+            while created < lines and len(sizes) < BATCH_SIZE:
+                size = min(rng.randint(1, 2 * order_size - 1), lines - created)
+                sizes.append(size)
+                created += size
+            orders = Order.objects.bulk_create([Order(full_name=profile, basket=basket) for _ in sizes])
+            rows = []
+            for order, size in zip(orders, sizes):
+                items = set(rng.choices(product_ids, cum_weights=cum_weights, k=size))
+                rows.extend(through(order_id=order.pk, product_id=product_id) for product_id in items)
+            through.objects.bulk_create(rows)
+            saved += len(rows)
+        # повторы товара в заказе схлопываются, строк меньше запрошенного
+        return saved
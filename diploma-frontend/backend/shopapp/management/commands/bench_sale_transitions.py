@@ -0,0 +1,133 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from shopapp.models import Category, Product, Sale, Subcategory
+from shopapp.pricing import apply_sale_transitions, effective_price, refresh_effective_prices
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """
+    Проверка воркера распродаж с перемоткой времени. В транзакции, которая
+    затем откатывается, создается синтетический каталог из --products
+    товаров, у доли --sale-share из них - распродажи со случайными
+    периодами. Затем день за днем на --days дней вперед выполняется
+    apply_sale_transitions, как это делает run_sale_worker на границе дня,
+    и после каждого дня проверяется, что цены всех товаров совпадают
+    с расчетными. Для сравнения замеряется полный пересчет всех товаров.
+    Команда завершается ошибкой при расхождении цен или если начатых и
+    законченных распродаж обрабатывается меньше --min-rate в секунду.
+    """
+    help = "Симуляция смены дней распродаж на синтетическом каталоге"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=20000)
+        parser.add_argument("--sale-share", type=float, default=0.5)
+        parser.add_argument("--days", type=int, default=30)
+        parser.add_argument("--min-rate", type=float, default=1000.0, help="Распродаж в секунду")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if options["products"] < 1 or options["days"] < 1:
+            raise CommandError("--products и --days должны быть положительными")
+        if not 0 < options["sale_share"] <= 1:
+            raise CommandError("--sale-share должен быть в диапазоне (0, 1]")
+        rng = random.Random(options["seed"])
+        start = timezone.localdate()
+
+        with transaction.atomic():
+            created = time.perf_counter()
+            product_ids = self.create_catalog(
+                rng, options["products"], options["sale_share"], start, options["days"]
+            )
+            self.stdout.write(
+                f"Создано товаров: {len(product_ids)}, распродаж: "
+                f"{Sale.objects.filter(product_id__in=product_ids).count()} "
+                f"за {time.perf_counter() - created:.1f} с"
+            )
+
+            started = time.perf_counter()
+            refresh_effective_prices(product_ids, today=start)
+            full_refresh = time.perf_counter() - started
+
+            transitions = changed = 0
+            elapsed = 0.0
+            day = start
+            for _ in range(options["days"]):
+                next_day = day + datetime.timedelta(days=1)
+                result = apply_sale_transitions(day, next_day)
+                transitions += result.activated + result.expired
+                changed += len(result.changed)
+                elapsed += result.seconds
+                mismatched = self.mismatched(product_ids, next_day)
+                if options["verbosity"] >= 2:
+                    self.stdout.write(
+                        f"{next_day}: начато {result.activated}, закончено {result.expired}, "
+                        f"изменено цен {len(result.changed)} за {result.seconds * 1000:.1f} мс"
+                    )
+                if mismatched:
+                    raise CommandError(f"{next_day}: у {mismatched} товаров неверная цена")
+                day = next_day
+            transaction.set_rollback(True)
+
+        rate = transitions / elapsed if elapsed else float("inf")
+        self.stdout.write(
+            f"Дней: {options['days']}, начатых и законченных распродаж: {transitions}, "
+            f"изменено цен: {changed}"
+        )
+        self.stdout.write(
+            f"Границы дней: {elapsed:.2f} с всего, {elapsed / options['days'] * 1000:.1f} мс на день, "
+            f"{rate:.0f} распродаж/с"
+        )
+        self.stdout.write(f"Полный пересчет каталога: {full_refresh * 1000:.1f} мс")
+        if rate < options["min_rate"]:
+            raise CommandError(f"Пропускная способность ниже {options['min_rate']:.0f} распродаж/с")
+
+    @staticmethod
+    def create_catalog(rng, count, sale_share, start, days):
+        category = Category.objects.create(title="bench")
+        subcategory = Subcategory.objects.create(title="bench", category=category)
+        product_ids = []
+        for offset in range(0, count, BATCH_SIZE):
+            products = Product.objects.bulk_create([
+                Product(
+                    title=f"bench {offset + i}",
+                    price=Decimal(rng.randint(100, 100000)),
+                    category=category,
+                    subcategory=subcategory,
+                )
+                for i in range(min(BATCH_SIZE, count - offset))
+            ])
+            sales = []
+            for product in products:
+                product_ids.append(product.pk)
+                if rng.random() >= sale_share:
+                    continue
+                date_from = start + datetime.timedelta(days=rng.randint(-5, days))
+                sales.append(Sale(
+                    product=product,
+                    date_from=date_from,
+                    date_to=date_from + datetime.timedelta(days=rng.randint(0, 10)),
+                    discount=(product.price * Decimal(rng.randint(1, 30)) / 100).quantize(Decimal("0.01")),
+                ))
+            Sale.objects.bulk_create(sales)
+        return product_ids
+
+    @staticmethod
+    def mismatched(product_ids, day):
+        first, last = min(product_ids), max(product_ids)
+        return (
+            Product.objects
+            .filter(pk__gte=first, pk__lte=last)
+            .annotate(expected=effective_price(day))
+            .exclude(effective_price=F("expected"))
+            .count()
+        )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.response_cache import invalidate
+from shopapp.recommendations import CHUNK_SIZE, SHARD_SIZE, TOP_K, build
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает рекомендации "с этим товаром покупают" по всем заказам
+    и корзинам (shopapp.recommendations). Запускается по расписанию, например
+    раз в ночь; память ограничена размером шарда --shard-size товаров.
+    """
+    help = "Пересчет рекомендаций товаров по совместным покупкам"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top-k", type=int, default=TOP_K)
+        parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if min(options["top_k"], options["shard_size"], options["chunk_size"]) < 1:
+            raise CommandError("--top-k, --shard-size и --chunk-size должны быть положительными")
+        stats = build(
+            top_k=options["top_k"],
+            shard_size=options["shard_size"],
+            chunk_size=options["chunk_size"],
+        )
+        invalidate("recommendations")
+        self.stdout.write(self.style.SUCCESS(
+            f"Товаров: {stats.products} в {stats.shards} шардах, групп: {stats.groups}, "
+            f"пар: {stats.pairs}, сохранено рекомендаций: {stats.recommendations} "
+            f"за {stats.seconds:.2f} с"
+        ))
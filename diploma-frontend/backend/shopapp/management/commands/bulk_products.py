@@ -0,0 +1,105 @@
+import csv
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shopapp import bulk
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Массовые изменения товаров из командной строки:
+    - discount  назначить скидку товарам категории/подкатегории на период
+    - undiscount снять скидку
+    - price     изменить цену на процент
+    - restock   обновить остатки из CSV файла со столбцами id,count
+    С флагом --dry-run изменения выполняются и откатываются.
+    """
+    help = "Массовые скидки, цены и остатки товаров"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="operation", required=True)
+
+        discount = subparsers.add_parser("discount")
+        self.add_filter_arguments(discount)
+        discount.add_argument("--percent", type=Decimal, required=True)
+        discount.add_argument("--date-from", type=datetime.date.fromisoformat, required=True)
+        discount.add_argument("--date-to", type=datetime.date.fromisoformat, required=True)
+
+        undiscount = subparsers.add_parser("undiscount")
+        self.add_filter_arguments(undiscount)
+
+        price = subparsers.add_parser("price")
+        self.add_filter_arguments(price)
+        price.add_argument("--percent", type=Decimal, required=True)
+
+        restock = subparsers.add_parser("restock")
+        restock.add_argument("path", help="CSV файл со столбцами id,count")
+        restock.add_argument("--mode", choices=["add", "set"], default="add")
+
+        for subparser in (discount, undiscount, price, restock):
+            subparser.add_argument("--dry-run", action="store_true")
+
+    @staticmethod
+    def add_filter_arguments(parser):
+        parser.add_argument("--category", type=int, help="id категории")
+        parser.add_argument("--subcategory", type=int, help="id подкатегории")
+        parser.add_argument("--ids", type=int, nargs="+", help="id товаров")
+
+    @staticmethod
+    def get_products(options):
+        products = Product.objects.all()
+        if options["category"]:
+            products = products.filter(category_id=options["category"])
+        if options["subcategory"]:
+            products = products.filter(subcategory_id=options["subcategory"])
+        if options["ids"]:
+            products = products.filter(pk__in=options["ids"])
+        return products
+
+    @staticmethod
+    def read_counts(path):
+        counts = {}
+        try:
+            with open(path, encoding="utf-8", newline="") as file:
+                for line_number, row in enumerate(csv.DictReader(file), start=2):
+                    try:
+                        counts[int(row["id"])] = int(row["count"])
+                    except (KeyError, TypeError, ValueError):
+                        raise CommandError(f"{path}, строка {line_number}: ожидаются id и count")
+        except OSError as exc:
+            raise CommandError(str(exc))
+        return counts
+
+    def handle(self, *args, **options):
+        operation = options["operation"]
+        dry_run = options["dry_run"]
+        try:
+            if operation == "restock":
+                result = bulk.restock(
+                    self.read_counts(options["path"]), mode=options["mode"], dry_run=dry_run
+                )
+            elif operation == "discount":
+                result = bulk.apply_discount(
+                    self.get_products(options), options["percent"],
+                    options["date_from"], options["date_to"], dry_run=dry_run,
+                )
+            elif operation == "undiscount":
+                result = bulk.remove_discount(self.get_products(options), dry_run=dry_run)
+            else:
+                result = bulk.change_prices(
+                    self.get_products(options), options["percent"], dry_run=dry_run
+                )
+        except (bulk.BulkOperationError, InvalidOperation) as exc:
+            raise CommandError(str(exc))
+
+        for row in result.preview:
+            self.stdout.write(f"#{row['id']} {row['title']}: {row['before']} -> {row['after']}")
+        if result.dry_run:
+            self.stdout.write(self.style.WARNING(
+                f"Проверка: было бы затронуто товаров - {result.affected}, изменения отменены"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Затронуто товаров - {result.affected}"))
@@ -0,0 +1,61 @@
+import csv
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from shopapp.catalog_io import CSV_FIELDS, product_to_row, row_to_csv
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Потоковый экспорт товаров в CSV или JSONL в формате команды import_products.
+    Товары читаются через iterator(chunk_size=...), поэтому расход памяти
+    не зависит от размера каталога.
+    """
+    help = "Экспорт товаров в CSV/JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-o", "--output", default="-",
+            help="Путь к файлу, по умолчанию - stdout",
+        )
+        parser.add_argument("--format", choices=["csv", "jsonl"], default="jsonl")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        products = (
+            Product.objects
+            .select_related("category", "subcategory", "sale_info")
+            .prefetch_related("tags", "specifications", "images")
+            .order_by("pk")
+            .iterator(chunk_size=options["chunk_size"])
+        )
+
+        output = options["output"]
+        file = sys.stdout if output == "-" else open(output, "w", encoding="utf-8", newline="")
+        started = time.monotonic()
+        exported = 0
+        try:
+            if options["format"] == "csv":
+                writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+                writer.writeheader()
+                for product in products:
+                    writer.writerow(row_to_csv(product_to_row(product)))
+                    exported += 1
+            else:
+                for product in products:
+                    file.write(json.dumps(product_to_row(product), ensure_ascii=False))
+                    file.write("\n")
+                    exported += 1
+        finally:
+            if file is not sys.stdout:
+                file.close()
+
+        elapsed = time.monotonic() - started
+        self.stderr.write(
+            f"Экспортировано {exported} товаров за {elapsed:.2f} с, "
+            f"{exported / elapsed if elapsed else 0:.0f} строк/с"
+        )
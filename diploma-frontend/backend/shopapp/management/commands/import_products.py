@@ -0,0 +1,248 @@
+import sys
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import response_cache
+from shopapp import tags
+from shopapp.catalog_io import CatalogRowError, read_rows
+from shopapp.pricing import refresh_effective_prices
+from shopapp.signals import products_changed
+from shopapp.models import (
+    Category,
+    Subcategory,
+    Product,
+    ProductImage,
+    Tag,
+    Specification,
+    Sale,
+)
+
+PRODUCT_FIELDS = [
+    "title",
+    "price",
+    "count",
+    "description",
+    "free_delivery",
+    "category_id",
+    "subcategory_id",
+]
+
+
+class Command(BaseCommand):
+    """
+    Потоковый импорт товаров из CSV или JSONL.
+    Файл читается построчно и записывается пачками через bulk_create (вставка и upsert),
+    категории, подкатегории и теги сопоставляются по названию через словари в памяти.
+    Товар со столбцом id обновляется по id, без него - по названию.
+    После фиксации каждой пачки кеши каталога сбрасываются сигналом
+    products_changed и тегом "tags" кеша ответов.
+    """
+    help = "Импорт товаров из CSV/JSONL пачками (upsert)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Путь к файлу, '-' - читать из stdin")
+        parser.add_argument(
+            "--format", choices=["csv", "jsonl"], default=None,
+            help="Формат файла, по умолчанию определяется по расширению",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"]
+        if file_format is None:
+            file_format = "csv" if path.endswith(".csv") else "jsonl"
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size должен быть положительным")
+
+        self.categories = dict(Category.objects.values_list("title", "pk"))
+        self.subcategories = {
+            (category_id, title): pk
+            for pk, category_id, title in Subcategory.objects.values_list(
+                "pk", "category_id", "title"
+            )
+        }
+        # теги сопоставляются по slug: "Popular" и "popular" - один тег
+        self.tags = dict(Tag.objects.values_list("slug", "pk"))
+
+        if path == "-":
+            file = sys.stdin
+        else:
+            if not Path(path).is_file():
+                raise CommandError(f"Файл {path} не найден")
+            file = open(path, encoding="utf-8", newline="")
+
+        total_created = total_updated = 0
+        started = time.monotonic()
+        try:
+            rows = read_rows(file, file_format)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                created, updated = self.import_batch(batch)
+                total_created += created
+                total_updated += updated
+                if options["verbosity"] >= 2:
+                    elapsed = time.monotonic() - started
+                    done = total_created + total_updated
+                    self.stdout.write(f"{done} строк, {done / elapsed:.0f} строк/с")
+        except CatalogRowError as exc:
+            raise CommandError(
+                f"Ошибка импорта: {exc}. Предыдущие пачки "
+                f"({total_created + total_updated} строк) уже сохранены."
+            )
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        elapsed = time.monotonic() - started
+        total = total_created + total_updated
+        self.stdout.write(self.style.SUCCESS(
+            f"Импортировано {total} строк (создано {total_created}, "
+            f"обновлено {total_updated}) за {elapsed:.2f} с, "
+            f"{total / elapsed if elapsed else 0:.0f} строк/с"
+        ))
+
+    def resolve_category(self, title):
+        if title not in self.categories:
+            self.categories[title] = Category.objects.create(title=title).pk
+        return self.categories[title]
+
+    def resolve_subcategory(self, category_id, title):
+        key = (category_id, title)
+        if key not in self.subcategories:
+            self.subcategories[key] = Subcategory.objects.create(
+                category_id=category_id, title=title
+            ).pk
+        return self.subcategories[key]
+
+    def resolve_tags(self, rows):
+        missing = {}
+        for row in rows:
+            for name in row["tags"]:
+                slug = tags.tag_slug(name)
+                if slug not in self.tags:
+                    missing.setdefault(slug, name)
+        if missing:
+            Tag.objects.bulk_create([Tag(name=name, slug=slug) for slug, name in missing.items()])
+            self.tags.update(
+                Tag.objects.filter(slug__in=missing).values_list("slug", "pk")
+            )
+            # bulk_create не отправляет post_save, карту тегов процесса
+            # сбрасываем сами; остальные процессы сбросят ее по теме "tags"
+            transaction.on_commit(tags.invalidate)
+
+    def find_existing(self, rows):
+        """
+        Возвращает множество существующих id и словарь название -> id
+        для строк без явного id. Два запроса на пачку.
+        """
+        ids = [row["id"] for row in rows if row["id"] is not None]
+        titles = [row["title"] for row in rows if row["id"] is None]
+        existing_ids = set(Product.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        by_title = {}
+        if titles:
+            for pk, title in Product.objects.filter(title__in=titles).order_by("pk").values_list(
+                "pk", "title"
+            ):
+                by_title.setdefault(title, pk)
+        return existing_ids, by_title
+
+    @transaction.atomic
+    def import_batch(self, rows):
+        # в пределах пачки последняя строка с тем же ключом побеждает
+        unique_rows = {}
+        for row in rows:
+            unique_rows[row["id"] or ("title", row["title"])] = row
+        rows = list(unique_rows.values())
+
+        self.resolve_tags(rows)
+        existing_ids, by_title = self.find_existing(rows)
+
+        to_create, to_update = [], []
+        products = []
+        for row in rows:
+            category_id = self.resolve_category(row["category"])
+            product = Product(
+                title=row["title"],
+                price=row["price"],
+                count=row["count"],
+                description=row["description"],
+                free_delivery=row["free_delivery"],
+                category_id=category_id,
+                subcategory_id=self.resolve_subcategory(category_id, row["subcategory"]),
+            )
+            if row["id"] is not None:
+                product.pk = row["id"]
+                exists = row["id"] in existing_ids
+            else:
+                product.pk = by_title.get(row["title"])
+                exists = product.pk is not None
+            (to_update if exists else to_create).append(product)
+            products.append((product, row))
+
+        Product.objects.bulk_create(to_create)
+        # bulk_update строит CASE WHEN на каждое поле и строку, что на больших
+        # пачках дороже самой записи, поэтому обновление делается через
+        # INSERT ... ON CONFLICT (id) DO UPDATE
+        Product.objects.bulk_create(
+            to_update,
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=PRODUCT_FIELDS,
+        )
+
+        updated_ids = [product.pk for product in to_update]
+        self.replace_relations(products, updated_ids)
+
+        # bulk_create не отправляет post_save: кеши каталога, товаров,
+        # распродаж и тегов сбрасываются одним сигналом на пачку
+        product_ids = {product.pk for product, _ in products}
+        transaction.on_commit(
+            lambda: products_changed.send(sender=Product, product_ids=product_ids)
+        )
+        response_cache.invalidate("tags")
+        return len(to_create), len(to_update)
+
+    def replace_relations(self, products, updated_ids):
+        """
+        Перезаписывает теги, характеристики, изображения и распродажи
+        товаров пачки: одно удаление и одна вставка на каждое отношение.
+        """
+        tag_through = Product.tags.through
+        if updated_ids:
+            tag_through.objects.filter(product_id__in=updated_ids).delete()
+            Specification.objects.filter(product_id__in=updated_ids).delete()
+            ProductImage.objects.filter(product_id__in=updated_ids).delete()
+            Sale.objects.filter(product_id__in=updated_ids).delete()
+
+        tag_links, specs, images, sales = [], [], [], []
+        for product, row in products:
+            tag_links.extend(
+                tag_through(product_id=product.pk, tag_id=tag_id)
+                for tag_id in {self.tags[tags.tag_slug(name)] for name in row["tags"]}
+            )
+            specs.extend(
+                Specification(
+                    product_id=product.pk, position=position,
+                    name=spec["name"], value=spec["value"],
+                )
+                for position, spec in enumerate(row["specifications"])
+            )
+            images.extend(
+                ProductImage(product_id=product.pk, image=image) for image in row["images"]
+            )
+            if row["sale"]:
+                sales.append(Sale(product_id=product.pk, **row["sale"]))
+
+        tag_through.objects.bulk_create(tag_links, ignore_conflicts=True)
+        Specification.objects.bulk_create(specs)
+        ProductImage.objects.bulk_create(images)
+        Sale.objects.bulk_create(sales)
+        refresh_effective_prices(product.pk for product, _ in products)
@@ -0,0 +1,35 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shopapp.models import Product
+from shopapp.pricing import refresh_effective_prices
+from shopapp.signals import products_changed
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает цены со скидкой (Product.effective_price) на дату --date
+    (по умолчанию сегодня): включает начавшиеся распродажи и снимает
+    закончившиеся. Запускается по расписанию сразу после полуночи;
+    повторный запуск в тот же день ничего не меняет.
+    """
+    help = "Пересчет цен товаров с учетом распродаж на текущую дату"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", type=datetime.date.fromisoformat, help="YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with transaction.atomic():
+            changed = refresh_effective_prices(today=options["date"])
+            if changed:
+                transaction.on_commit(
+                    lambda: products_changed.send(sender=Product, product_ids=changed)
+                )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Изменена цена {len(changed)} товаров за {elapsed:.2f} с"
+        ))
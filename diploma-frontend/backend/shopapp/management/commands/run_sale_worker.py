@@ -0,0 +1,83 @@
+import logging
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from api import metrics
+from shopapp.models import Product
+from shopapp.pricing import apply_sale_transitions, refresh_effective_prices
+from shopapp.signals import products_changed
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Воркер распродаж: при запуске сверяет цены всех товаров с распродажами
+    на сегодня, затем раз в --interval секунд проверяет смену дня и на
+    границе включает начавшиеся и снимает закончившиеся распродажи.
+    Если воркер не работал несколько дней, пропущенные границы
+    обрабатываются одним пересчетом. Затронутые товары сбрасываются
+    из кеша ответов сигналом products_changed.
+
+    Достаточно одного воркера на базу: пересчет идемпотентен, но
+    несколько воркеров выполняли бы одну работу.
+    """
+    help = "Включение и снятие распродаж на границах их периодов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=60.0, help="Секунд между проверками")
+        parser.add_argument("--once", action="store_true", help="Только сверка при запуске")
+
+    def handle(self, *args, **options):
+        if options["interval"] <= 0:
+            raise CommandError("--interval должен быть положительным")
+        day = timezone.localdate()
+        started = time.perf_counter()
+        with transaction.atomic():
+            changed = refresh_effective_prices(today=day)
+            self.notify(changed)
+        self.stdout.write(
+            f"{day}: сверено, изменена цена {len(changed)} товаров "
+            f"за {time.perf_counter() - started:.2f} с"
+        )
+        if options["once"]:
+            return
+
+        # SIGTERM (остановка сервиса) завершает цикл после текущей проверки
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        try:
+            while not stop.wait(options["interval"]):
+                close_old_connections()
+                today = timezone.localdate()
+                if today == day:
+                    continue
+                with transaction.atomic():
+                    result = apply_sale_transitions(day, today)
+                    self.notify(result.changed)
+                logger.info(
+                    "Распродажи на %s: начато %s, закончено %s", today,
+                    result.activated, result.expired,
+                    extra={
+                        "activated": result.activated,
+                        "expired": result.expired,
+                        "changed": len(result.changed),
+                        "seconds": round(result.seconds, 3),
+                    },
+                )
+                metrics.maybe_flush()
+                day = today
+        except KeyboardInterrupt:
+            pass
+
+    @staticmethod
+    def notify(changed):
+        if changed:
+            transaction.on_commit(
+                lambda: products_changed.send(sender=Product, product_ids=changed)
+            )
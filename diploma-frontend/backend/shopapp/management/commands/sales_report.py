@@ -0,0 +1,40 @@
+import datetime
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shopapp.reports import REPORTS, ReportError, build_report, stream_rows
+
+
+class Command(BaseCommand):
+    """
+    Выгрузка отчетов по заказам и продажам в CSV или JSONL.
+    Отчет orders выводится построчно по мере чтения из БД,
+    сводные отчеты считаются агрегацией в БД.
+    """
+    help = "Отчеты по заказам и продажам за период"
+
+    def add_arguments(self, parser):
+        parser.add_argument("report", choices=sorted(REPORTS))
+        parser.add_argument("--from", dest="date_from", type=datetime.date.fromisoformat, required=True)
+        parser.add_argument("--to", dest="date_to", type=datetime.date.fromisoformat, required=True)
+        parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+        parser.add_argument(
+            "-o", "--output", default="-",
+            help="Путь к файлу, по умолчанию - stdout",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            fields, rows = build_report(options["report"], options["date_from"], options["date_to"])
+        except ReportError as exc:
+            raise CommandError(str(exc))
+
+        output = options["output"]
+        file = sys.stdout if output == "-" else open(output, "w", encoding="utf-8", newline="")
+        try:
+            for chunk in stream_rows(fields, rows, options["format"]):
+                file.write(chunk)
+        finally:
+            if file is not sys.stdout:
+                file.close()
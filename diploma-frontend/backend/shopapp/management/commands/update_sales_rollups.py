@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shopapp.rollups import BATCH_SIZE, apply_pending
+
+
+class Command(BaseCommand):
+    """
+    Догоняет дневные сводки продаж: учитывает оплаченные заказы без отметки
+    rollup_applied пачками по --batch-size. Безопасно запускать по расписанию
+    параллельно с оплатами - SalesRollupMark блокируется на время пачки.
+    """
+    help = "Инкрементальное обновление дневных сводок продаж"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size должен быть положительным")
+        started = time.monotonic()
+        applied = apply_pending(batch_size=options["batch_size"])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Учтено заказов: {applied} за {elapsed:.2f} с"
+        ))
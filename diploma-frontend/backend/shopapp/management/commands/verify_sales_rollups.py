@@ -0,0 +1,43 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shopapp.rollups import rebuild, verify
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает дневные сводки продаж за период из позиций оплаченных
+    заказов и выводит расхождения с сохраненными сводками.
+    С --fix сводки периода перезаписываются пересчетом.
+    """
+    help = "Сверка дневных сводок продаж с исходными данными"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", type=datetime.date.fromisoformat, required=True)
+        parser.add_argument("--to", dest="date_to", type=datetime.date.fromisoformat, required=True)
+        parser.add_argument("--fix", action="store_true")
+
+    def handle(self, *args, **options):
+        date_from, date_to = options["date_from"], options["date_to"]
+        if date_from > date_to:
+            raise CommandError("Дата начала позже даты окончания")
+
+        products, categories = verify(date_from, date_to)
+        for title, diffs in (("товар", products), ("категория", categories)):
+            for diff in diffs:
+                self.stdout.write(
+                    f"{diff.date} {title} {diff.key}: "
+                    f"сводка (шт, выручка, заказов) {diff.stored}, пересчет {diff.expected}"
+                )
+
+        if not products and not categories:
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+            return
+        if options["fix"]:
+            rebuild(date_from, date_to)
+            self.stdout.write(self.style.SUCCESS("Сводки за период пересчитаны"))
+        else:
+            raise CommandError(
+                f"Расхождений: по товарам {len(products)}, по категориям {len(categories)}"
+            )
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-19 00:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0002_order_archived_alter_productimage_image'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='title',
+            field=models.CharField(db_index=True, max_length=200, verbose_name='Название продукта'),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+    ]
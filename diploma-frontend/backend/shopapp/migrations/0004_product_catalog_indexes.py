@@ -0,0 +1,29 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0003_product_title_tag_name_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='shopapp_pro_price_bc367d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating'], name='shopapp_pro_rating_da457b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['date'], name='shopapp_pro_date_eab420_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price'], name='shopapp_pro_categor_fa32ed_idx'),
+        ),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:02
+
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def move_specifications_to_products(apps, schema_editor):
+    """
+    Переносит связи Product.specification (M2M) в Specification.product.
+    Характеристика, связанная с несколькими товарами, копируется для каждого
+    следующего товара, характеристики без товаров удаляются.
+    """
+    Product = apps.get_model("shopapp", "Product")
+    Specification = apps.get_model("shopapp", "Specification")
+    links = (
+        Product.specification.through.objects
+        .order_by("product_id", "id")
+        .values_list("product_id", "specification_id", "specification__name", "specification__value")
+    )
+
+    assigned = set()
+    positions = defaultdict(int)
+    to_update, to_create = [], []
+    for product_id, spec_id, name, value in links.iterator(chunk_size=BATCH_SIZE):
+        position = positions[product_id]
+        positions[product_id] += 1
+        if spec_id not in assigned:
+            assigned.add(spec_id)
+            to_update.append(Specification(pk=spec_id, product_id=product_id, position=position))
+        else:
+            to_create.append(
+                Specification(product_id=product_id, position=position, name=name, value=value)
+            )
+        if len(to_update) >= BATCH_SIZE:
+            Specification.objects.bulk_update(to_update, ["product", "position"])
+            to_update = []
+        if len(to_create) >= BATCH_SIZE:
+            Specification.objects.bulk_create(to_create)
+            to_create = []
+    Specification.objects.bulk_update(to_update, ["product", "position"])
+    Specification.objects.bulk_create(to_create)
+    Specification.objects.filter(product__isnull=True).delete()
+
+
+def move_specifications_to_m2m(apps, schema_editor):
+    Product = apps.get_model("shopapp", "Product")
+    Specification = apps.get_model("shopapp", "Specification")
+    through = Product.specification.through
+    links = Specification.objects.values_list("product_id", "pk").iterator(chunk_size=BATCH_SIZE)
+    batch = []
+    for product_id, spec_id in links:
+        batch.append(through(product_id=product_id, specification_id=spec_id))
+        if len(batch) >= BATCH_SIZE:
+            through.objects.bulk_create(batch)
+            batch = []
+    through.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0004_product_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='specification',
+            name='position',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Порядок'),
+        ),
+        migrations.AddField(
+            model_name='specification',
+            name='product',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='specifications', to='shopapp.product', verbose_name='Товар'),
+        ),
+        migrations.RunPython(move_specifications_to_products, move_specifications_to_m2m),
+        migrations.RemoveField(
+            model_name='product',
+            name='specification',
+        ),
+        migrations.AlterField(
+            model_name='specification',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='specifications', to='shopapp.product', verbose_name='Товар'),
+        ),
+        migrations.AlterModelOptions(
+            name='specification',
+            options={'ordering': ['product', 'position'], 'verbose_name': 'Характеристика', 'verbose_name_plural': 'Характеристики'},
+        ),
+        migrations.AddIndex(
+            model_name='specification',
+            index=models.Index(fields=['product', 'position'], name='shopapp_spe_product_f41ca3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='specification',
+            index=models.Index(fields=['name', 'value'], name='shopapp_spe_name_873c81_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myauth', '0001_initial'),
+        ('shopapp', '0005_specification_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField(unique=True, verbose_name='Номер заказа')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания заказа')),
+                ('city', models.CharField(max_length=100, verbose_name='Город доставки')),
+                ('delivery_address', models.CharField(max_length=200, verbose_name='Адрес доставки')),
+                ('delivery_type', models.CharField(max_length=20)),
+                ('payment_type', models.CharField(max_length=20)),
+                ('total_cost', models.DecimalField(decimal_places=2, default=0, max_digits=8, verbose_name='Итоговая сумма заказа')),
+                ('status', models.CharField(max_length=255)),
+                ('payment_error', models.CharField(blank=True, default='', max_length=255)),
+                ('products', models.JSONField(default=list)),
+                ('payments', models.JSONField(default=list)),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата переноса в архив')),
+            ],
+            options={
+                'verbose_name': 'Архивный заказ',
+                'verbose_name_plural': 'Архивные заказы',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['full_name', 'archived', '-created_at'], name='shopapp_ord_full_na_49554b_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='full_name',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='myauth.userprofile', verbose_name='Покупатель'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['full_name', '-created_at'], name='shopapp_arc_full_na_e261cb_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0006_order_user_index_archivedorder'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['created_at'], name='shopapp_arc_created_f14dfc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['archived', 'created_at'], name='shopapp_ord_archive_53c1cb_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0007_order_report_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollupMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_payment_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='shopapp.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_lines', to='shopapp.product')),
+            ],
+            options={
+                'verbose_name': 'Позиция заказа',
+                'verbose_name_plural': 'Позиции заказов',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shopapp.product')),
+            ],
+            options={
+                'verbose_name': 'Продажи товара за день',
+                'verbose_name_plural': 'Продажи товаров по дням',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shopapp.category')),
+            ],
+            options={
+                'verbose_name': 'Продажи категории за день',
+                'verbose_name_plural': 'Продажи категорий по дням',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyproductsales',
+            constraint=models.UniqueConstraint(fields=('date', 'product'), name='daily_product_sales_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycategorysales',
+            constraint=models.UniqueConstraint(fields=('date', 'category'), name='daily_category_sales_unique'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:23
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+BATCH_SIZE = 500
+
+
+def deduplicate_tags(apps, schema_editor):
+    """
+    Заполняет slug из названия и объединяет теги с одинаковым slug
+    (повторы и различия в регистре и пробелах): остается тег с меньшим id,
+    товары повторов привязываются к нему.
+    """
+    Product = apps.get_model("shopapp", "Product")
+    Tag = apps.get_model("shopapp", "Tag")
+    through = Product.tags.through
+
+    keepers, duplicates, to_update = {}, {}, []
+    for pk, name in Tag.objects.order_by("pk").values_list("pk", "name"):
+        name = name.strip()
+        slug = slugify(name, allow_unicode=True)[:200] or f"tag-{pk}"
+        if slug in keepers:
+            duplicates[pk] = keepers[slug]
+            continue
+        keepers[slug] = pk
+        to_update.append(Tag(pk=pk, name=name, slug=slug))
+    Tag.objects.bulk_update(to_update, ["name", "slug"], batch_size=BATCH_SIZE)
+
+    duplicate_ids = list(duplicates)
+    for start in range(0, len(duplicate_ids), BATCH_SIZE):
+        batch = duplicate_ids[start:start + BATCH_SIZE]
+        links = through.objects.filter(tag_id__in=batch).values_list("product_id", "tag_id")
+        wanted = {(product_id, duplicates[tag_id]) for product_id, tag_id in links}
+        existing = set(
+            through.objects
+            .filter(product_id__in={product_id for product_id, _ in wanted},
+                    tag_id__in={tag_id for _, tag_id in wanted})
+            .values_list("product_id", "tag_id")
+        )
+        through.objects.bulk_create(
+            [through(product_id=product_id, tag_id=tag_id) for product_id, tag_id in wanted - existing],
+            batch_size=BATCH_SIZE,
+        )
+        Tag.objects.filter(pk__in=batch).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0008_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, max_length=200, null=True),
+        ),
+        migrations.RunPython(deduplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, max_length=200, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='tags',
+            field=models.ManyToManyField(related_name='products', to='shopapp.tag', verbose_name='Тег'),
+        ),
+    ]
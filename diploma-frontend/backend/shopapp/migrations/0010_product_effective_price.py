@@ -0,0 +1,58 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:27
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+
+def fill_effective_price(apps, schema_editor):
+    """
+    effective_price = price минус скидка распродажи, действующей сегодня
+    """
+    Product = apps.get_model("shopapp", "Product")
+    Sale = apps.get_model("shopapp", "Sale")
+    today = timezone.localdate()
+    zero = Value(0, output_field=DecimalField(max_digits=8, decimal_places=2))
+    discount = (
+        Sale.objects
+        .filter(product_id=OuterRef("pk"), date_from__lte=today, date_to__gte=today)
+        .values("discount")[:1]
+    )
+    Product.objects.update(effective_price=Greatest(
+        F("price") - Coalesce(Subquery(discount), zero),
+        zero,
+        output_field=DecimalField(max_digits=8, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0009_tag_slug_dedup'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='shopapp_pro_price_bc367d_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='shopapp_pro_categor_fa32ed_idx',
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8, verbose_name='Цена со скидкой'),
+        ),
+        migrations.RunPython(fill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price'], name='shopapp_pro_effecti_34baa5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'effective_price'], name='shopapp_pro_categor_14b801_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0010_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['date_from'], name='shopapp_sal_date_fr_49b937_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['date_to'], name='shopapp_sal_date_to_1140b2_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0011_sale_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='shopapp.product')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shopapp.product')),
+            ],
+            options={
+                'verbose_name': 'Рекомендация',
+                'verbose_name_plural': 'Рекомендации',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productrecommendation',
+            constraint=models.UniqueConstraint(fields=('product', 'rank'), name='product_recommendation_rank_unique'),
+        ),
+    ]
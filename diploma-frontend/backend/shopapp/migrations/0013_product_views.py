@@ -0,0 +1,28 @@
+# Generated by Django 4.2.5 on 2026-10-19 01:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0012_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductViews',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='view_stats', serialize=False, to='shopapp.product')),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('score', models.FloatField()),
+                ('viewed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Просмотры товара',
+                'verbose_name_plural': 'Просмотры товаров',
+                'indexes': [models.Index(fields=['-score'], name='shopapp_pro_score_9a244f_idx')],
+            },
+        ),
+    ]
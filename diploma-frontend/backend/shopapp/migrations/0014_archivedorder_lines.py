@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-19 02:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0013_product_views'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='lines',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.5 on 2026-10-19 03:05
+
+from django.db import migrations
+
+# таблицы, в админке которых ищут по префиксу названия ("^title")
+TABLES = ["shopapp_product", "shopapp_subcategory"]
+
+# istartswith в SQLite - LIKE, который идет по индексу только с NOCASE,
+# в PostgreSQL - UPPER("title"::text) LIKE UPPER(...), ему нужен индекс
+# по UPPER(title) с классом операторов для LIKE
+INDEXES = {
+    "sqlite": '("title" COLLATE NOCASE)',
+    "postgresql": '(UPPER("title") text_pattern_ops)',
+}
+
+
+def create_indexes(apps, schema_editor):
+    columns = INDEXES.get(schema_editor.connection.vendor)
+    if columns is None:
+        return
+    for table in TABLES:
+        schema_editor.execute(f'CREATE INDEX "{table}_title_prefix" ON "{table}" {columns}')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in INDEXES:
+        return
+    for table in TABLES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{table}_title_prefix"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0014_archivedorder_lines'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
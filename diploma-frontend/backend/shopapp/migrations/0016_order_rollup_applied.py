@@ -0,0 +1,57 @@
+# Generated by Django 4.2.5 on 2026-10-19 05:40
+
+from django.db import migrations, models
+
+MARK_NAME = "sales"
+
+
+def mark_applied_orders(apps, schema_editor):
+    """
+    Заказы с успешной оплатой не новее прежней отметки уже учтены в сводках
+    """
+    SalesRollupMark = apps.get_model("shopapp", "SalesRollupMark")
+    Order = apps.get_model("shopapp", "Order")
+    Payment = apps.get_model("shopapp", "Payment")
+    mark = (
+        SalesRollupMark.objects
+        .filter(name=MARK_NAME)
+        .values_list("last_payment_id", flat=True)
+        .first()
+    ) or 0
+    paid = Payment.objects.filter(success=True, pk__lte=mark).values("order_id")
+    Order.objects.filter(pk__in=paid).update(rollup_applied=True)
+
+
+def restore_mark(apps, schema_editor):
+    SalesRollupMark = apps.get_model("shopapp", "SalesRollupMark")
+    Payment = apps.get_model("shopapp", "Payment")
+    last = (
+        Payment.objects
+        .filter(success=True, order__rollup_applied=True)
+        .aggregate(last=models.Max("pk"))["last"]
+    ) or 0
+    SalesRollupMark.objects.filter(name=MARK_NAME).update(last_payment_id=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0015_title_prefix_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='rollup_applied',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_applied_orders, restore_mark),
+        migrations.RemoveField(
+            model_name='salesrollupmark',
+            name='last_payment_id',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('archived', True), ('rollup_applied', False)), fields=['id'], name='order_rollup_pending'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils.text import slugify
 
 from myauth.models import UserProfile
 
@@ -11,11 +12,12 @@ class Product(models.Model):
     - category (категория к которой относится товар, например - "компьютеры")
     - subcategory   (у компьютеров может быть подкатегория, например "intel" или "amd")
     - price         (цена товара)
+    - effective_price (цена с учетом действующей распродажи, shopapp.pricing)
     - count         (количество товара на складе)
     - date          (дата занесения товара в базу данных)
     - title         (название товара)
     - description   (описание товара)
-    - specification (спецификация)
+    - specifications (характеристики, модель Specification со ссылкой на товар)
     - free_delivery  (бесплатная или нет доставка)
     - tags          (ключевые слова товара, по которым может осуществляться поиск товара)
     - rating        (рейтинг товара)
@@ -26,9 +28,19 @@ class Product(models.Model):
         ordering = ["title", "price", ]
         verbose_name = "Продукт"
         verbose_name_plural = "Продукты"
+        # индексы под фильтры и сортировки каталога (shopapp.catalog)
+        indexes = [
+            models.Index(fields=["effective_price"]),
+            models.Index(fields=["rating"]),
+            models.Index(fields=["date"]),
+            models.Index(fields=["category", "effective_price"]),
+        ]
 
-    title = models.CharField(max_length=200, verbose_name="Название продукта")
+    title = models.CharField(max_length=200, db_index=True, verbose_name="Название продукта")
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
+    effective_price = models.DecimalField(
+        default=0, max_digits=8, decimal_places=2, editable=False, verbose_name="Цена со скидкой"
+    )
     description = models.TextField(null=False, blank=True)
     count = models.IntegerField(default=0)
     date = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания записи")
@@ -36,10 +48,7 @@ class Product(models.Model):
     count_of_orders = models.IntegerField(default=0)
     category = models.ForeignKey("Category", on_delete=models.CASCADE)
     subcategory = models.ForeignKey("Subcategory", on_delete=models.CASCADE)
-    tags = models.ManyToManyField("Tag", verbose_name="Тег", related_name="tags")
-    specification = models.ManyToManyField(
-        "Specification", verbose_name="Характеристика", related_name="specification"
-    )
+    tags = models.ManyToManyField("Tag", verbose_name="Тег", related_name="products")
     rating = models.DecimalField(
         max_digits=3,
         decimal_places=2,
@@ -49,8 +58,9 @@ class Product(models.Model):
 
     def get_image(self):
         images = ProductImage.objects.filter(product_id=self.pk)
+        # изображение без файла (запись не удалась) не показываем
         return [
-            {"src": item.image.url, "alt": item.image.name} for item in images
+            {"src": item.image.url, "alt": item.image.name} for item in images if item.image
         ]
 
     def get_rating(self):
@@ -140,11 +150,21 @@ class Subcategory(models.Model):
 
 
 class Tag(models.Model):
+    """
+    Тег товара. Ключ тега - slug, он же используется в фильтрах каталога
+    (shopapp.tags); если не задан, строится из названия.
+    """
     class Meta:
         verbose_name = "Тег"
         verbose_name_plural = "Теги"
 
-    name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200, unique=True)
+    slug = models.SlugField(max_length=200, unique=True, allow_unicode=True)
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = slugify(self.name, allow_unicode=True)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
@@ -178,14 +198,27 @@ class Review(models.Model):
 
 class Specification(models.Model):
     """
-     Класс, отвечающий за некие характеристики продукта. Имеет поля:
+     Класс, отвечающий за характеристики продукта. Каждая характеристика
+     принадлежит одному товару, характеристики товара упорядочены по position
+     и читаются одним запросом по индексу (product, position). Имеет поля:
+     - product
+     - position
      - name
      - value
     """
     class Meta:
         verbose_name = "Характеристика"
         verbose_name_plural = "Характеристики"
+        ordering = ["product", "position"]
+        indexes = [
+            models.Index(fields=["product", "position"]),
+            models.Index(fields=["name", "value"]),
+        ]
 
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="specifications", verbose_name="Товар"
+    )
+    position = models.PositiveSmallIntegerField(default=0, verbose_name="Порядок")
     name = models.CharField(max_length=50, blank=True, null=True)
     value = models.CharField(max_length=100, blank=True, null=True)
 
@@ -201,6 +234,13 @@ class Sale(models.Model):
     - date_to       (дата конца распродажи)
     - discount      (размер скидки на товар)
     """
+    class Meta:
+        # границы периодов для воркера распродаж (shopapp.pricing)
+        indexes = [
+            models.Index(fields=["date_from"]),
+            models.Index(fields=["date_to"]),
+        ]
+
     product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name="sale_info")
     date_from = models.DateField()
     date_to = models.DateField()
@@ -248,11 +288,24 @@ class Order(models.Model):
     - status               (Статус заказа)
     - basket            (Связь с корзиной пользователя    )
     - payment_error     (Ошибка оплаты заказа)
+    - rollup_applied    (Заказ учтен в дневных сводках продаж)
     """
 
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
+        # открытый заказ пользователя и его история читаются по этому индексу
+        indexes = [
+            models.Index(fields=["full_name", "archived", "-created_at"]),
+            # отчеты по оплаченным заказам за период (shopapp.reports)
+            models.Index(fields=["archived", "created_at"]),
+            # оплаченные заказы, еще не учтенные в сводках (shopapp.rollups)
+            models.Index(
+                fields=["id"],
+                condition=models.Q(archived=True, rollup_applied=False),
+                name="order_rollup_pending",
+            ),
+        ]
     DELIVERY_OPTIONS = (
         ("delivery", "Доставка"),
         ("express", "Экспресс доставка"),
@@ -277,6 +330,47 @@ class Order(models.Model):
         Basket, on_delete=models.CASCADE, related_name="orders", default=None)
     payment_error = models.CharField(max_length=255, blank=True, default="")
     archived = models.BooleanField(default=False)
+    rollup_applied = models.BooleanField(default=False, editable=False)
+
+
+class ArchivedOrder(models.Model):
+    """
+    Холодный архив старых оплаченных заказов. Команда archive_orders
+    переносит сюда заказы старше заданного срока, чтобы таблица Order
+    оставалась небольшой. Товары и оплаты хранятся снимком в JSON. Поля:
+    - order_id      (id заказа в таблице Order, сохраняется при переносе)
+    - full_name     (покупатель)
+    - created_at    (когда создан заказ)
+    - products      (снимок товаров заказа)
+    - lines         (снимок позиций заказа OrderLine: количество и цена оплаты)
+    - payments      (снимок оплат заказа)
+    - archived_at   (когда заказ перенесен в архив)
+    остальные поля повторяют Order
+    """
+    class Meta:
+        verbose_name = "Архивный заказ"
+        verbose_name_plural = "Архивные заказы"
+        indexes = [
+            models.Index(fields=["full_name", "-created_at"]),
+            models.Index(fields=["created_at"]),
+        ]
+
+    order_id = models.BigIntegerField(unique=True, verbose_name="Номер заказа")
+    full_name = models.ForeignKey(UserProfile, on_delete=models.CASCADE, verbose_name="Покупатель")
+    created_at = models.DateTimeField(verbose_name="Дата создания заказа")
+    city = models.CharField(max_length=100, verbose_name="Город доставки")
+    delivery_address = models.CharField(max_length=200, verbose_name="Адрес доставки")
+    delivery_type = models.CharField(max_length=20)
+    payment_type = models.CharField(max_length=20)
+    total_cost = models.DecimalField(
+        default=0, max_digits=8, decimal_places=2, verbose_name="Итоговая сумма заказа"
+    )
+    status = models.CharField(max_length=255)
+    payment_error = models.CharField(max_length=255, blank=True, default="")
+    products = models.JSONField(default=list)
+    lines = models.JSONField(default=list)
+    payments = models.JSONField(default=list)
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата переноса в архив")
 
 
 class DeliveryPrices(models.Model):
@@ -320,3 +414,105 @@ class Payment(models.Model):
     card_number = models.CharField(max_length=16)
     validity_period = models.CharField(max_length=20)
     success = models.BooleanField(default=False)
+
+
+class OrderLine(models.Model):
+    """
+    Позиция оплаченного заказа. Записывается при оплате из корзины и служит
+    исходными данными для дневных сводок продаж. Имеет поля:
+    - order     (заказ)
+    - product   (товар)
+    - quantity  (количество единиц)
+    - price     (цена единицы на момент оплаты)
+    """
+    class Meta:
+        verbose_name = "Позиция заказа"
+        verbose_name_plural = "Позиции заказов"
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="lines")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="order_lines")
+    quantity = models.PositiveIntegerField(default=1)
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+
+
+class DailyProductSales(models.Model):
+    """
+    Дневная сводка продаж товара: проданные единицы, выручка и число заказов.
+    Обновляется инкрементально модулем shopapp.rollups.
+    """
+    class Meta:
+        verbose_name = "Продажи товара за день"
+        verbose_name_plural = "Продажи товаров по дням"
+        constraints = [
+            models.UniqueConstraint(fields=["date", "product"], name="daily_product_sales_unique"),
+        ]
+
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales")
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+
+class DailyCategorySales(models.Model):
+    """
+    Дневная сводка продаж категории, устроена так же, как DailyProductSales
+    """
+    class Meta:
+        verbose_name = "Продажи категории за день"
+        verbose_name_plural = "Продажи категорий по дням"
+        constraints = [
+            models.UniqueConstraint(fields=["date", "category"], name="daily_category_sales_unique"),
+        ]
+
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="daily_sales")
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+
+class SalesRollupMark(models.Model):
+    """
+    Блокировка инкрементального обновления сводок: проходы
+    захватывают строку select_for_update и не пересекаются
+    """
+    name = models.CharField(max_length=50, unique=True)
+
+
+class ProductRecommendation(models.Model):
+    """
+    Рекомендация "с этим товаром покупают": товар recommended встречался
+    вместе с product в заказах и корзинах score раз, rank - место в списке
+    рекомендаций product (с 0). Строится командой build_recommendations.
+    """
+    class Meta:
+        verbose_name = "Рекомендация"
+        verbose_name_plural = "Рекомендации"
+        constraints = [
+            models.UniqueConstraint(fields=["product", "rank"], name="product_recommendation_rank_unique"),
+        ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="recommendations")
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    score = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+
+class ProductViews(models.Model):
+    """
+    Просмотры товара для списка "сейчас смотрят" (shopapp.trending):
+    views - всего просмотров, score - затухающий рейтинг просмотров
+    в логарифмической шкале, сравнимый между товарами в любой момент.
+    """
+    class Meta:
+        verbose_name = "Просмотры товара"
+        verbose_name_plural = "Просмотры товаров"
+        indexes = [
+            models.Index(fields=["-score"]),
+        ]
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="view_stats")
+    views = models.PositiveIntegerField(default=0)
+    score = models.FloatField()
+    viewed_at = models.DateTimeField()
@@ -0,0 +1,61 @@
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.utils.functional import cached_property
+
+# на таблицах меньше этого размера точный COUNT(*) дешевле, чем неточность оценки
+ESTIMATE_THRESHOLD = 10000
+
+
+def estimate_row_count(model, using="default"):
+    """
+    Возвращает приблизительное количество строк в таблице модели по статистике
+    планировщика базы данных, либо None, если статистика недоступна.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    queries = {
+        "postgresql": (
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [connection.ops.quote_name(table)],
+        ),
+        "mysql": (
+            "SELECT table_rows FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = %s",
+            [table],
+        ),
+        # sqlite_stat1 заполняется командой ANALYZE, первое число в stat - число строк
+        "sqlite": (
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1",
+            [table],
+        ),
+    }
+    if connection.vendor not in queries:
+        return None
+    sql, params = queries[connection.vendor]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для списков админки по большим таблицам.
+    Для нефильтрованного списка берет оценку количества строк из статистики БД
+    вместо полного COUNT(*), при фильтрах и на небольших таблицах считает точно.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is not None and not query.where:
+            estimate = estimate_row_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and estimate > ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
@@ -0,0 +1,115 @@
+"""
+Цена товара с учетом распродажи.
+
+Product.effective_price хранит цену, по которой товар продается сегодня:
+price минус скидка распродажи, если ее период (date_from - date_to
+включительно) содержит текущую дату, иначе price. По этому
+индексированному полю каталог фильтрует и сортирует по цене.
+
+Поле пересчитывается после изменения товара или распродажи (сигналы и
+массовые операции), а на границах периодов распродаж - воркером
+run_sale_worker (apply_sale_transitions) или командой refresh_sale_prices.
+Пересчет - набор UPDATE с подзапросом к Sale на пачку товаров, у которых
+сохраненная цена отличается от расчетной.
+"""
+import time
+from typing import NamedTuple
+
+from django.db.models import DecimalField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from api import metrics
+
+from .models import Product, Sale
+
+BATCH_SIZE = 1000
+ZERO = Value(0, output_field=DecimalField(max_digits=8, decimal_places=2))
+
+
+def effective_price(today=None):
+    """
+    Выражение цены товара с учетом распродажи, действующей в день today
+    """
+    today = today or timezone.localdate()
+    discount = (
+        Sale.objects
+        .filter(product_id=OuterRef("pk"), date_from__lte=today, date_to__gte=today)
+        .values("discount")[:1]
+    )
+    return Greatest(
+        F("price") - Coalesce(Subquery(discount), ZERO),
+        ZERO,
+        output_field=DecimalField(max_digits=8, decimal_places=2),
+    )
+
+
+def refresh_effective_prices(product_ids=None, today=None):
+    """
+    Пересчитывает effective_price товаров product_ids (по умолчанию всех),
+    у которых она устарела. Товары перебираются пачками по первичному
+    ключу: запрос устаревших в пачке и один UPDATE для них.
+    Возвращает множество id измененных товаров.
+    """
+    expected = effective_price(today)
+    products = Product.objects.order_by("pk")
+    if product_ids is not None:
+        product_ids = sorted(set(product_ids))
+        batches = (product_ids[i:i + BATCH_SIZE] for i in range(0, len(product_ids), BATCH_SIZE))
+    else:
+        batches = _pk_batches(products)
+
+    changed = set()
+    for batch in batches:
+        stale = list(
+            products.filter(pk__in=batch)
+            .annotate(expected=expected)
+            .exclude(effective_price=F("expected"))
+            .values_list("pk", flat=True)
+        )
+        if stale:
+            Product.objects.filter(pk__in=stale).update(effective_price=expected)
+            changed.update(stale)
+    return changed
+
+
+def _pk_batches(products):
+    last = 0
+    while True:
+        batch = list(products.filter(pk__gt=last).values_list("pk", flat=True)[:BATCH_SIZE])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+class SaleTransitions(NamedTuple):
+    activated: int
+    expired: int
+    changed: set
+    seconds: float
+
+
+def apply_sale_transitions(since, today):
+    """
+    Включает распродажи, начавшиеся после дня since по день today,
+    и снимает закончившиеся с since по вчерашний день: пересчитывает цены
+    только товаров этих распродаж (выборка по индексам date_from/date_to).
+    """
+    started = time.perf_counter()
+    activated = set(
+        Sale.objects.filter(date_from__gt=since, date_from__lte=today)
+        .values_list("product_id", flat=True)
+    )
+    expired = set(
+        Sale.objects.filter(date_to__gte=since, date_to__lt=today)
+        .values_list("product_id", flat=True)
+    )
+    changed = refresh_effective_prices(activated | expired, today=today)
+    seconds = time.perf_counter() - started
+    metrics.observe("shop_sale_transition_seconds", seconds)
+    metrics.inc("shop_sale_transitions_total", len(activated), kind="activated")
+    metrics.inc("shop_sale_transitions_total", len(expired), kind="expired")
+    return SaleTransitions(
+        activated=len(activated), expired=len(expired), changed=changed, seconds=seconds
+    )
@@ -0,0 +1,203 @@
+"""
+Рекомендации "с этим товаром покупают".
+
+Исходные данные - группы товаров, купленных или отложенных вместе:
+товары каждого заказа (Order.products), в том числе перенесенных
+в холодный архив (снимок ArchivedOrder.products), и каждой корзины
+(BasketItem). Снимки архива могут ссылаться на удаленные товары,
+такие товары в рекомендации не попадают.
+Для каждой пары товаров группы считается, в скольких группах они
+встречались вместе, и для каждого товара сохраняются TOP_K соседей
+с наибольшим счетом (ProductRecommendation).
+
+Матрица совместных покупок разреженная, но целиком для большого каталога
+в память не помещается, поэтому она считается по частям: товары делятся
+на шарды по shard_size, и для каждого шарда группы читаются из БД заново
+пачками по chunk_size строк, а в памяти хранятся только строки матрицы
+товаров шарда. Память ограничена shard_size * число соседей, время -
+числом шардов * объем групп.
+"""
+import heapq
+import time
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+from typing import NamedTuple
+
+from django.db import transaction
+
+from .models import ArchivedOrder, BasketItem, Order, Product, ProductRecommendation
+
+TOP_K = 10
+SHARD_SIZE = 20000
+CHUNK_SIZE = 5000
+# в больших группах (оптовый заказ) пар слишком много, а связь слабая
+MAX_GROUP = 50
+
+
+class BuildStats(NamedTuple):
+    products: int
+    shards: int
+    groups: int
+    pairs: int
+    recommendations: int
+    seconds: float
+
+
+def _grouped(rows):
+    for _, items in groupby(rows, key=itemgetter(0)):
+        group = {product_id for _, product_id in items}
+        if 1 < len(group) <= MAX_GROUP:
+            yield group
+
+
+def _archived_groups(chunk_size):
+    snapshots = (
+        ArchivedOrder.objects
+        .order_by("pk")
+        .values_list("products", flat=True)
+        .iterator(chunk_size=chunk_size)
+    )
+    for products in snapshots:
+        group = {item["id"] for item in products}
+        if 1 < len(group) <= MAX_GROUP:
+            yield group
+
+
+def iter_groups(chunk_size=CHUNK_SIZE):
+    """
+    Множества id товаров заказов, заказов из холодного архива и корзин;
+    строки читаются пачками
+    """
+    order_rows = (
+        Order.products.through.objects
+        .order_by("order_id")
+        .values_list("order_id", "product_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    yield from _grouped(order_rows)
+    yield from _archived_groups(chunk_size)
+    basket_rows = (
+        BasketItem.objects
+        .order_by("basket_id")
+        .values_list("basket_id", "product_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    yield from _grouped(basket_rows)
+
+
+def count_shard(groups, low, high):
+    """
+    Строки матрицы совместных покупок для товаров с id от low до high:
+    {товар: Counter(сосед: число групп)}. Возвращает также число пар.
+    """
+    counts = defaultdict(Counter)
+    pairs = 0
+    for group in groups:
+        sources = [product_id for product_id in group if low <= product_id <= high]
+        if not sources:
+            continue
+        for product_id in sources:
+            row = counts[product_id]
+            # сам товар тоже учитывается, он удаляется в top_neighbors
+            row.update(group)
+            pairs += len(group) - 1
+    return counts, pairs
+
+
+def drop_missing(counts):
+    """
+    Удаляет из строк матрицы товары, которых больше нет в каталоге
+    (они встречаются в снимках заказов холодного архива)
+    """
+    # in_bulk разбивает список id на пачки по ограничению числа параметров БД
+    existing = Product.objects.only("pk").in_bulk(set(counts).union(*counts.values())).keys()
+    for product_id in list(counts):
+        if product_id not in existing:
+            del counts[product_id]
+            continue
+        row = counts[product_id]
+        for neighbor in row.keys() - existing:
+            del row[neighbor]
+    return counts
+
+
+def top_neighbors(counts, top_k):
+    """
+    {товар: [(сосед, счет), ...]} - top_k соседей с наибольшим счетом,
+    при равенстве - с меньшим id
+    """
+    result = {}
+    for product_id, row in counts.items():
+        del row[product_id]
+        result[product_id] = heapq.nlargest(top_k, row.items(), key=lambda item: (item[1], -item[0]))
+    return result
+
+
+def _shards(shard_size):
+    last = 0
+    while True:
+        ids = list(
+            Product.objects.filter(pk__gt=last).order_by("pk").values_list("pk", flat=True)[:shard_size]
+        )
+        if not ids:
+            return
+        yield ids[0], ids[-1], len(ids)
+        last = ids[-1]
+
+
+def build(top_k=TOP_K, shard_size=SHARD_SIZE, chunk_size=CHUNK_SIZE):
+    """
+    Пересчитывает рекомендации всех товаров. Рекомендации шарда
+    заменяются в одной транзакции, так что читатели видят либо прежний,
+    либо новый список товара.
+    """
+    started = time.perf_counter()
+    products = shards = groups_total = pairs_total = saved = 0
+    for low, high, size in _shards(shard_size):
+        groups = 0
+
+        def counted_groups():
+            nonlocal groups
+            for group in iter_groups(chunk_size):
+                groups += 1
+                yield group
+
+        counts, pairs = count_shard(counted_groups(), low, high)
+        drop_missing(counts)
+        rows = [
+            ProductRecommendation(product_id=product_id, recommended_id=neighbor, score=score, rank=rank)
+            for product_id, neighbors in top_neighbors(counts, top_k).items()
+            for rank, (neighbor, score) in enumerate(neighbors)
+        ]
+        with transaction.atomic():
+            ProductRecommendation.objects.filter(product_id__gte=low, product_id__lte=high).delete()
+            ProductRecommendation.objects.bulk_create(rows, batch_size=chunk_size)
+        products += size
+        shards += 1
+        groups_total = groups
+        pairs_total += pairs
+        saved += len(rows)
+    return BuildStats(
+        products=products,
+        shards=shards,
+        groups=groups_total,
+        pairs=pairs_total,
+        recommendations=saved,
+        seconds=time.perf_counter() - started,
+    )
+
+
+def recommended_for(product_id, limit=TOP_K):
+    """
+    Рекомендованные товары одним запросом по индексу (product, rank)
+    """
+    return [
+        item.recommended
+        for item in (
+            ProductRecommendation.objects
+            .filter(product_id=product_id)
+            .select_related("recommended")
+            .order_by("rank")[:limit]
+        )
+    ]
@@ -0,0 +1,338 @@
+"""
+Отчеты по заказам и продажам за произвольный период.
+
+Построчные отчеты (orders) читаются через iterator(), то есть серверным
+курсором там, где он поддерживается, и отдаются потоком. Сводные отчеты
+считаются агрегацией в БД; для закрытых периодов (дата окончания раньше
+сегодняшней) результат кешируется, и повторный запрос не обращается к БД.
+"""
+import csv
+import datetime
+import json
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from api import metrics
+
+from .models import ArchivedOrder, Category, DailyCategorySales, Order, OrderLine, Product
+
+CHUNK_SIZE = 2000
+CACHE_PREFIX = "shopapp:report"
+
+
+class ReportError(ValueError):
+    """
+    Неверные параметры отчета
+    """
+
+
+def _bounds(date_from, date_to):
+    """
+    Полуинтервал [начало date_from, начало следующего за date_to дня)
+    в текущем часовом поясе - так фильтр использует индекс по created_at
+    """
+    if date_from > date_to:
+        raise ReportError("Дата начала позже даты окончания")
+    start = timezone.make_aware(datetime.datetime.combine(date_from, datetime.time.min))
+    end = timezone.make_aware(
+        datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min)
+    )
+    return start, end
+
+
+def _paid_orders(start, end):
+    return Order.objects.filter(archived=True, created_at__gte=start, created_at__lt=end)
+
+
+def _archived_orders(start, end):
+    return ArchivedOrder.objects.filter(created_at__gte=start, created_at__lt=end)
+
+
+def orders_report(date_from, date_to):
+    """
+    Все заказы периода построчно, включая перенесенные в холодный архив
+    """
+    start, end = _bounds(date_from, date_to)
+    fields = [
+        "id", "created_at", "customer", "email", "city",
+        "delivery_type", "payment_type", "total_cost", "status",
+    ]
+    columns = (
+        "pk", "created_at", "full_name__surname", "full_name__email", "city",
+        "delivery_type", "payment_type", "total_cost", "status",
+    )
+    hot = (
+        Order.objects
+        .filter(created_at__gte=start, created_at__lt=end)
+        .order_by("created_at")
+        .values_list(*columns)
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    cold = (
+        _archived_orders(start, end)
+        .order_by("created_at")
+        .values_list("order_id", *columns[1:])
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+    def rows():
+        for source in (cold, hot):
+            for row in source:
+                yield dict(zip(fields, row))
+
+    return fields, rows()
+
+
+def _merge_grouped(key, *sources):
+    totals = defaultdict(lambda: {"orders": 0, "revenue": Decimal(0)})
+    for source in sources:
+        for row in source:
+            totals[row[key]]["orders"] += row["orders"]
+            totals[row[key]]["revenue"] += row["revenue"] or 0
+    return [
+        {key: group, "orders": value["orders"], "revenue": value["revenue"]}
+        for group, value in sorted(totals.items(), key=lambda item: str(item[0]))
+    ]
+
+
+def revenue_by_day_report(date_from, date_to):
+    """
+    Выручка и количество оплаченных заказов по дням
+    """
+    start, end = _bounds(date_from, date_to)
+    tzinfo = timezone.get_current_timezone()
+
+    def grouped(queryset):
+        return (
+            queryset
+            .annotate(day=TruncDate("created_at", tzinfo=tzinfo))
+            .values("day")
+            .annotate(orders=Count("pk"), revenue=Sum("total_cost"))
+            .order_by()
+        )
+
+    rows = _merge_grouped(
+        "day", grouped(_paid_orders(start, end)), grouped(_archived_orders(start, end))
+    )
+    return ["day", "orders", "revenue"], rows
+
+
+def revenue_by_delivery_report(date_from, date_to):
+    """
+    Выручка и количество оплаченных заказов по типу доставки
+    """
+    start, end = _bounds(date_from, date_to)
+
+    def grouped(queryset):
+        return (
+            queryset
+            .values("delivery_type")
+            .annotate(orders=Count("pk"), revenue=Sum("total_cost"))
+            .order_by()
+        )
+
+    rows = _merge_grouped(
+        "delivery_type",
+        grouped(_paid_orders(start, end)),
+        grouped(_archived_orders(start, end)),
+    )
+    return ["delivery_type", "orders", "revenue"], rows
+
+
+def _line_totals(start, end):
+    """
+    Позиции оплаченных заказов периода по товарам: {id товара: {"orders",
+    "lines", "units", "revenue", "title", "category_id"}}. Горячие заказы
+    читаются из OrderLine агрегацией в БД, перенесенные в архив - из
+    снимков ArchivedOrder.lines. Для заказов, перенесенных в архив до
+    появления снимка позиций, берется снимок товаров: одна единица по цене
+    на момент переноса.
+    """
+    totals = defaultdict(lambda: {"orders": 0, "lines": 0, "units": 0, "revenue": Decimal(0)})
+    hot = (
+        OrderLine.objects
+        .filter(order__archived=True, order__created_at__gte=start, order__created_at__lt=end)
+        .values("product_id")
+        .annotate(
+            orders=Count("order_id", distinct=True),
+            lines=Count("pk"),
+            units=Sum("quantity"),
+            revenue=Sum(ExpressionWrapper(
+                F("price") * F("quantity"),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )),
+        )
+        .order_by()
+    )
+    for row in hot:
+        total = totals[row["product_id"]]
+        for field in ("orders", "lines", "units", "revenue"):
+            total[field] += row[field] or 0
+
+    # название и категория товаров, удаленных после переноса заказа в архив
+    snapshots = {}
+    cold = _archived_orders(start, end).values_list("lines", "products").iterator(chunk_size=CHUNK_SIZE)
+    for lines, products in cold:
+        if not lines:
+            lines = [
+                {"product": item["id"], "category": item["category"], "title": item["title"],
+                 "quantity": 1, "price": item["price"]}
+                for item in products
+            ]
+        for product_id in {line["product"] for line in lines}:
+            totals[product_id]["orders"] += 1
+        for line in lines:
+            total = totals[line["product"]]
+            total["lines"] += 1
+            total["units"] += line["quantity"]
+            total["revenue"] += Decimal(line["price"]) * line["quantity"]
+            snapshots[line["product"]] = (line["title"], line["category"])
+
+    current = {
+        pk: (title, category_id)
+        for pk, title, category_id in Product.objects.filter(pk__in=list(totals)).values_list(
+            "pk", "title", "category_id"
+        )
+    }
+    for product_id, total in totals.items():
+        total["title"], total["category_id"] = current.get(product_id) or snapshots[product_id]
+    return totals
+
+
+def products_report(date_from, date_to):
+    """
+    Продажи по товарам за период, включая заказы в холодном архиве: в скольких
+    оплаченных заказах был товар, проданные единицы и выручка по ценам оплаты
+    """
+    start, end = _bounds(date_from, date_to)
+    totals = _line_totals(start, end)
+    categories = dict(
+        Category.objects
+        .filter(pk__in={total["category_id"] for total in totals.values()})
+        .values_list("pk", "title")
+    )
+    fields = ["product_id", "title", "category", "orders", "units", "revenue"]
+    return fields, [
+        {
+            "product_id": product_id,
+            "title": total["title"],
+            "category": categories.get(total["category_id"]),
+            "orders": total["orders"],
+            "units": total["units"],
+            "revenue": total["revenue"],
+        }
+        for product_id, total in sorted(totals.items(), key=lambda item: (-item[1]["orders"], item[0]))
+    ]
+
+
+def categories_report(date_from, date_to):
+    """
+    Продажи по категориям за период, включая заказы в холодном архиве:
+    количество позиций в оплаченных заказах, единицы и выручка по ценам оплаты
+    """
+    start, end = _bounds(date_from, date_to)
+    by_category = defaultdict(lambda: {"lines": 0, "units": 0, "revenue": Decimal(0)})
+    for total in _line_totals(start, end).values():
+        category = by_category[total["category_id"]]
+        for field in ("lines", "units", "revenue"):
+            category[field] += total[field]
+    categories = dict(Category.objects.filter(pk__in=list(by_category)).values_list("pk", "title"))
+    fields = ["category_id", "category", "lines", "units", "revenue"]
+    return fields, [
+        {
+            "category_id": category_id,
+            "category": categories.get(category_id),
+            "lines": total["lines"],
+            "units": total["units"],
+            "revenue": total["revenue"],
+        }
+        for category_id, total in sorted(by_category.items(), key=lambda item: (-item[1]["lines"], item[0]))
+    ]
+
+
+def daily_sales_report(date_from, date_to):
+    """
+    Продажи по дням и категориям из дневных сводок (shopapp.rollups):
+    единицы, выручка по ценам оплаты и количество заказов
+    """
+    if date_from > date_to:
+        raise ReportError("Дата начала позже даты окончания")
+    rows = (
+        DailyCategorySales.objects
+        .filter(date__gte=date_from, date__lte=date_to)
+        .order_by("date", "category_id")
+        .values_list("date", "category_id", "category__title", "units", "revenue", "orders")
+    )
+    fields = ["day", "category_id", "category", "units", "revenue", "orders"]
+    return fields, [dict(zip(fields, row)) for row in rows]
+
+
+REPORTS = {
+    "orders": orders_report,
+    "revenue-by-day": revenue_by_day_report,
+    "revenue-by-delivery": revenue_by_delivery_report,
+    "products": products_report,
+    "categories": categories_report,
+    "daily-sales": daily_sales_report,
+}
+# построчные отчеты не кешируются - они большие и отдаются потоком
+STREAMED_REPORTS = {"orders"}
+
+
+def build_report(name, date_from, date_to):
+    """
+    Возвращает (поля, строки) отчета. Сводные отчеты по закрытому периоду
+    берутся из кеша, если уже считались.
+    """
+    if name not in REPORTS:
+        raise ReportError(f"Неизвестный отчет {name}, допустимо: {', '.join(REPORTS)}")
+    report = REPORTS[name]
+    if name in STREAMED_REPORTS or date_to >= timezone.localdate():
+        return report(date_from, date_to)
+
+    key = f"{CACHE_PREFIX}:{name}:{date_from.isoformat()}:{date_to.isoformat()}"
+    cached = cache.get(key)
+    metrics.inc("cache_requests_total", cache="reports", result="miss" if cached is None else "hit")
+    if cached is None:
+        fields, rows = report(date_from, date_to)
+        cached = (fields, list(rows))
+        cache.set(key, cached, getattr(settings, "REPORTS_CACHE_TIMEOUT", 60 * 60 * 24))
+    return cached
+
+
+class _Echo:
+    """
+    Псевдофайл для csv.writer, возвращающий записанную строку
+    """
+    def write(self, value):
+        return value
+
+
+def _plain(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def stream_rows(fields, rows, file_format):
+    """
+    Генератор строк отчета в CSV (с заголовком) или JSONL
+    """
+    if file_format == "csv":
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([_plain(row[field]) for field in fields])
+    else:
+        for row in rows:
+            yield json.dumps(
+                {field: _plain(row[field]) for field in fields}, ensure_ascii=False
+            ) + "\n"
@@ -0,0 +1,237 @@
+"""
+Дневные сводки продаж по товарам и категориям.
+
+Исходные данные - позиции оплаченных заказов (OrderLine) и успешные оплаты
+(Payment). Сводки обновляются инкрементально: каждый проход добавляет
+к сводкам оплаченные заказы без отметки Order.rollup_applied и ставит ее
+в той же транзакции. Отметка на заказе, а не id последней оплаты: оплата
+с меньшим id может зафиксироваться позже оплаты с большим, и граница по id
+пропустила бы ее навсегда. Проходы не пересекаются - строка SalesRollupMark
+блокируется на время пачки. Проход запускается после оплаты в PaymentAPIView
+и командой update_sales_rollups, которая догоняет пропущенное. Повторная
+оплата уже учтенного заказа сводки не меняет.
+
+Витрины (популярные товары, баннеры) и отчет daily-sales читают сводки,
+не обращаясь к таблицам заказов.
+"""
+import datetime
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.db import DatabaseError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from api import response_cache
+
+from .models import (
+    DailyCategorySales,
+    DailyProductSales,
+    Order,
+    OrderLine,
+    SalesRollupMark,
+)
+
+MARK_NAME = "sales"
+BATCH_SIZE = 1000
+
+TOTAL_FIELDS = ("units", "revenue", "orders")
+
+
+class RollupDiff(NamedTuple):
+    """
+    Расхождение сводки с пересчетом по исходным данным;
+    key - id товара или категории
+    """
+    date: datetime.date
+    key: int
+    stored: tuple
+    expected: tuple
+
+
+def _line_totals(lines, key):
+    """
+    Суммы позиций заказов по (день заказа, key)
+    """
+    tzinfo = timezone.get_current_timezone()
+    rows = (
+        lines
+        .annotate(day=TruncDate("order__created_at", tzinfo=tzinfo))
+        .values("day", key)
+        .annotate(
+            units=Sum("quantity"),
+            revenue=Sum(ExpressionWrapper(
+                F("price") * F("quantity"),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )),
+            orders=Count("order_id", distinct=True),
+        )
+        .order_by()
+    )
+    return {
+        (row["day"], row[key]): (row["units"], Decimal(row["revenue"]), row["orders"])
+        for row in rows
+    }
+
+
+def _add_totals(model, key_field, totals):
+    """
+    Прибавляет totals к строкам сводки model. Вызывается под блокировкой
+    отметки, поэтому других писателей сводок в это время нет.
+    """
+    if not totals:
+        return
+    days = {day for day, _ in totals}
+    keys = {key for _, key in totals}
+    existing = {
+        (row.date, getattr(row, key_field)): row
+        for row in model.objects.filter(date__in=days, **{f"{key_field}__in": keys})
+    }
+    objects = []
+    for (day, key), (units, revenue, orders) in totals.items():
+        row = existing.get((day, key))
+        if row is not None:
+            units += row.units
+            revenue += row.revenue
+            orders += row.orders
+        objects.append(model(
+            date=day, units=units, revenue=revenue, orders=orders, **{key_field: key}
+        ))
+    model.objects.bulk_create(
+        objects,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["date", key_field.removesuffix("_id")],
+        update_fields=list(TOTAL_FIELDS),
+    )
+
+
+def apply_pending(batch_size=BATCH_SIZE):
+    """
+    Учитывает в сводках все оплаченные заказы, которые еще не учтены.
+    Возвращает количество добавленных заказов.
+    """
+    applied = 0
+    while True:
+        with transaction.atomic():
+            SalesRollupMark.objects.select_for_update().get_or_create(name=MARK_NAME)
+            order_ids = list(
+                Order.objects
+                .filter(archived=True, rollup_applied=False, pay_order__success=True)
+                .order_by("pk")
+                .values_list("pk", flat=True)
+                .distinct()[:batch_size]
+            )
+            if not order_ids:
+                return applied
+
+            lines = OrderLine.objects.filter(order_id__in=order_ids)
+            _add_totals(DailyProductSales, "product_id", _line_totals(lines, "product_id"))
+            _add_totals(
+                DailyCategorySales, "category_id", _line_totals(lines, "product__category_id")
+            )
+            Order.objects.filter(pk__in=order_ids).update(rollup_applied=True)
+            applied += len(order_ids)
+            # баннеры и популярные товары строятся по сводкам
+            response_cache.invalidate("rollups")
+
+
+def _apply_after_payment():
+    try:
+        apply_pending()
+    except DatabaseError:
+        # оплата уже сохранена, пропущенное догонит update_sales_rollups
+        pass
+
+
+def schedule_update():
+    """
+    Обновляет сводки после фиксации текущей транзакции
+    """
+    transaction.on_commit(_apply_after_payment)
+
+
+def _window(date_from, date_to):
+    start = timezone.make_aware(datetime.datetime.combine(date_from, datetime.time.min))
+    end = timezone.make_aware(
+        datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min)
+    )
+    return start, end
+
+
+def _expected_lines(date_from, date_to):
+    """
+    Позиции заказов периода, уже учтенных в сводках
+    """
+    start, end = _window(date_from, date_to)
+    return OrderLine.objects.filter(
+        order__created_at__gte=start, order__created_at__lt=end, order__rollup_applied=True
+    )
+
+
+def _stored(model, key_field, date_from, date_to):
+    return {
+        (row["date"], row[key_field]): (row["units"], row["revenue"], row["orders"])
+        for row in model.objects
+        .filter(date__gte=date_from, date__lte=date_to)
+        .values("date", key_field, *TOTAL_FIELDS)
+    }
+
+
+def _diff(stored, expected):
+    empty = (0, Decimal(0), 0)
+    return [
+        RollupDiff(day, key, stored.get((day, key), empty), expected.get((day, key), empty))
+        for day, key in sorted(set(stored) | set(expected))
+        if stored.get((day, key), empty) != expected.get((day, key), empty)
+    ]
+
+
+def verify(date_from, date_to):
+    """
+    Пересчитывает сводки по товарам и категориям за период из исходных данных
+    и возвращает расхождения: (по товарам, по категориям).
+    Заказы, уже перенесенные в ArchivedOrder, в пересчет не попадают,
+    поэтому проверять имеет смысл период новее границы архивации.
+    """
+    lines = _expected_lines(date_from, date_to)
+    products = _diff(
+        _stored(DailyProductSales, "product_id", date_from, date_to),
+        _line_totals(lines, "product_id"),
+    )
+    categories = _diff(
+        _stored(DailyCategorySales, "category_id", date_from, date_to),
+        _line_totals(lines, "product__category_id"),
+    )
+    return products, categories
+
+
+@transaction.atomic
+def rebuild(date_from, date_to):
+    """
+    Перезаписывает сводки за период пересчетом из исходных данных
+    """
+    SalesRollupMark.objects.select_for_update().get_or_create(name=MARK_NAME)
+    lines = _expected_lines(date_from, date_to)
+    for model, key_field, key in (
+        (DailyProductSales, "product_id", "product_id"),
+        (DailyCategorySales, "category_id", "product__category_id"),
+    ):
+        model.objects.filter(date__gte=date_from, date__lte=date_to).delete()
+        _add_totals(model, key_field, _line_totals(lines, key))
+
+
+def top_product_ids(days=30, limit=8):
+    """
+    id самых продаваемых товаров за последние days дней, по убыванию продаж
+    """
+    since = timezone.localdate() - datetime.timedelta(days=days)
+    return list(
+        DailyProductSales.objects
+        .filter(date__gt=since)
+        .values("product_id")
+        .annotate(total_units=Sum("units"))
+        .order_by("-total_units", "product_id")
+        .values_list("product_id", flat=True)[:limit]
+    )
@@ -1,8 +1,9 @@
 from rest_framework import serializers
 
 from .models import (
-    Product, Review, Tag, Specification, BasketItem, Order
+    Product, Review, Tag, BasketItem, Order, ArchivedOrder
 )
+from .recommendations import recommended_for
 
 
 class ProductSerializer(serializers.Serializer):
@@ -15,13 +16,14 @@ class ProductSerializer(serializers.Serializer):
         reviews = Review.objects.filter(product_id=instance.id).values_list(
             "rate", flat=True
         )
-        tags = Tag.objects.filter(tags__id=instance.id)
+        tags = instance.tags.all()
         if reviews.count() == 0:
             rating = "Пока нет отзывов"
         else:
             rating = sum(reviews) / reviews.count()
         rep['title'] = instance.title
         rep['price'] = instance.price
+        rep['salePrice'] = instance.effective_price
         rep['images'] = instance.get_image()
         rep['tags'] = [{"id": tag.pk, "name": tag.name} for tag in tags]
         rep['reviews'] = reviews.count()
@@ -39,7 +41,7 @@ class ProductSerializer(serializers.Serializer):
 class DetailsSerializer(ProductSerializer):
     def to_representation(self, instance):
         rep = super().to_representation(instance)
-        specifications = Specification.objects.filter(pk=instance.id)
+        specifications = instance.specifications.all()
         reviews = Review.objects.filter(product_id=instance.id)
 
         rep['specifications'] = [{'name': spec.name, 'value': spec.value} for spec in specifications]
@@ -53,15 +55,22 @@ class DetailsSerializer(ProductSerializer):
             }
             for review in reviews
         ]
+        rep['alsoBought'] = [
+            {
+                'id': product.pk,
+                'title': product.title,
+                'price': product.price,
+                'salePrice': product.effective_price,
+            }
+            for product in recommended_for(instance.pk)
+        ]
         return rep
 
 
 class TagSerializer(serializers.ModelSerializer):
-    id = serializers.CharField(source="name")
-
     class Meta:
         model = Tag
-        fields = "__all__"
+        fields = "id", "name", "slug"
 
 
 class BasketItemSerializer(serializers.ModelSerializer):
@@ -75,13 +84,24 @@ class BasketItemSerializer(serializers.ModelSerializer):
         return data
 
 
+def order_profile(serializer, instance):
+    """
+    Профиль покупателя заказа. Если вьюха передала профиль пользователя
+    в context["profile"] и заказ его, профиль повторно не загружается.
+    """
+    profile = serializer.context.get("profile")
+    if profile is not None and profile.pk == instance.full_name_id:
+        return profile
+    return instance.full_name
+
+
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = '__all__'
 
     def to_representation(self, instance):
-        profile = instance.full_name
+        profile = order_profile(self, instance)
         products = instance.basket.baskets.all()
         data = {
             "id": instance.pk,
@@ -111,3 +131,30 @@ class OrderSerializer(serializers.ModelSerializer):
             } for item in products],
         }
         return data
+
+
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    """
+    Вывод заказа из холодного архива в том же формате, что и OrderSerializer,
+    товары берутся из сохраненного снимка
+    """
+    class Meta:
+        model = ArchivedOrder
+        fields = '__all__'
+
+    def to_representation(self, instance):
+        profile = order_profile(self, instance)
+        return {
+            "id": instance.order_id,
+            "createdAt": instance.created_at.strftime("%Y.%m.%d %H:%M"),
+            "fullName": f"{profile.surname} {profile.name} {profile.patronymic}",
+            "email": profile.email,
+            "phone": profile.phone,
+            "deliveryType": instance.delivery_type,
+            "paymentType": instance.payment_type,
+            "totalCost": instance.total_cost,
+            "status": instance.status,
+            "city": instance.city,
+            "address": instance.delivery_address,
+            "products": instance.products,
+        }
@@ -0,0 +1,132 @@
+"""
+Настройки магазина (стоимость доставки и порог бесплатной доставки),
+которые администратор меняет в админке.
+
+Настройки хранятся одной строкой DeliveryPrices (первой по id) и
+читаются get_shop_config() из памяти процесса. Загруженное значение
+помечено версией из кеша CACHES[ALIAS]; сохранение или удаление строки
+меняет версию (сигнал, после фиксации транзакции), и каждый процесс,
+сверяя версию не чаще раза в CHECK_INTERVAL секунд, перечитывает
+настройки. Кроме того, изменение рассылается темой "shop-config" шины
+api.invalidation. Так изменение в админке доходит до всех воркеров не
+позже чем через CHECK_INTERVAL секунд, а запросы не обращаются к БД.
+
+Если строки нет, get_shop_config() выбрасывает ShopConfigMissing,
+вьюхи отвечают 503 с описанием ошибки.
+"""
+import threading
+import time
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from api import invalidation
+
+from .models import DeliveryPrices
+
+DEFAULT_SHOP_CONFIG = {
+    "ALIAS": "default",
+    # как часто процесс сверяет версию настроек, с
+    "CHECK_INTERVAL": 1,
+}
+
+VERSION_KEY = "shopconfig:version"
+# тема шины инвалидации
+TOPIC = "shop-config"
+
+
+def get_settings():
+    return {**DEFAULT_SHOP_CONFIG, **getattr(settings, "SHOP_CONFIG", {})}
+
+
+class ShopConfigMissing(LookupError):
+    """
+    Настройки магазина не заданы в админке
+    """
+    def __init__(self):
+        super().__init__(
+            "Настройки доставки не заданы: создайте запись "
+            "\"Стоимость доставки\" в админке"
+        )
+
+
+class ShopConfig(NamedTuple):
+    delivery_cost: Decimal
+    delivery_express_cost: Decimal
+    # доставка бесплатна для заказов дороже этой суммы
+    delivery_free_minimum_cost: Decimal
+
+    @classmethod
+    def from_model(cls, prices):
+        return cls(
+            delivery_cost=prices.delivery_cost,
+            delivery_express_cost=prices.delivery_express_cost,
+            delivery_free_minimum_cost=prices.delivery_free_minimum_cost,
+        )
+
+    def delivery_for(self, total_cost):
+        """
+        Стоимость обычной доставки заказа на сумму total_cost
+        """
+        return Decimal(0) if total_cost > self.delivery_free_minimum_cost else self.delivery_cost
+
+
+class _Loaded(NamedTuple):
+    config: ShopConfig
+    version: object
+    checked_at: float
+
+
+_lock = threading.Lock()
+_loaded = None
+
+
+def get_shop_config():
+    """
+    Настройки магазина из памяти процесса, перечитываются после смены версии
+    """
+    global _loaded
+    options = get_settings()
+    now = time.monotonic()
+    loaded = _loaded
+    if loaded is not None and now - loaded.checked_at < options["CHECK_INTERVAL"]:
+        return loaded.config
+    with _lock:
+        # версия читается до настроек: изменение между ними даст
+        # лишнее перечитывание при следующей сверке, а не устаревшие данные
+        version = caches[options["ALIAS"]].get(VERSION_KEY)
+        if _loaded is not None and _loaded.version == version:
+            _loaded = _loaded._replace(checked_at=now)
+            return _loaded.config
+        prices = DeliveryPrices.objects.order_by("pk").first()
+        if prices is None:
+            raise ShopConfigMissing()
+        _loaded = _Loaded(ShopConfig.from_model(prices), version, now)
+        return _loaded.config
+
+
+def clear_local():
+    global _loaded
+    with _lock:
+        _loaded = None
+
+
+def invalidate():
+    """
+    Меняет версию настроек после фиксации текущей транзакции
+    """
+    def bump():
+        clear_local()
+        caches[get_settings()["ALIAS"]].set(VERSION_KEY, time.time_ns(), None)
+
+    transaction.on_commit(bump)
+    invalidation.publish(TOPIC)
+
+
+@invalidation.subscribe
+def _config_changed(topics):
+    if TOPIC in topics:
+        clear_local()
@@ -0,0 +1,74 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from api import response_cache
+
+from . import shop_config, tags
+from .pricing import refresh_effective_prices
+from .models import (
+    Category, DeliveryPrices, Product, ProductImage, Review, Sale, Specification, Subcategory, Tag,
+)
+
+# Отправляется один раз на пачку массовых изменений товаров (цены, остатки,
+# распродажи) после фиксации транзакции. Аргумент product_ids - множество
+# id затронутых товаров. Подписчики сбрасывают закешированные данные каталога.
+products_changed = Signal()
+
+# теги кеша ответов (api.response_cache), которые сбрасывает изменение модели
+CACHE_TAGS = {
+    Product: ("products", "sales"),
+    ProductImage: ("products", "sales"),
+    Specification: ("products",),
+    Review: ("products",),
+    Sale: ("products", "sales"),
+    Category: ("categories",),
+    Subcategory: ("categories",),
+    Tag: ("tags", "products"),
+}
+
+
+# поля товара, которые не видны в каталоге и не влияют на цену: сохранение
+# только этих полей (update_fields) не сбрасывает кеш и не пересчитывает цену
+PRODUCT_COUNTER_FIELDS = frozenset({"count_of_orders"})
+
+
+def _counters_only(sender, update_fields):
+    return sender is Product and bool(update_fields) and update_fields <= PRODUCT_COUNTER_FIELDS
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    tags.invalidate()
+
+
+@receiver([post_save, post_delete], sender=DeliveryPrices)
+def shop_config_changed(sender, instance, **kwargs):
+    shop_config.invalidate()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, update_fields=None, **kwargs):
+    if not _counters_only(sender, update_fields):
+        refresh_effective_prices([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Sale)
+def sale_changed(sender, instance, **kwargs):
+    refresh_effective_prices([instance.product_id])
+
+
+@receiver([post_save, post_delete])
+def model_changed(sender, update_fields=None, **kwargs):
+    if sender in CACHE_TAGS and not _counters_only(sender, update_fields):
+        response_cache.invalidate(*CACHE_TAGS[sender])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def product_tags_changed(sender, action, **kwargs):
+    if action.startswith("post_"):
+        response_cache.invalidate("products", "tags")
+
+
+@receiver(products_changed)
+def products_bulk_changed(sender, **kwargs):
+    response_cache.invalidate("products", "sales")
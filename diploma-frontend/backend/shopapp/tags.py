@@ -0,0 +1,98 @@
+"""
+Теги товаров: ключ тега - slug, фильтры по тегам - целочисленные
+условия по tag_id в промежуточной таблице Product.tags.through.
+
+Соответствие slug и названия тега его id хранится в памяти процесса.
+Оно перечитывается целиком при изменении тегов в этом процессе или
+в другом (тема "tags" шины api.invalidation), не реже раза в MAP_TIMEOUT
+секунд и при обращении к неизвестному тегу (не чаще раза в MISS_REFRESH
+секунд).
+"""
+import threading
+import time
+
+from django.db.models import Exists, OuterRef
+from django.utils.text import slugify
+
+from api import invalidation
+
+from .models import Product, Tag
+
+MAP_TIMEOUT = 300
+MISS_REFRESH = 5
+
+# id, которого нет у тегов: фильтр по неизвестному тегу дает пустую выборку
+UNKNOWN_TAG_ID = 0
+
+_lock = threading.Lock()
+_map = None
+_loaded_at = 0.0
+
+
+def tag_slug(name):
+    return slugify(name, allow_unicode=True)
+
+
+def _load():
+    global _map, _loaded_at
+    mapping = {}
+    for pk, name, slug in Tag.objects.values_list("pk", "name", "slug"):
+        mapping[slug] = pk
+        mapping.setdefault(tag_slug(name), pk)
+    _map, _loaded_at = mapping, time.monotonic()
+    return mapping
+
+
+def invalidate():
+    global _map
+    with _lock:
+        _map = None
+
+
+@invalidation.subscribe
+def _tags_changed(topics):
+    if "tags" in topics:
+        invalidate()
+
+
+def _get_map():
+    with _lock:
+        if _map is None or time.monotonic() - _loaded_at > MAP_TIMEOUT:
+            return _load()
+        return _map
+
+
+def _refresh_on_miss():
+    with _lock:
+        if time.monotonic() - _loaded_at > MISS_REFRESH:
+            return _load()
+        return _map
+
+
+def tag_ids(values):
+    """
+    id тегов по значениям из запроса: id, slug или название.
+    Неизвестные теги дают UNKNOWN_TAG_ID.
+    """
+    mapping = _get_map()
+    ids = []
+    for value in values:
+        value = str(value).strip()
+        # isdigit() верно и для "²", int() такие строки не разбирает
+        if value.isascii() and value.isdigit():
+            ids.append(int(value))
+            continue
+        slug = tag_slug(value)
+        if slug not in mapping:
+            mapping = _refresh_on_miss()
+        ids.append(mapping.get(slug, UNKNOWN_TAG_ID))
+    return ids
+
+
+def tagged(products, *values):
+    """
+    Товары, отмеченные хотя бы одним из тегов values
+    """
+    return products.filter(Exists(
+        Product.tags.through.objects.filter(product_id=OuterRef("pk"), tag_id__in=tag_ids(values))
+    ))
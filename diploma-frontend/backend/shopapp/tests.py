@@ -1,3 +1,724 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from api import response_cache
+from myauth.models import UserProfile
+from myauth.tests import TEST_CACHES, ProfileQueriesTestCase, png_file
+
+from .management.commands.run_sale_worker import Command as SaleWorker
+from .models import (
+    ArchivedOrder, Basket, BasketItem, Category, DailyProductSales, DeliveryPrices, Order,
+    OrderLine, Payment, Product, ProductImage, Review, Sale, Specification, Subcategory, Tag,
+)
+from . import bulk, rollups, tags
+from .catalog_io import CSV_FIELDS, CatalogRowError, read_rows
+from .catalog import CatalogParams, build_catalog_queryset, compile_catalog_query, get_catalog_page
+from .pricing import apply_sale_transitions
+from .signals import products_changed
+from .recommendations import build as build_recommendations, recommended_for
+from .reports import categories_report, products_report
+
+
+def make_product(title="Ноутбук", price="100.00", category=None):
+    if category is None:
+        category = Category.objects.create(title="Компьютеры")
+    subcategory = Subcategory.objects.create(title="Ноутбуки", category=category)
+    return Product.objects.create(
+        title=title, price=Decimal(price), count=10, category=category, subcategory=subcategory,
+    )
+
+
+class ProductReviewAPIViewTests(ProfileQueriesTestCase):
+    def test_post(self):
+        product = make_product()
+        # товар, INSERT отзыва и его повторное сохранение
+        response = self.assertProfileNotQueried(
+            3, self.client.post, f"/api/product/{product.pk}/reviews",
+            {"text": "Хороший", "rate": 5}, content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Review.objects.get().author, self.profile)
+
+
+class OrdersAPIViewTests(ProfileQueriesTestCase):
+    def setUp(self):
+        super().setUp()
+        DeliveryPrices.objects.create(
+            delivery_cost=Decimal("200"), delivery_express_cost=Decimal("500"),
+            delivery_free_minimum_cost=Decimal("2000"),
+        )
+        self.product = make_product()
+        self.basket = Basket.objects.create(user=self.user)
+        BasketItem.objects.create(basket=self.basket, product=self.product, quantity=2)
+
+    def test_post(self):
+        # оформление заказа не сбрасывает кеш каталога
+        with mock.patch("api.response_cache.invalidate") as invalidate:
+            response = self.assertProfileNotQueried(
+                10, self.client.post, "/api/orders", [], content_type="application/json",
+            )
+        invalidate.assert_not_called()
+        order = Order.objects.get(pk=response.json()["orderId"])
+        self.assertEqual(order.full_name, self.profile)
+        self.assertEqual(order.total_cost, Decimal("400.00"))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.count_of_orders, 2)
+
+    def test_counter_save(self):
+        with mock.patch("api.response_cache.invalidate") as invalidate:
+            self.product.save(update_fields=["count_of_orders"])
+            invalidate.assert_not_called()
+            self.product.save()
+            invalidate.assert_called_with("products", "sales")
+
+    def test_history(self):
+        for _ in range(3):
+            Order.objects.create(full_name=self.profile, basket=self.basket, archived=True)
+        # заказы, по 7 запросов на товары каждого заказа и архив; покупатель
+        # всех заказов - профиль запроса, он не загружается для каждого заказа
+        response = self.assertProfileNotQueried(1 + 3 * 7 + 1, self.client.get, "/api/orders")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        self.assertEqual({order["email"] for order in response.json()}, {"buyer@example.com"})
+
+
+class OrderAccessTests(ProfileQueriesTestCase):
+    """
+    Оформление и оплата доступны только для заказов самого пользователя,
+    в том числе перенесенных в холодный архив
+    """
+    def setUp(self):
+        super().setUp()
+        basket = Basket.objects.create(user=self.user)
+        self.own = Order.objects.create(full_name=self.profile, basket=basket)
+        other_user = User.objects.create_user("other", password="secret")
+        other = UserProfile.objects.create(
+            user=other_user, name="Петр", surname="Петров", patronymic="Петрович",
+            phone="+71111111111", email="other@example.com", avatar="avatar_default.png",
+        )
+        self.foreign = Order.objects.create(full_name=other, basket=Basket.objects.create(user=other_user))
+        self.foreign_archived = ArchivedOrder.objects.create(
+            order_id=self.foreign.pk + 100, full_name=other, created_at=timezone.now(),
+            city="Москва", delivery_address="Тверская, 1", delivery_type="ordinary",
+            payment_type="online", status="оплачено",
+        )
+
+    def test_get(self):
+        self.assertEqual(self.client.get(f"/api/order/{self.own.pk}").status_code, 200)
+        self.assertEqual(self.client.get(f"/api/order/{self.foreign.pk}").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/order/{self.foreign_archived.order_id}").status_code, 404)
+
+    def test_post(self):
+        data = {"deliveryType": "ordinary", "paymentType": "online", "city": "Москва", "address": "Тверская, 1"}
+        response = self.client.post(f"/api/order/{self.foreign.pk}", data, content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+        self.foreign.refresh_from_db()
+        self.assertEqual(self.foreign.city, "")
+
+    def test_payment(self):
+        data = {"number": "2", "month": "12", "year": "99"}
+        response = self.client.post(f"/api/payment/{self.foreign.pk}", data, content_type="application/json")
+        self.assertEqual(response.status_code, 404)
+        self.foreign.refresh_from_db()
+        self.assertFalse(self.foreign.archived)
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(f"/api/order/{self.own.pk}").status_code, 403)
+        response = self.client.post(f"/api/payment/{self.own.pk}", {}, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+
+
+# шина инвалидации записывает события из другого потока, а транзакция
+# TestCase не фиксируется; сброс кешей этого процесса от нее не зависит
+@override_settings(CACHES=TEST_CACHES, INVALIDATION={"ENABLED": False})
+class SaleTransitionsTests(TestCase):
+    """
+    Перемотка времени: день за днем выполняется то же, что run_sale_worker
+    на границе дня, и проверяются цены товаров и список распродаж
+    """
+    START = datetime.date(2024, 3, 1)
+
+    def day(self, offset):
+        return self.START + datetime.timedelta(days=offset)
+
+    def at(self, offset):
+        return mock.patch("django.utils.timezone.localdate", return_value=self.day(offset))
+
+    def setUp(self):
+        with self.at(0):
+            category = Category.objects.create(title="Компьютеры")
+            self.current = make_product("Текущая", "200.00", category)
+            self.upcoming = make_product("Будущая", "100.00", category)
+            # скидка больше цены: товар продается за 0
+            self.oversized = make_product("Большая скидка", "80.00", category)
+            self.regular = make_product("Без распродажи", "60.00", category)
+            Sale.objects.create(product=self.current, discount=50, date_from=self.day(-5), date_to=self.day(0))
+            Sale.objects.create(product=self.upcoming, discount=30, date_from=self.day(1), date_to=self.day(2))
+            Sale.objects.create(product=self.oversized, discount=100, date_from=self.day(3), date_to=self.day(3))
+
+    def test_days(self):
+        # день: (цены current, upcoming, oversized, regular), товары в списке распродаж
+        expected = {
+            0: (("150.00", "100.00", "80.00", "60.00"), [self.current]),
+            1: (("200.00", "70.00", "80.00", "60.00"), [self.upcoming]),
+            2: (("200.00", "70.00", "80.00", "60.00"), [self.upcoming]),
+            3: (("200.00", "100.00", "0.00", "60.00"), [self.oversized]),
+            4: (("200.00", "100.00", "80.00", "60.00"), []),
+        }
+        products = [self.current, self.upcoming, self.oversized, self.regular]
+        for offset, (prices, on_sale) in expected.items():
+            with self.subTest(day=offset), self.at(offset):
+                if offset:
+                    with self.captureOnCommitCallbacks(execute=True):
+                        result = apply_sale_transitions(self.day(offset - 1), self.day(offset))
+                        SaleWorker.notify(result.changed)
+                effective = dict(
+                    Product.objects.filter(pk__in=[product.pk for product in products])
+                    .values_list("pk", "effective_price")
+                )
+                self.assertEqual([effective[product.pk] for product in products], [Decimal(price) for price in prices])
+
+                sales = self.client.get("/api/sales").json()["items"]
+                self.assertEqual([sale["id"] for sale in sales], [product.pk for product in on_sale])
+                for sale in sales:
+                    self.assertEqual(Decimal(str(sale["salePrice"])), effective[sale["id"]])
+
+    def test_missed_days(self):
+        # воркер не работал три дня: границы обрабатываются одним пересчетом
+        with self.at(3), self.captureOnCommitCallbacks(execute=True):
+            result = apply_sale_transitions(self.day(0), self.day(3))
+        self.assertEqual((result.activated, result.expired), (2, 2))
+        self.assertEqual(result.changed, {self.current.pk, self.oversized.pk})
+        self.current.refresh_from_db()
+        self.upcoming.refresh_from_db()
+        self.assertEqual(self.current.effective_price, Decimal("200.00"))
+        self.assertEqual(self.upcoming.effective_price, Decimal("100.00"))
+
+
+@override_settings(CACHES=TEST_CACHES, INVALIDATION={"ENABLED": False})
+class BulkOperationsTests(TestCase):
+    """
+    Массовые операции: пересчет effective_price в той же транзакции,
+    откат при dry_run и один сигнал products_changed после фиксации
+    """
+    def setUp(self):
+        category = Category.objects.create(title="Компьютеры")
+        self.laptop = make_product("Ноутбук", "100.00", category)
+        self.mouse = make_product("Мышь", "10.00", category)
+        self.products = Product.objects.filter(pk__in=[self.laptop.pk, self.mouse.pk])
+        self.today = timezone.localdate()
+        self.signals = []
+        products_changed.connect(self.record)
+        self.addCleanup(products_changed.disconnect, self.record)
+
+    def record(self, sender, product_ids, **kwargs):
+        self.signals.append(set(product_ids))
+
+    def prices(self):
+        return {
+            pk: (price, effective)
+            for pk, price, effective in Product.objects.values_list("pk", "price", "effective_price")
+        }
+
+    def test_dry_run(self):
+        before = self.prices()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            result = bulk.change_prices(self.products, 10, dry_run=True)
+        self.assertEqual((result.affected, result.dry_run), (2, True))
+        # предпросмотр показывает результат, хотя изменения откатаны
+        self.assertEqual({row["id"]: (row["before"], row["after"]) for row in result.preview}, {
+            self.laptop.pk: (Decimal("100.00"), Decimal("110.00")),
+            self.mouse.pk: (Decimal("10.00"), Decimal("11.00")),
+        })
+        self.assertEqual(self.prices(), before)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.signals, [])
+
+    def test_discount(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            result = bulk.apply_discount(
+                self.products, 10, self.today, self.today + datetime.timedelta(days=7)
+            )
+        self.assertEqual(result.affected, 2)
+        self.assertEqual(self.signals, [{self.laptop.pk, self.mouse.pk}])
+        self.assertEqual(self.prices(), {
+            self.laptop.pk: (Decimal("100.00"), Decimal("90.00")),
+            self.mouse.pk: (Decimal("10.00"), Decimal("9.00")),
+        })
+
+        # цена меняется вместе со скидочной ценой
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk.change_prices(self.products.filter(pk=self.laptop.pk), 50)
+        self.assertEqual(self.prices()[self.laptop.pk], (Decimal("150.00"), Decimal("140.00")))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk.remove_discount(self.products)
+        self.assertEqual(self.signals[1:], [{self.laptop.pk}, {self.laptop.pk, self.mouse.pk}])
+        self.assertEqual(self.prices(), {
+            self.laptop.pk: (Decimal("150.00"), Decimal("150.00")),
+            self.mouse.pk: (Decimal("10.00"), Decimal("10.00")),
+        })
+
+    def test_restock(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk.restock({self.laptop.pk: 5, self.mouse.pk: 1}, mode="add")
+            bulk.restock({self.mouse.pk: 0}, mode="set")
+        counts = dict(Product.objects.values_list("pk", "count"))
+        self.assertEqual(counts, {self.laptop.pk: 15, self.mouse.pk: 0})
+        self.assertEqual(self.signals, [{self.laptop.pk, self.mouse.pk}, {self.mouse.pk}])
+
+    def test_invalid(self):
+        for call in (
+            lambda: bulk.apply_discount(self.products, 100, self.today, self.today),
+            lambda: bulk.change_prices(self.products, -100),
+            lambda: bulk.restock({}, mode="replace"),
+        ):
+            with self.assertRaises(bulk.BulkOperationError):
+                call()
+
+
+class SalesReportsTests(ProfileQueriesTestCase):
+    """
+    Отчеты по товарам и категориям считают позиции по ценам оплаты,
+    в том числе у заказов, перенесенных в холодный архив
+    """
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(title="Компьютеры")
+        self.laptop = make_product("Ноутбук", "100.00", self.category)
+        self.mouse = make_product("Мышь", "10.00", self.category)
+        basket = Basket.objects.create(user=self.user)
+        now = timezone.now()
+        old = self.order(basket, now - datetime.timedelta(days=400), [(self.laptop, 1, "90.00"), (self.mouse, 3, "8.00")])
+        self.order(basket, now, [(self.laptop, 2, "100.00")])
+        call_command("archive_orders", months=6, stdout=io.StringIO())
+        self.assertTrue(ArchivedOrder.objects.filter(order_id=old.pk).exists())
+        # цена товара после оплаты не влияет на отчет
+        Product.objects.filter(pk=self.laptop.pk).update(price=Decimal("500.00"))
+        self.period = ((now - datetime.timedelta(days=500)).date(), now.date())
+
+    def order(self, basket, created_at, lines):
+        order = Order.objects.create(full_name=self.profile, basket=basket, archived=True)
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        for product, quantity, price in lines:
+            OrderLine.objects.create(order=order, product=product, quantity=quantity, price=Decimal(price))
+        return order
+
+    def test_products(self):
+        fields, rows = products_report(*self.period)
+        self.assertEqual(
+            [(row["title"], row["orders"], row["units"], row["revenue"]) for row in rows],
+            [("Ноутбук", 2, 3, Decimal("290.00")), ("Мышь", 1, 3, Decimal("24.00"))],
+        )
+        self.assertEqual({row["category"] for row in rows}, {"Компьютеры"})
+
+    def test_categories(self):
+        fields, rows = categories_report(*self.period)
+        self.assertEqual(
+            [(row["category_id"], row["lines"], row["units"], row["revenue"]) for row in rows],
+            [(self.category.pk, 3, 6, Decimal("314.00"))],
+        )
+
+
+@override_settings(CACHES=TEST_CACHES, INVALIDATION={"ENABLED": False})
+class SalesRollupsTests(ProfileQueriesTestCase):
+    """
+    Инкрементальные сводки учитывают каждый оплаченный заказ ровно один раз,
+    в том числе оплату, зафиксированную позже оплаты с большим id
+    """
+    def setUp(self):
+        super().setUp()
+        self.laptop = make_product("Ноутбук", "100.00", Category.objects.create(title="Компьютеры"))
+        self.basket = Basket.objects.create(user=self.user)
+        self.today = timezone.localdate()
+
+    def order(self, quantity):
+        order = Order.objects.create(full_name=self.profile, basket=self.basket, archived=True)
+        OrderLine.objects.create(order=order, product=self.laptop, quantity=quantity, price=Decimal("100.00"))
+        return order
+
+    def pay(self, order, success=True):
+        return Payment.objects.create(order=order, card_number="2", validity_period="12.30", success=success)
+
+    def totals(self):
+        row = DailyProductSales.objects.get(date=self.today, product=self.laptop)
+        return row.units, row.revenue, row.orders
+
+    def verify(self, *args):
+        out = io.StringIO()
+        day = self.today.isoformat()
+        call_command("verify_sales_rollups", "--from", day, "--to", day, *args, stdout=out)
+        return out.getvalue()
+
+    def test_late_commit(self):
+        early, late = self.order(1), self.order(2)
+        # оплата early создана раньше, а зафиксирована после оплаты late
+        payment = self.pay(early, success=False)
+        self.pay(late)
+        self.assertEqual(rollups.apply_pending(), 1)
+        Payment.objects.filter(pk=payment.pk).update(success=True)
+        self.assertEqual(rollups.apply_pending(), 1)
+        self.assertEqual(self.totals(), (3, Decimal("300.00"), 2))
+        self.assertEqual(rollups.apply_pending(), 0)
+
+    def test_repeat_payment(self):
+        order = self.order(2)
+        self.pay(order)
+        self.pay(order)
+        self.assertEqual(rollups.apply_pending(), 1)
+        self.pay(order)
+        self.assertEqual(rollups.apply_pending(), 0)
+        self.assertEqual(self.totals(), (2, Decimal("200.00"), 1))
+
+    def test_batches(self):
+        for quantity in (1, 2, 3):
+            self.pay(self.order(quantity))
+        self.assertEqual(rollups.apply_pending(batch_size=2), 3)
+        self.assertEqual(self.totals(), (6, Decimal("600.00"), 3))
+
+    def test_verify(self):
+        self.pay(self.order(2))
+        rollups.apply_pending()
+        # оплаченный, но еще не учтенный заказ расхождением не считается
+        self.pay(self.order(1))
+        self.assertIn("Расхождений нет", self.verify())
+
+        DailyProductSales.objects.filter(product=self.laptop).update(units=5)
+        with self.assertRaises(CommandError):
+            self.verify()
+        self.assertIn("Сводки за период пересчитаны", self.verify("--fix"))
+        self.assertEqual(rollups.verify(self.today, self.today), ([], []))
+        self.assertEqual(self.totals(), (2, Decimal("200.00"), 1))
+
+
+@override_settings(CACHES=TEST_CACHES, INVALIDATION={"ENABLED": False})
+class ProductImageAdminTests(TestCase):
+    """
+    Файлы формы изображения товара принимает обработчик изображений,
+    подключенный к вьюхам админки; CSRF по-прежнему проверяется
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        uploads = override_settings(
+            MEDIA_ROOT=directory, UPLOADS={"SPOOL_DIR": f"{directory}/spool", "ASYNC": False},
+        )
+        uploads.enable()
+        self.addCleanup(uploads.disable)
+        self.product = make_product()
+        self.admin = User.objects.create_superuser("admin", password="secret")
+        self.client.force_login(self.admin)
+        self.url = "/admin/shopapp/productimage/add/"
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+
+    def test_image(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {"product": self.product.pk, "image": png_file("photo.png")})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(ProductImage.objects.get().image.name.endswith("photo.png"))
+
+    def test_pending_upload(self):
+        # изображение создается вместе с записью файла: пока запись не
+        # выполнена, у товара нет изображения, а не изображение без файла
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(self.url, {"product": self.product.pk, "image": png_file("photo.png")})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(ProductImage.objects.exists())
+        response = self.client.get(f"/api/product/{self.product.pk}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["images"], [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.product.get_image()), 1)
+        self.assertTrue(self.product.get_image()[0]["src"].endswith("photo.png"))
+
+    def test_empty_image(self):
+        # строка без файла, оставшаяся от потерянной записи
+        ProductImage.objects.create(product=self.product, image="")
+        Sale.objects.create(
+            product=self.product, discount=10,
+            date_from=timezone.localdate(), date_to=timezone.localdate(),
+        )
+        for url in (f"/api/product/{self.product.pk}", "/api/catalog", "/api/banners", "/api/sales"):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.product.get_image(), [])
+
+    def test_rejected_type(self):
+        text = SimpleUploadedFile("photo.png", b"not an image at all", content_type="image/png")
+        response = self.client.post(self.url, {"product": self.product.pk, "image": text}, follow=True)
+        self.assertContains(response, "допустимы только изображения")
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.admin)
+        response = client.post(self.url, {"product": self.product.pk, "image": png_file("photo.png")})
+        self.assertEqual(response.status_code, 403)
+
+
+class CatalogQueryTests(TestCase):
+    """
+    SQL каталога компилируется один раз на форму запроса, значения
+    фильтров подставляются при каждом запросе
+    """
+    def setUp(self):
+        compile_catalog_query.cache_clear()
+        self.computers = Category.objects.create(title="Компьютеры")
+        self.phones = Category.objects.create(title="Телефоны")
+        self.red = Tag.objects.create(name="Красный", slug="red")
+        self.new = Tag.objects.create(name="Новинка", slug="new")
+        self.products = []
+        for index, (category, price, product_tags, color) in enumerate([
+            (self.computers, "100.00", [self.red], "черный"),
+            (self.computers, "250.00", [self.red, self.new], "белый"),
+            (self.phones, "50.00", [self.new], "черный"),
+            (self.phones, "300.00", [self.red, self.new], "черный"),
+        ]):
+            product = make_product(f"Товар 100% №{index}", price, category)
+            product.tags.set(product_tags)
+            Specification.objects.create(product=product, name="Цвет", value=color)
+            self.products.append(product)
+
+    def expected(self, params):
+        return list(build_catalog_queryset(params).values_list("pk", flat=True))
+
+    def test_same_shape(self):
+        requests = [
+            CatalogParams(category=self.computers.pk, min_price=Decimal("90"), tags=(self.red.pk,)),
+            CatalogParams(category=self.phones.pk, min_price=Decimal("10"), tags=(self.new.pk,)),
+            CatalogParams(category=self.phones.pk, min_price=Decimal("1000"), tags=(self.red.pk,)),
+            CatalogParams(category=self.computers.pk, min_price=Decimal("0"), tags=(0,)),
+        ]
+        for params in requests:
+            with self.subTest(params=params):
+                page = get_catalog_page(params, 1, 10)
+                self.assertEqual([product.pk for product in page.products], self.expected(params))
+        self.assertEqual(compile_catalog_query.cache_info().misses, 1)
+        self.assertEqual(compile_catalog_query.cache_info().hits, len(requests) - 1)
+
+    def test_filters(self):
+        requests = [
+            CatalogParams(),
+            CatalogParams(name="100%", sort="price", descending=True),
+            CatalogParams(name="№1"),
+            CatalogParams(max_price=Decimal("260"), available=True, sort="title"),
+            CatalogParams(tags=(self.red.pk, self.new.pk), specs=(("Цвет", "черный"),)),
+            CatalogParams(tags=(self.new.pk, self.red.pk), specs=(("Цвет", "белый"),), sort="reviews"),
+            CatalogParams(free_delivery=True),
+        ]
+        for params in requests:
+            with self.subTest(params=params):
+                page = get_catalog_page(params, 1, 10)
+                self.assertEqual([product.pk for product in page.products], self.expected(params))
+
+
+class RecommendationsTests(ProfileQueriesTestCase):
+    """
+    Заказы из холодного архива участвуют в рекомендациях, удаленные
+    с тех пор товары пропускаются
+    """
+    def test_archived_orders(self):
+        category = Category.objects.create(title="Компьютеры")
+        laptop = make_product("Ноутбук", "100.00", category)
+        mouse = make_product("Мышь", "10.00", category)
+        removed = make_product("Снят с продажи", "5.00", category)
+        snapshot = [
+            {"id": product.pk, "category": category.pk, "price": str(product.price), "count": 1, "title": product.title}
+            for product in (laptop, mouse, removed)
+        ]
+        removed.delete()
+        for order_id in (1, 2):
+            ArchivedOrder.objects.create(
+                order_id=order_id, full_name=self.profile, created_at=timezone.now(),
+                city="Москва", delivery_address="Тверская, 1", delivery_type="ordinary",
+                payment_type="online", status="оплачено", products=snapshot,
+            )
+        stats = build_recommendations(shard_size=1)
+        self.assertEqual(stats.groups, 2)
+        self.assertEqual(recommended_for(laptop.pk), [mouse])
+        self.assertEqual(recommended_for(mouse.pk), [laptop])
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "план запроса SQLite")
+class AdminTitleSearchTests(TestCase):
+    """
+    Поиск по префиксу названия в админке идет по индексу, а не перебором
+    """
+    def test_plan(self):
+        for model in (Product, Subcategory):
+            with self.subTest(model=model.__name__):
+                model_admin = admin.site._registry[model]
+                queryset, _ = model_admin.get_search_results(RequestFactory().get("/"), model.objects.all(), "Ноу")
+                sql, params = queryset.query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                    plan = " ".join(row[-1] for row in cursor.fetchall())
+                self.assertIn(f"USING INDEX {model._meta.db_table}_title_prefix", plan)
+
+
+class CatalogRowsTests(unittest.TestCase):
+    """
+    Распродажа в строке импорта проверяется при разборе файла,
+    а не ошибкой целостности при сохранении пачки
+    """
+    def csv_rows(self, **sale):
+        row = {field: "" for field in CSV_FIELDS}
+        row.update(title="Ноутбук", category="Компьютеры", subcategory="Ноутбуки", price="100", **sale)
+        content = io.StringIO()
+        writer = csv.DictWriter(content, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerow(row)
+        content.seek(0)
+        return list(read_rows(content, "csv"))
+
+    def test_csv_sale(self):
+        row, = self.csv_rows(sale_discount="10", sale_date_from="2024-03-01", sale_date_to="2024-03-05")
+        self.assertEqual(row["sale"], {
+            "discount": Decimal("10"),
+            "date_from": datetime.date(2024, 3, 1),
+            "date_to": datetime.date(2024, 3, 5),
+        })
+        row, = self.csv_rows()
+        self.assertIsNone(row["sale"])
+
+    def test_csv_invalid_sale(self):
+        cases = {
+            "без дат": {"sale_discount": "10"},
+            "без даты окончания": {"sale_discount": "10", "sale_date_from": "2024-03-01"},
+            "не дата": {"sale_discount": "10", "sale_date_from": "01.03.2024", "sale_date_to": "2024-03-05"},
+            "обратный период": {"sale_discount": "10", "sale_date_from": "2024-03-05", "sale_date_to": "2024-03-01"},
+            "отрицательная скидка": {"sale_discount": "-1", "sale_date_from": "2024-03-01", "sale_date_to": "2024-03-05"},
+        }
+        for name, sale in cases.items():
+            with self.subTest(name), self.assertRaisesRegex(CatalogRowError, "^строка 2: "):
+                self.csv_rows(**sale)
+
+    def test_jsonl_invalid_sale(self):
+        line = json.dumps({
+            "title": "Ноутбук", "category": "Компьютеры", "subcategory": "Ноутбуки",
+            "sale": {"discount": "10", "date_from": "2024-03-01", "date_to": None},
+        })
+        with self.assertRaisesRegex(CatalogRowError, "^строка 1: .*sale_date_to"):
+            list(read_rows(io.StringIO(line), "jsonl"))
+
+
+@override_settings(CACHES=TEST_CACHES, INVALIDATION={"ENABLED": False})
+class CatalogAPIViewTests(TestCase):
+    """
+    Ответ каталога с фасетами: содержимое фасетов, переключатель
+    facets=true и заголовок Server-Timing, в том числе из кеша ответов
+    """
+    def setUp(self):
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+        response_cache.clear_local()
+
+    def test_server_timing_cached(self):
+        make_product()
+        for _ in range(2):
+            response = self.client.get("/api/catalog", {"facets": "true"})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("facets", response.json())
+            self.assertRegex(response["Server-Timing"], r"^facets;dur=\d+\.\d$")
+
+    def test_facets_switch(self):
+        make_product()
+        response = self.client.get("/api/catalog")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("facets", response.json())
+        self.assertNotIn("Server-Timing", response)
+        for value in ("true", "1", "TRUE"):
+            with self.subTest(facets=value):
+                self.assertIn("facets", self.client.get("/api/catalog", {"facets": value}).json())
+        self.assertNotIn("facets", self.client.get("/api/catalog", {"facets": "no"}).json())
+
+    def test_facets_contents(self):
+        computers = Category.objects.create(title="Компьютеры")
+        phones = Category.objects.create(title="Телефоны")
+        new, hit = Tag.objects.create(name="Новинка", slug="new"), Tag.objects.create(name="Хит", slug="hit")
+        laptop = make_product("Ноутбук", "100.00", computers)
+        tablet = make_product("Планшет", "60.00", computers)
+        phone = make_product("Телефон", "30.00", phones)
+        make_product("Монитор", "500.00", computers)
+        Product.objects.update(free_delivery=False)
+        Product.objects.filter(pk=tablet.pk).update(count=0, free_delivery=True)
+        laptop.tags.add(new, hit)
+        tablet.tags.add(new)
+        phone.tags.add(hit)
+        # фасеты считаются по отфильтрованной выборке целиком, а не по странице
+        response = self.client.get(
+            "/api/catalog", {"facets": "true", "filter[maxPrice]": "200", "limit": "1"}
+        )
+        self.assertEqual(len(response.json()["items"]), 1)
+        facets = response.json()["facets"]
+        self.assertEqual(facets["total"], 3)
+        self.assertEqual(
+            {key: float(value) for key, value in facets["price"].items()}, {"min": 30.0, "max": 100.0}
+        )
+        self.assertEqual((facets["inStock"], facets["freeDelivery"]), (2, 1))
+        self.assertEqual(facets["categories"], [
+            {"id": computers.pk, "title": "Компьютеры", "count": 2},
+            {"id": phones.pk, "title": "Телефоны", "count": 1},
+        ])
+        self.assertEqual(facets["tags"], [
+            {"id": new.pk, "name": "Новинка", "count": 2},
+            {"id": hit.pk, "name": "Хит", "count": 2},
+        ])
+
+    def test_facets_sorted_by_reviews(self):
+        # аннотация Count("reviews") сортировки не должна попадать в фасеты
+        category = Category.objects.create(title="Компьютеры")
+        tag = Tag.objects.create(name="Новинка", slug="new")
+        reviewed = make_product("С отзывами", "100.00", category)
+        plain = make_product("Без отзывов", "50.00", category)
+        for product in (reviewed, plain):
+            product.tags.add(tag)
+        user = User.objects.create_user("reviewer", password="secret")
+        author = UserProfile.objects.create(
+            user=user, name="Иван", surname="Иванов", patronymic="Иванович",
+            phone="+70000000000", email="reviewer@example.com", avatar="avatar_default.png",
+        )
+        for rate in (3, 4, 5):
+            Review.objects.create(product=reviewed, author=author, text="", rate=rate)
+        for sort in ("id", "reviews"):
+            with self.subTest(sort=sort):
+                facets = self.client.get("/api/catalog", {"facets": "true", "sort": sort}).json()["facets"]
+                self.assertEqual(facets["total"], 2)
+                self.assertEqual(facets["categories"], [{"id": category.pk, "title": "Компьютеры", "count": 2}])
+                self.assertEqual(facets["tags"], [{"id": tag.pk, "name": "Новинка", "count": 2}])
+
+    def test_non_ascii_digit_tag(self):
+        make_product()
+        self.assertEqual(tags.tag_ids(["²", "٣"]), [tags.UNKNOWN_TAG_ID, tags.UNKNOWN_TAG_ID])
+        response = self.client.get("/api/catalog", {"tags[]": "²"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["items"], [])
+
+    def test_too_large_ids(self):
+        huge = "99999999999999999999999"
+        for params in ({"category": huge}, {"tags[]": huge}, {"currentPage": huge}):
+            with self.subTest(params=params):
+                response = self.client.get("/api/catalog", params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+        self.assertEqual(self.client.get("/api/catalog", {"category": str(2 ** 63 - 1)}).status_code, 200)
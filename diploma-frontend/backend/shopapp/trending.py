@@ -0,0 +1,276 @@
+"""
+Просмотры товаров: списки "сейчас смотрят" и "вы смотрели".
+
+Запись строки на каждый просмотр нагружала бы БД, поэтому просмотры
+копятся в памяти процесса (Collector) и записываются сводно: число
+просмотров каждого товара за интервал. Запись выполняет фоновый поток
+раз в FLUSH_INTERVAL секунд, сразу после накопления FLUSH_SIZE просмотров
+и при выходе процесса. Просмотры, не записанные до аварийного завершения
+воркера, теряются - для рейтинга это допустимо.
+
+Рейтинг затухает: просмотр t секунд назад весит 2 ** (-t / HALF_LIFE).
+Чтобы не пересчитывать со временем рейтинги всех товаров, хранится
+логарифм суммы весов, отсчитанных от постоянной точки EPOCH:
+score = ln(sum(n * 2 ** ((t - EPOCH) / HALF_LIFE))). Записанные значения
+не меняются, а порядок товаров по score совпадает с порядком по
+затухающему рейтингу на любой момент, так что "сейчас смотрят" - один
+запрос по индексу score. Новые просмотры добавляются атомарным UPDATE
+score = ln(exp(score) + exp(added)), одним на товары с равным числом
+просмотров.
+
+"Вы смотрели" - последние RECENT_LIMIT товаров пользователя или сессии
+в кеше CACHES[ALIAS], без записи в БД.
+"""
+import atexit
+import datetime
+import functools
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from api import metrics
+
+from .models import Product, ProductViews
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRENDING = {
+    "ENABLED": True,
+    "FLUSH_INTERVAL": 10,
+    # столько просмотров в буфере запускают запись, не дожидаясь интервала
+    "FLUSH_SIZE": 1000,
+    # через сколько секунд вес просмотра уменьшается вдвое
+    "HALF_LIFE": 6 * 60 * 60,
+    "LIMIT": 8,
+    # кеш списков "вы смотрели"
+    "ALIAS": "default",
+    "RECENT_LIMIT": 20,
+    "RECENT_TIMEOUT": 30 * 24 * 60 * 60,
+}
+
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+# score товара без просмотров: ln(0)
+NO_SCORE = -1e9
+BATCH_SIZE = 500
+
+_config = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        _config = {**DEFAULT_TRENDING, **getattr(settings, "TRENDING", {})}
+    return _config
+
+
+def _reset_config(setting, **kwargs):
+    global _config
+    if setting == "TRENDING":
+        _config = None
+
+
+setting_changed.connect(_reset_config)
+
+
+def _score_value(count, now):
+    """
+    ln(count * 2 ** ((now - EPOCH) / HALF_LIFE))
+    """
+    offset = (now.timestamp() - EPOCH) / get_config()["HALF_LIFE"] * math.log(2)
+    return Value(math.log(count) + offset, output_field=FloatField())
+
+
+def write_views(counts, now=None):
+    """
+    Добавляет просмотры counts ({id товара: число}) к счетчикам и рейтингам.
+    Возвращает число записанных товаров.
+    """
+    now = now or timezone.now()
+    # товар могли удалить, пока просмотры лежали в буфере; строки
+    # просмотров создаются только для товаров, у которых их еще нет
+    existing, missing = set(), []
+    ids = list(counts)
+    for i in range(0, len(ids), BATCH_SIZE):
+        rows = Product.objects.filter(pk__in=ids[i:i + BATCH_SIZE]).values_list("pk", "view_stats__product_id")
+        for product_id, views_id in rows:
+            existing.add(product_id)
+            if views_id is None:
+                missing.append(product_id)
+
+    by_count = defaultdict(list)
+    for product_id in existing:
+        by_count[counts[product_id]].append(product_id)
+    with transaction.atomic():
+        # строку мог создать другой процесс: ее просмотры добавит UPDATE
+        ProductViews.objects.bulk_create(
+            [ProductViews(product_id=product_id, score=NO_SCORE, viewed_at=now) for product_id in missing],
+            ignore_conflicts=True,
+            batch_size=BATCH_SIZE,
+        )
+        for count, product_ids in by_count.items():
+            added = _score_value(count, now)
+            for i in range(0, len(product_ids), BATCH_SIZE):
+                ProductViews.objects.filter(product_id__in=product_ids[i:i + BATCH_SIZE]).update(
+                    views=F("views") + count,
+                    score=Greatest(F("score"), added) + Ln(
+                        Value(1.0, output_field=FloatField()) + Exp(-Abs(F("score") - added))
+                    ),
+                    viewed_at=now,
+                )
+    return len(existing)
+
+
+class Collector:
+    """
+    Буфер просмотров процесса с фоновой записью
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.events = 0
+        # записи и их суммарное время, для замеров
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def record(self, product_id):
+        with self.lock:
+            self.counts[product_id] += 1
+            self.events += 1
+            full = self.events >= get_config()["FLUSH_SIZE"]
+        self._start()
+        if full:
+            self.wakeup.set()
+
+    def pending(self):
+        with self.lock:
+            return self.events
+
+    def flush(self):
+        """
+        Записывает накопленные просмотры; при ошибке БД они возвращаются
+        в буфер до следующей записи. Возвращает число записанных товаров.
+        """
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            events, self.events = self.events, 0
+        if not counts:
+            return 0
+        started = time.perf_counter()
+        try:
+            written = write_views(counts)
+        except DatabaseError:
+            with self.lock:
+                self.counts.update(counts)
+                self.events += events
+            raise
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.flush_seconds += elapsed
+        metrics.observe("shop_product_views_flush_seconds", elapsed)
+        return written
+
+    def _start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.thread_lock:
+            # после fork потока родителя в воркере нет
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="product-views", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(get_config()["FLUSH_INTERVAL"])
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Не удалось записать просмотры товаров")
+            finally:
+                close_old_connections()
+
+
+collector = Collector()
+
+
+def _flush_at_exit():
+    try:
+        collector.flush()
+    except Exception:
+        logger.exception("Не удалось записать просмотры товаров при выходе")
+
+
+atexit.register(_flush_at_exit)
+
+
+def _recent_key(request):
+    if request.user.is_authenticated:
+        return f"recent:user:{request.user.pk}"
+    # у анонимного посетителя без сессии списка нет
+    session_key = request.session.session_key
+    return f"recent:session:{session_key}" if session_key else None
+
+
+def remember_view(request, product_id):
+    key = _recent_key(request)
+    if key is None:
+        return
+    config = get_config()
+    cache = caches[config["ALIAS"]]
+    ids = [pk for pk in cache.get(key, []) if pk != product_id]
+    cache.set(key, [product_id, *ids][:config["RECENT_LIMIT"]], config["RECENT_TIMEOUT"])
+
+
+def record_view(request, product_id):
+    if not get_config()["ENABLED"]:
+        return
+    collector.record(product_id)
+    remember_view(request, product_id)
+    metrics.inc("shop_product_views_total")
+
+
+def track_views(handler):
+    """
+    Декоратор retrieve вьюхи товара: успешный ответ учитывается как
+    просмотр. Ставится над cache_response, чтобы учитывать и ответы из кеша.
+    """
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        response = handler(view, request, *args, **kwargs)
+        if response.status_code == 200:
+            record_view(request, int(view.kwargs[view.lookup_url_kwarg]))
+        return response
+    return wrapper
+
+
+def trending(limit=None):
+    """
+    Товары с наибольшим затухающим рейтингом просмотров, один запрос по индексу
+    """
+    rows = ProductViews.objects.select_related("product").order_by("-score")
+    return [row.product for row in rows[:limit or get_config()["LIMIT"]]]
+
+
+def recently_viewed(request):
+    """
+    Последние просмотренные товары пользователя или сессии, новые первыми
+    """
+    key = _recent_key(request)
+    if key is None:
+        return []
+    ids = caches[get_config()["ALIAS"]].get(key, [])
+    products = Product.objects.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
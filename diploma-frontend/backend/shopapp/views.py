@@ -1,16 +1,24 @@
 import datetime
+import logging
+import time
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.paginator import Paginator
-from django.http import JsonResponse, HttpResponse
+from django.db import transaction
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django_filters.rest_framework import DjangoFilterBackend
+from django.utils import timezone
 
 from rest_framework.generics import ListAPIView, RetrieveAPIView
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.filters import OrderingFilter
+
+from api import metrics
+from api.idempotency import idempotent
+from api.response_cache import cache_response
+from api.throttling import BasketThrottle, ReviewThrottle
 
 from .models import (
     Category,
@@ -21,17 +29,29 @@ from .models import (
     BasketItem,
     Order,
     Payment,
-    DeliveryPrices,
+    ArchivedOrder,
+    OrderLine,
+)
+from .catalog import (
+    CatalogQueryError,
+    filter_catalog_queryset,
+    get_catalog_page,
+    get_facets,
+    parse_catalog_params,
+    parse_page,
 )
+from . import rollups, tags, trending
+from .reports import ReportError, build_report, stream_rows
+from .shop_config import ShopConfigMissing, get_shop_config
 from .serializers import (
     ProductSerializer,
     DetailsSerializer,
     TagSerializer,
     BasketItemSerializer, OrderSerializer,
-
+    ArchivedOrderSerializer,
 )
 
-from myauth.models import UserProfile
+logger = logging.getLogger(__name__)
 
 
 class CategoryAPIView(APIView):
@@ -40,6 +60,7 @@ class CategoryAPIView(APIView):
     на кнопку "All Departments"
     """
 
+    @cache_response("categories", tags=("categories",), timeout=600)
     def get(self, request):
         categories = Category.objects.all()
         categories_data = []
@@ -63,15 +84,32 @@ class CategoryAPIView(APIView):
         return JsonResponse(categories_data, safe=False)
 
 
+def _with_fallback(product_ids, fallback, limit):
+    """
+    Товары в порядке product_ids, дополненные до limit товарами из fallback
+    """
+    products = Product.objects.in_bulk(product_ids)
+    result = [products[pk] for pk in product_ids if pk in products]
+    if len(result) < limit:
+        result += list(fallback.exclude(pk__in=product_ids)[:limit - len(result)])
+    return result
+
+
 class BannerListAPIView(ListAPIView):
     """
-    Класс, отвечающий за вывод трех баннеров с продуктов с самым высоким рейтингом
+    Класс, отвечающий за вывод трех баннеров: самые продаваемые за месяц товары
+    по дневным сводкам, при нехватке - товары с самым высоким рейтингом
     """
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return Product.objects.filter(rating__gt=0).order_by('-rating')[:3]
+        return _with_fallback(
+            rollups.top_product_ids(days=30, limit=3),
+            Product.objects.filter(rating__gt=0).order_by('-rating'),
+            3,
+        )
 
+    @cache_response("banners", tags=("products", "rollups"))
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
         serializer = self.get_serializer(queryset, many=True)
@@ -82,8 +120,14 @@ class PopularListAPIView(ListAPIView):
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return Product.objects.filter(tags__name__in=['popular'])[:8]
-
+        # самые продаваемые за месяц, затем отмеченные тегом popular
+        return _with_fallback(
+            rollups.top_product_ids(days=30, limit=8),
+            tags.tagged(Product.objects.all(), 'popular'),
+            8,
+        )
+
+    @cache_response("popular", tags=("products", "rollups"))
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
         serializer = self.get_serializer(queryset, many=True)
@@ -94,88 +138,89 @@ class LimitedListAPIView(ListAPIView):
     serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return Product.objects.filter(tags__name__in=['limited'])[:16]
+        return tags.tagged(Product.objects.all(), 'limited')[:16]
 
+    @cache_response("limited", tags=("products",))
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
 
+class TrendingListAPIView(ListAPIView):
+    """
+    Товары, которые сейчас чаще всего смотрят (shopapp.trending)
+    """
+    serializer_class = ProductSerializer
+
+    def get_queryset(self):
+        return trending.trending()
+
+    # рейтинги меняются при каждой записи просмотров, раз в FLUSH_INTERVAL
+    @cache_response("trending", tags=("products",), timeout=10)
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+
+class RecentlyViewedListAPIView(ListAPIView):
+    """
+    Товары, которые пользователь недавно смотрел, новые первыми
+    """
+    serializer_class = ProductSerializer
+
+    def get_queryset(self):
+        return trending.recently_viewed(self.request)
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        return Response(serializer.data)
+
+
 class ProductDetailsRetrieveAPIView(RetrieveAPIView):
     queryset = Product.objects.all()
     serializer_class = DetailsSerializer
     lookup_url_kwarg = "id"
 
+    @trending.track_views
+    @cache_response("product", tags=("products", "recommendations"))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class CatalogAPIView(APIView):
     """
     Класс отвечающий за вывод каталога товаров с фильтрацией и сортировкой.
+    Параметры запроса разбираются и проверяются в shopapp.catalog,
+    неизвестная сортировка или некорректные значения дают ответ 400.
     """
-    filter_backends = [DjangoFilterBackend, OrderingFilter]
-    filterset_fields = {
-        'category': ['exact'],      # точное соответствие
-        'price': ['gte', 'lte'],    # диапазон от "больше или равно" до "меньше или равно"
-        'freeDelivery': ['exact'],  # точное соответствие
-        'count': ['gt'],             # больше
-        'title': ['icontains'],      # содержит (неточное определение)
-        'tags__name': ['exact'],     # точное соответствие
-    }
-    ordering_fields = [
-        'id',
-        'category__id',
-        'price',
-        'count',
-        'date',
-        'title',
-        'freeDelivery',
-        'rating',
-    ]
-
-    def filter_queryset(self, products):
-        category_id = self.request.GET.get('category')
-        min_price = float(self.request.GET.get('filter[minPrice]', 0))
-        max_price = float(self.request.GET.get('filter[maxPrice]', float('inf')))
-        free_delivery = self.request.GET.get('filter[freeDelivery]', '').lower() == 'true'
-        available = self.request.GET.get('filter[available]', '').lower() == 'true'
-        name = self.request.GET.get('filter[name]', '').strip()
-        tags = self.request.GET.getlist('tags[]')
-        sort_field = self.request.GET.get('sort', 'id')
-        sort_type = self.request.GET.get('sortType', 'inc')
-
-        if category_id:
-            products = products.filter(category__id=category_id)
-        products = products.filter(price__gte=min_price, price__lte=max_price)
-        if free_delivery:
-            products = products.filter(freeDelivery=True)
-        if available:
-            products = products.filter(count__gt=0)
-        if name:
-            products = products.filter(title__icontains=name)
-        for tag in tags:
-            products = products.filter(tags__name=tag)
-        if sort_type == 'inc':
-            products = products.order_by(sort_field)
-        else:
-            products = products.order_by('-' + sort_field)
-
-        return products
 
+    @cache_response("catalog", tags=("products", "tags", "categories"))
     def get(self, request):
-        products = Product.objects.all()
-        filtered_products = self.filter_queryset(products)
-        page_number = int(request.GET.get('currentPage', 1))
-        limit = int(request.GET.get('limit', 20))
-        paginator = Paginator(filtered_products, limit)
-        page = paginator.get_page(page_number)
+        try:
+            params = parse_catalog_params(request.GET)
+            page_number, limit = parse_page(request.GET)
+        except CatalogQueryError as exc:
+            return Response({"error": str(exc)}, status=400)
+        page = get_catalog_page(params, page_number, limit)
         products_list = []
-        for product in page:
+        for product in page.products:
             products_list.append(ProductSerializer(product).data)
         catalog_data = {
             "items": products_list,
-            "currentPage": page_number,
-            "lastPage": paginator.num_pages
+            "currentPage": page.current_page,
+            "lastPage": page.last_page
         }
+        # фасеты считаются только по запросу ?facets=true, время их расчета
+        # возвращается в заголовке Server-Timing
+        if request.GET.get('facets', '').lower() in ('true', '1'):
+            started = time.perf_counter()
+            catalog_data["facets"] = get_facets(filter_catalog_queryset(params))
+            duration = (time.perf_counter() - started) * 1000
+            response = Response(catalog_data)
+            response["Server-Timing"] = f"facets;dur={duration:.1f}"
+            return response
         return Response(catalog_data)
 
 
@@ -183,9 +228,11 @@ class ProductReviewAPIView(ProductDetailsRetrieveAPIView):
     """
     Класс, обрабатывающий оставление пользователями отзывов о товаре
     """
+    throttle_classes = [ReviewThrottle]
+
     def post(self, request, **kwargs):
         if request.user.is_authenticated:
-            profile = UserProfile.objects.get(user=request.user)
+            profile = request.profile
             product = Product.objects.get(pk=kwargs['id'])
             author = profile
             text = request.data['text']
@@ -209,8 +256,9 @@ class TagListAPIView(ListAPIView):
     serializer_class = TagSerializer
 
     def get_queryset(self):
-        return Tag.objects.all().distinct()
+        return Tag.objects.order_by("name")
 
+    @cache_response("tags", tags=("tags",))
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
         serializer = self.get_serializer(queryset, many=True)
@@ -219,15 +267,22 @@ class TagListAPIView(ListAPIView):
 
 class SalesListAPIView(APIView):
     """
-    Класс обрабатывающий товары, попадающие под распродажу
+    Класс обрабатывающий товары, попадающие под распродажу: только
+    распродажи, действующие сегодня, цена со скидкой - Product.effective_price
     """
+    @cache_response("sales", tags=("sales",))
     def get(self, request):
         page_number = int(request.GET.get('currentPage', 1))
         limit = int(request.GET.get('limit', 20))
-        obj_list = []
-        for obj in Sale.objects.all():
-            obj_list.append(obj)
-        paginator = Paginator(obj_list, limit)
+        today = timezone.localdate()
+        sales = (
+            Sale.objects
+            .filter(date_from__lte=today, date_to__gte=today)
+            .select_related("product")
+            .prefetch_related("product__images")
+            .order_by("pk")
+        )
+        paginator = Paginator(sales, limit)
         page = paginator.get_page(page_number)
         serialized_data = []
 
@@ -235,7 +290,7 @@ class SalesListAPIView(APIView):
             serialized_data.append({
                 "id": sale.product.id,
                 "price": sale.product.price,
-                "salePrice": sale.product.price - sale.discount,
+                "salePrice": sale.product.effective_price,
                 "dateFrom": sale.date_from,
                 "dateTo": sale.date_to,
                 "title": sale.product.title,
@@ -245,7 +300,7 @@ class SalesListAPIView(APIView):
                         "alt": sale.product.title,
                     }
                     for image in
-                    sale.product.images.all()],
+                    sale.product.images.all() if image.image],
             })
         response_data = {
             "items": serialized_data,
@@ -260,6 +315,8 @@ class BasketItemsAPIView(APIView):
     Класс, отвечающий за чтение, добавление и удаление данных о
     товарах в корзине
     """
+    throttle_classes = [BasketThrottle]
+
     def get(self, request):
         """
         Вывод информации о товарах в корзине
@@ -298,6 +355,10 @@ class BasketItemsAPIView(APIView):
         if not created and (product.count - basket_item.quantity) != 0:
             basket_item.quantity += count
             basket_item.save()
+        elif not created:
+            # в корзине уже весь товар, что есть в наличии
+            metrics.inc("shop_stock_outs_total", source="basket")
+        metrics.inc("shop_basket_operations_total", operation="add")
 
         # получаем обновленные данные корзины, передаем в сериализатор
         # где они обрабатываются и возвращаются для отображения на страничке
@@ -325,6 +386,7 @@ class BasketItemsAPIView(APIView):
                 basket_item.save()
             else:
                 basket_item.delete()
+            metrics.inc("shop_basket_operations_total", operation="remove")
 
             # получаем обновленные данные корзины, передаем в сериализатор
             # где они обрабатываются и возвращаются для отображения на страничке
@@ -339,72 +401,100 @@ class BasketItemsAPIView(APIView):
 class OrdersAPIView(APIView):
     """
     Класс обрабатывающий создание заказа. Вывод истории заказов.
+    Заказы пользователя выбираются по индексу (full_name, archived, created_at).
     """
+    permission_classes = [IsAuthenticated, ]
+
     def get(self, request):
         """
-        Данный метод отвечает за вывод истории заказов в меню профиля пользователя
+        Данный метод отвечает за вывод истории заказов в меню профиля пользователя:
+        сначала закрытые заказы из таблицы Order, затем заказы из холодного архива
         """
-        orders = Order.objects.filter(archived=True)
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
-
+        profile = request.profile
+        orders = Order.objects.filter(full_name=profile, archived=True).order_by("-created_at")
+        archived_orders = ArchivedOrder.objects.filter(full_name=profile).order_by("-created_at")
+        # все заказы принадлежат пользователю, профиль не загружается для каждого
+        context = {"profile": profile}
+        data = OrderSerializer(orders, many=True, context=context).data
+        data += ArchivedOrderSerializer(archived_orders, many=True, context=context).data
+        return Response(data)
+
+    @idempotent("orders")
     def post(self, request):
         """
         Создается заказ из находящихся в корзине товаров, либо передается номер
         незакрытого заказа, для завершения оформления.
         """
         try:
-            # Необходимо перед первым вызовом DeliveryPrices создать объект
-            # delivery_price в админке и назначить стоимость доставки, иначе будет ошибка
-            delivery_price = DeliveryPrices.objects.get(id=1)
+            # стоимость доставки задается в админке (shopapp.shop_config)
+            shop_config = get_shop_config()
             basket = request.user.basket
-            profile = UserProfile.objects.get(user=request.user)
+            profile = request.profile
             basket_items = BasketItem.objects.filter(basket__user=request.user)
             total_cost = 0
             # Проверим, есть ли у нас незакрытые заказы, если нет то создадим новый
-            active_order = Order.objects.filter(archived=False)
-            if not active_order:
+            active_order = (
+                Order.objects
+                .filter(full_name=profile, archived=False)
+                .order_by("-created_at")
+                .first()
+            )
+            if active_order is None:
                 order = Order.objects.create(full_name=profile, basket=basket)
-                for item in basket_items:
-                    product = Product.objects.get(pk=item.product.pk)
-                    product.count_of_orders = item.quantity
+                order.products.set([item.product_id for item in basket_items])
+                for item in basket_items.select_related("product"):
+                    # счетчик в каталоге не виден: UPDATE без сигналов, чтобы
+                    # оформление заказа не сбрасывало кеш каталога
+                    Product.objects.filter(pk=item.product_id).update(count_of_orders=item.quantity)
                     total_cost += item.product.price * item.quantity
-                    product.save()
-                if total_cost > delivery_price.delivery_free_minimum_cost:
-                    order.total_cost = total_cost
-                else:
-                    order.total_cost = total_cost + delivery_price.delivery_cost
+                order.total_cost = total_cost + shop_config.delivery_for(total_cost)
                 order.save()
+                metrics.inc("shop_orders_created_total")
                 response_data = {"orderId": order.pk}
                 return JsonResponse(response_data)
             else:
                 # если был незавершенный заказ, то завершим его
-                return JsonResponse({"orderId": active_order[0].pk})
+                return JsonResponse({"orderId": active_order.pk})
         except Basket.DoesNotExist:
             error_data = {"error": "У данного пользователя пока нет 'корзины'"}
             return JsonResponse(error_data)
+        except ShopConfigMissing as exc:
+            return Response({"error": str(exc)}, status=503)
 
 
 class OrderRegistrationAPIView(APIView):
     """
     Класс, обрабатывающий оформление заказа. Доставка. Оплата.
+    Пользователю доступны только его заказы, чужой заказ - 404.
     """
-    def get(self, request, order_id):
-        order = Order.objects.get(pk=order_id)
-        serializer = OrderSerializer(order)
-        return Response(serializer.data)
+    permission_classes = [IsAuthenticated, ]
 
+    def get(self, request, order_id):
+        order = Order.objects.filter(pk=order_id, full_name=request.profile).first()
+        if order is not None:
+            return Response(OrderSerializer(order).data)
+        # заказ мог быть перенесен в холодный архив командой archive_orders
+        archived_order = get_object_or_404(ArchivedOrder, order_id=order_id, full_name=request.profile)
+        return Response(ArchivedOrderSerializer(archived_order).data)
+
+    @idempotent("order")
     def post(self, request, order_id):
-        order = get_object_or_404(Order, id=order_id)
+        order = get_object_or_404(Order, id=order_id, full_name=request.profile)
         delivery_type = request.data["deliveryType"]
         payment_type = request.data["paymentType"]
         city = request.data["city"]
         address = request.data["address"]
         status_order = "подтвержден"
-        print(delivery_type)
+        logger.info(
+            "Оформление заказа %s", order_id,
+            extra={"order_id": order_id, "delivery_type": delivery_type, "payment_type": payment_type},
+        )
         if delivery_type == "express":
-            delivery_price = DeliveryPrices.objects.get(id=1)
-            order.total_cost += delivery_price.delivery_express_cost
+            try:
+                shop_config = get_shop_config()
+            except ShopConfigMissing as exc:
+                return Response({"error": str(exc)}, status=503)
+            order.total_cost += shop_config.delivery_express_cost
             order.save()
 
         order.delivery_type = delivery_type
@@ -419,9 +509,13 @@ class OrderRegistrationAPIView(APIView):
 
 class PaymentAPIView(APIView):
     """
-    Класс, отвечающий за оплату заказа
+    Класс, отвечающий за оплату заказа пользователя
     """
+    permission_classes = [IsAuthenticated, ]
+
+    @idempotent("payment")
     def post(self, request, order_id):
+        order = get_object_or_404(Order, id=order_id, full_name=request.profile)
         data = request.data
         card_number = data['number']
         expiration_month = data['month']
@@ -432,31 +526,88 @@ class PaymentAPIView(APIView):
         if int(expiration_year) < current_year or (
                 int(expiration_year == current_year) and
                 int(expiration_month) < datetime.datetime.now().month):
-            order = Order.objects.get(id=order_id)
             order.payment_error = "Payment expired"
-            order.save()
-            print("payment expired")
+            order.save(update_fields=["payment_error"])
+            metrics.inc("shop_payments_total", result="failed", reason="expired")
+            logger.warning(
+                "Оплата заказа %s отклонена: истек срок действия карты", order_id,
+                extra={"order_id": order_id},
+            )
             return JsonResponse({"error": "Payment expired"})
 
         # номер должен быть чётным и не длиннее восьми цифр
         if not (len(card_number.strip()) <= 8 and int(card_number) % 2 == 0):
-            print("card number invalid")
+            metrics.inc("shop_payments_total", result="failed", reason="invalid-card")
+            logger.warning(
+                "Оплата заказа %s отклонена: неверный номер карты", order_id,
+                extra={"order_id": order_id},
+            )
             return JsonResponse({"error": "Неверный номер банковской карты"})
         res_date = f"{expiration_month}.{expiration_year}"
-        order = Order.objects.get(id=order_id)
-        payment = Payment.objects.create(order=order, card_number=card_number, validity_period=res_date)
-        order.status = 'оплачено'
-        order.archived = True
-        order.save()
-        # заказ оплачен
-        # можно очистить корзину
-        basket = Basket.objects.get(user=request.user)
-        basket_items = BasketItem.objects.filter(basket=basket)
-        for basket_item in basket_items:
-            product = Product.objects.get(pk=basket_item.product.pk)
-            product.count -= basket_item.quantity
-            payment.success = True
-            payment.save()
-        basket_items.delete()
+        with transaction.atomic():
+            payment = Payment.objects.create(order=order, card_number=card_number, validity_period=res_date)
+            order.status = 'оплачено'
+            order.archived = True
+            # rollup_applied не перезаписываем: заказ мог быть учтен в сводках
+            # после того, как этот запрос его прочитал
+            order.save(update_fields=["status", "archived"])
+            # заказ оплачен
+            # позиции корзины сохраняем в заказе для сводок продаж и очищаем корзину
+            basket = Basket.objects.get(user=request.user)
+            basket_items = BasketItem.objects.filter(basket=basket).select_related('product')
+            OrderLine.objects.bulk_create([
+                OrderLine(
+                    order=order,
+                    product=basket_item.product,
+                    quantity=basket_item.quantity,
+                    price=basket_item.product.price,
+                )
+                for basket_item in basket_items
+            ])
+            for basket_item in basket_items:
+                product = basket_item.product
+                product.count -= basket_item.quantity
+                if product.count <= 0:
+                    metrics.inc("shop_stock_outs_total", source="payment")
+                payment.success = True
+                payment.save()
+            basket_items.delete()
+            rollups.schedule_update()
+        metrics.inc("shop_payments_total", result="succeeded")
+        logger.info(
+            "Заказ %s оплачен", order_id,
+            extra={"order_id": order_id, "payment_id": payment.pk, "success": payment.success},
+        )
         return HttpResponse(status=200)
 
+
+class SalesReportAPIView(APIView):
+    """
+    Класс, отдающий администраторам отчеты по заказам и продажам
+    за период dateFrom - dateTo (YYYY-MM-DD) в формате output=csv|jsonl.
+    Ответ формируется потоком, расход памяти не зависит от числа заказов.
+    """
+    permission_classes = [IsAdminUser, ]
+
+    def get(self, request, report):
+        output = request.GET.get("output", "csv")
+        try:
+            date_from = datetime.date.fromisoformat(request.GET["dateFrom"])
+            date_to = datetime.date.fromisoformat(request.GET["dateTo"])
+        except (KeyError, ValueError):
+            return Response({"error": "Укажите dateFrom и dateTo в формате YYYY-MM-DD"}, status=400)
+        if output not in ("csv", "jsonl"):
+            return Response({"error": "output должен быть csv или jsonl"}, status=400)
+        try:
+            fields, rows = build_report(report, date_from, date_to)
+        except ReportError as exc:
+            return Response({"error": str(exc)}, status=400)
+
+        content_type = "text/csv" if output == "csv" else "application/x-ndjson"
+        response = StreamingHttpResponse(
+            stream_rows(fields, rows, output), content_type=f"{content_type}; charset=utf-8"
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{report}_{date_from}_{date_to}.{output}"'
+        )
+        return response
@@ -1,4 +1,6 @@
 const { createApp } = Vue
+// последние ключи идемпотентности операций: { операция: { body, key } }
+const idempotencyKeys = {}
 createApp({
 	delimiters: ['${', '}$'],
 	mixins: [window.mix ? window.mix : {}],
@@ -40,6 +42,18 @@ createApp({
 					throw new Error()
 				})
 		},
+		idempotencyKey(operation, payload) {
+			// ключ повторяется, пока повторяется та же операция с теми же данными:
+			// повторная отправка не выполнит ее дважды
+			const body = JSON.stringify(payload)
+			const last = idempotencyKeys[operation]
+			if (last && last.body === body) return last.key
+			const key = window.crypto?.randomUUID
+				? window.crypto.randomUUID()
+				: `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+			idempotencyKeys[operation] = { body, key }
+			return key
+		},
 		getData(url, payload) {
 			return axios
 				.get(url, { params: payload })
@@ -1,7 +1,10 @@
 var mix = {
     methods: {
         submitBasket () {
-            this.postData('/api/orders', Object.values(this.basket))
+            const payload = Object.values(this.basket)
+            this.postData('/api/orders', payload, {
+                'Idempotency-Key': this.idempotencyKey('orders', payload),
+            })
                 .then(({data: { orderId }}) => {
                     location.assign(`/orders/${orderId}/`)
                 }).catch(() => {
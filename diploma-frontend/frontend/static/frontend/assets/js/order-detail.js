@@ -24,7 +24,10 @@ var mix = {
 		},
 		confirmOrder() {
 			if (this.orderId !== null) {
-				this.postData(`/api/order/${this.orderId}`, { ...this })
+				const payload = { ...this }
+				this.postData(`/api/order/${this.orderId}`, payload, {
+					'Idempotency-Key': this.idempotencyKey(`order:${this.orderId}`, payload),
+				})
 					.then(({ data: { orderId } }) => {
 						alert('Заказ подтвержден')
 						location.replace(`/payment/${orderId}/`)
@@ -11,12 +11,15 @@ var mix = {
 				month: this.month,
 				code: this.code,
 			})
-			this.postData(`/api/payment/${orderId}`, {
+			const payload = {
 				name: this.name,
 				number: this.number1,
 				year: this.year,
 				month: this.month,
 				code: this.code
+			}
+			this.postData(`/api/payment/${orderId}`, payload, {
+				'Idempotency-Key': this.idempotencyKey(`payment:${orderId}`, payload),
 			}).then(() => {
 				alert('Успешная оплата')
 				this.number1 = ''